@@ -0,0 +1,155 @@
+"""Runtime library of the protocol templates.
+
+Helpers shared by the protocols, inlined by protocol-compiler.py into each compiled protocol in place of
+{{RUNTIME_LIBRARY}}: only the definitions used by the template, and the imports they need, are copied,
+so compiled protocols stay self-contained files for the OT-2.
+"""
+
+import json
+import os
+import time
+from itertools import groupby
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from opentrons import protocol_api
+
+def setup_pipettes(protocol: protocol_api.ProtocolContext, params: Dict[str, Any]) -> Dict[str, protocol_api.InstrumentContext]:
+    """Load the pipettes of the parameters with their tip racks, by mount: the pipette of pipette_mount,
+    or the pipette of each mount named in <mount>_pipette_name."""
+    if "pipette_name" in params:
+        mounts = {params["pipette_mount"]: (params["pipette_name"], params["tiprack_name"], params["tiprack_slots"])}
+    else:
+        mounts = {side: (params[f"{side}_pipette_name"], params[f"{side}_pipette_tiprack_name"], params[f"{side}_pipette_tiprack_slot"])
+                  for side in ["right", "left"] if params[f"{side}_pipette_name"] != "NA"}
+    loaded_pipettes = {}
+    for mount, (pipette_name, tiprack_name, tiprack_slots) in mounts.items():
+        tip_racks = [protocol.load_labware(tiprack_name, slot) for slot in tiprack_slots]
+        loaded_pipettes[mount] = protocol.load_instrument(pipette_name, mount=mount, tip_racks=tip_racks)
+    return loaded_pipettes
+
+class Deck:
+    """Labware loaded on each deck slot or on the thermocycler, with their well lookups built once."""
+    __slots__ = ("protocol", "labware", "wells", "thermocycler")
+
+    def __init__(self, protocol: protocol_api.ProtocolContext):
+        self.protocol = protocol
+        self.labware = {}
+        self.wells = {}
+        self.thermocycler = None
+
+    def load(self, name: str, slot: Any, label: Optional[str] = None) -> Dict[str, protocol_api.Well]:
+        """Load a labware on a slot, or on the thermocycler, reusing the labware already loaded there, and return its wells by name."""
+        slot = slot if slot == "thermocycler" else int(slot)
+        if slot not in self.labware:
+            if slot == "thermocycler":
+                self.thermocycler = self.protocol.load_module("thermocycler")
+                self.labware[slot] = self.thermocycler.load_labware(name)
+            else:
+                self.labware[slot] = self.protocol.load_labware(name, slot, label=label)
+            self.wells[slot] = self.labware[slot].wells_by_name()
+        return self.wells[slot]
+
+def step_passes(step: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the 8-channel and single-channel passes of a step, each with its pipette mount and transfers."""
+    return [step] + ([step["single_channel"]] if "single_channel" in step else [])
+
+def transfer_lists(transfers: Sequence[Tuple], sources: Dict[str, protocol_api.Well],
+                   destinations: Dict[str, protocol_api.Well]) -> Tuple[List[protocol_api.Well], List[float], List[protocol_api.Well]]:
+    """Return the source wells, volumes and destination wells of (source well, volume, destination well) transfers,
+    as arguments of InstrumentContext.transfer and distribute."""
+    return ([sources[transfer[0]] for transfer in transfers], [transfer[1] for transfer in transfers],
+            [destinations[transfer[2]] for transfer in transfers])
+
+def distribute_media(pipette: protocol_api.InstrumentContext, transfers: Sequence[Tuple], sources: Dict[str, protocol_api.Well],
+                     destinations: Dict[str, protocol_api.Well], multi_dispense: bool) -> None:
+    """Transfer media with a single tip, multi-dispensing if set: one aspiration then serves all the destination wells
+    of a media well that fit in the tip."""
+    if multi_dispense:
+        pipette.pick_up_tip()
+        for media_well, well_transfers in groupby(transfers, key=lambda transfer: transfer[0]):
+            _, volumes, destination_wells = transfer_lists(list(well_transfers), sources, destinations)
+            pipette.distribute(volume=volumes, source=sources[media_well], dest=destination_wells, disposal_volume=0, new_tip="never")
+        pipette.drop_tip()
+    else:
+        source_wells, volumes, destination_wells = transfer_lists(transfers, sources, destinations)
+        pipette.transfer(volume=volumes, source=source_wells, dest=destination_wells, new_tip="once")
+
+class Hold:
+    """Thermocycler block hold run alongside liquid handling: the block is brought to temperature, and finish()
+    only waits for the part of the hold not already spent handling liquids."""
+    __slots__ = ("protocol", "seconds", "start")
+
+    def __init__(self, protocol: protocol_api.ProtocolContext, thermocycler: Any, temperature: float, seconds: float):
+        thermocycler.set_block_temperature(temperature=temperature)
+        protocol.comment(f"Holding the thermocycler block at {temperature:g} °C for {seconds:g} seconds:")
+        self.protocol = protocol
+        self.seconds = seconds
+        self.start = time.monotonic()
+
+    def finish(self) -> None:
+        """Wait for the rest of the hold, or for the whole hold when simulating, as simulated commands take no time."""
+        elapsed = 0.0 if self.protocol.is_simulating() else time.monotonic() - self.start
+        self.protocol.comment("Waiting for the end of the thermocycler hold.")
+        self.protocol.delay(seconds=max(self.seconds - elapsed, 0.0))
+
+class Telemetry:
+    """Wall-clock timings of the sections of a protocol run on the robot, and of the transfer passes of each section,
+    appended as JSON Lines to a telemetry file as each section ends, so that interrupted runs keep the sections done.
+    Sections start with the comments of the protocol. Telemetry is off when simulating or when compiled without it,
+    and is turned off if the file cannot be written, never failing the run."""
+    __slots__ = ("protocol", "file", "start", "current")
+
+    def __init__(self, protocol: protocol_api.ProtocolContext, telemetry: Optional[Dict[str, str]]):
+        self.protocol = protocol
+        self.file = None
+        self.start = time.monotonic()
+        self.current = {"section": "setup", "start": self.start, "paused_seconds": 0.0, "pauses": 0, "passes": []}
+        if telemetry is not None and not protocol.is_simulating():
+            self.file = os.path.join(telemetry["directory"], f"{telemetry['protocol']}-{time.strftime('%Y%m%d-%H%M%S')}-telemetry.jsonl")
+            self.write({"record": "run", "protocol": telemetry["protocol"], "started": time.strftime("%Y-%m-%dT%H:%M:%S")})
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """Append a record to the telemetry file, if any."""
+        if self.file is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.file), exist_ok=True)
+            with open(self.file, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as error:
+            self.protocol.comment(f"Telemetry turned off, cannot write {self.file}: {error}")
+            self.file = None
+
+    def end_section(self) -> None:
+        """Save the timings of the current section."""
+        section, now = self.current, time.monotonic()
+        self.write({"record": "section", "section": section["section"], "start_seconds": round(section["start"] - self.start, 1),
+                    "seconds": round(now - section["start"], 1), "paused_seconds": round(section["paused_seconds"], 1),
+                    "pauses": section["pauses"], "passes": section["passes"],
+                    "transfers": sum(step_pass["transfers"] for step_pass in section["passes"])})
+
+    def section(self, text: str) -> None:
+        """End the current section and start a new one with a comment."""
+        self.end_section()
+        self.protocol.comment(text)
+        self.current = {"section": text.rstrip(":."), "start": time.monotonic(), "paused_seconds": 0.0, "pauses": 0, "passes": []}
+
+    def passes(self, step: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Iterate over the passes of a step (see step_passes), timing each pass and counting its transfers."""
+        for step_pass in step_passes(step):
+            start = time.monotonic()
+            yield step_pass
+            self.current["passes"].append({"pipette": step_pass["pipette"], "transfers": len(step_pass["transfers"]),
+                                           "seconds": round(time.monotonic() - start, 1)})
+
+    def pause(self, message: str) -> None:
+        """Pause the protocol, timing the wait for the user apart from the section."""
+        start = time.monotonic()
+        self.protocol.pause(message)
+        self.current["paused_seconds"] += time.monotonic() - start
+        self.current["pauses"] += 1
+
+    def finish(self) -> None:
+        """End the last section and the run."""
+        self.end_section()
+        self.write({"record": "end", "seconds": round(time.monotonic() - self.start, 1)})
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""analyse-telemetry.py
+
+    Compare the timings of protocols run on the robot, as saved by protocols compiled with --telemetry
+    (see Telemetry in protocol-runtime.py), against the run time estimated from their simulation.
+
+    Each telemetry file is matched to the simulation results of its protocol, <simulation_dir>/<protocol>-simulation.json
+    as saved by simulate-protocol.py, whose commands are timed with the timing model of estimate-runtime.py and summed
+    per section of the run, sections starting with the comments of the protocol, and per transfer pass of each section.
+    The time spent waiting for the user at pauses is left out of the actual timings, as pauses are not timed by the estimates.
+
+    With a calibration file, the liquid handling timings of each pipette (pick up and drop tip, aspirate, dispense...) are
+    scaled so that the estimates of its transfer passes match their actual timings over all the runs, and the calibrated
+    timing model is saved, to be used with estimate-runtime.py --timing-model.
+
+    Usage:
+        analyse-telemetry.py [-m <model_file>] [-o <out_file>] [-r <report_file>] [-c <calibration_file>] <simulation_dir> <telemetry_files>...
+
+    Options:
+    -m, --timing-model <model_file>             JSON file overriding the default timing model.
+    -o, --output-file <out_file>                Actual and estimated timings as JSON [default: telemetry.json].
+    -r, --report-file <report_file>             Actual and estimated timings as text [default: telemetry.txt].
+    -c, --calibration-file <calibration_file>   Timing model calibrated on the transfer passes of the runs, as JSON.
+    -h --help                                   Show this screen.
+"""
+
+import json
+import os
+import re
+import sys
+from typing import Any, Dict, List
+
+from docopt import docopt
+
+from runtime_model import THERMOCYCLER_COMMANDS, RuntimeModel, command_type, format_duration, is_comment, leaf_records, load_timing_model, pipette_model
+
+# timing model values scaled by the calibration, as the rest of the commands run for fixed times
+LIQUID_HANDLING = ["aspirate", "dispense", "pick_up_tip", "drop_tip", "blow_out", "touch_tip", "air_gap", "move_to"]
+MOUNT = re.compile(r" on (left|right) mount$")
+
+def read_telemetry(telemetry_file: str) -> Dict[str, Any]:
+    """Read the run, sections and end records of a telemetry file. Runs interrupted before their end are incomplete."""
+    run = {"sections": [], "complete": False}
+    with open(telemetry_file) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["record"] == "run":
+                run.update(protocol=record["protocol"], started=record["started"])
+            elif record["record"] == "section":
+                run["sections"].append(record)
+            elif record["record"] == "end":
+                run.update(complete=True, seconds=record["seconds"])
+    return run
+
+def new_timing() -> Dict[str, Any]:
+    """Return an empty estimate of a section or transfer pass."""
+    return {"seconds": 0.0, "handling_seconds": 0.0, "pipettes": {}}
+
+def section_estimates(records: List[Dict[str, Any]], model: Dict[str, Any], sections: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Estimate the duration of each section of a simulated protocol, and of its transfer passes by pipette mount.
+    Liquid handling values of the timing model are also summed apart, by pipette model, for calibration."""
+    runtime = RuntimeModel(model)
+    estimates = {name: {**new_timing(), "passes": {}} for name in ["setup"] + sections}
+    section, mount = estimates["setup"], None
+    for record in leaf_records(records):
+        if is_comment(record):
+            runtime.comment(record)
+            section = estimates.get(record["text"].rstrip(":."), section)
+            # commands after a comment, e.g. the delay ending a hold, are not part of the previous pass
+            mount = None
+            continue
+        command = command_type(record)
+        if command is None:
+            continue
+        seconds = runtime.duration(command, record)
+        instrument = MOUNT.search(record.get("instrument", ""))
+        # commands without a pipette, e.g. delays, are part of the pass in progress, unless run by the thermocycler
+        mount = instrument.group(1) if instrument is not None else None if command in THERMOCYCLER_COMMANDS else mount
+        timings = [section] + ([section["passes"].setdefault(mount, new_timing())] if mount is not None else [])
+        for timing in timings:
+            timing["seconds"] += seconds
+            if command in LIQUID_HANDLING:
+                handling = runtime.value(command, record)
+                timing["handling_seconds"] += handling
+                timing["pipettes"][pipette_model(record)] = timing["pipettes"].get(pipette_model(record), 0.0) + handling
+    return estimates
+
+def compare(actual: float, estimated: float) -> Dict[str, Any]:
+    """Return the actual and estimated seconds, and their ratio."""
+    return {"actual_seconds": round(actual, 1), "estimated_seconds": round(estimated, 1),
+            "ratio": round(actual / estimated, 2) if estimated else None}
+
+def analyse_run(run: Dict[str, Any], records: List[Dict[str, Any]], model: Dict[str, Any]) -> Dict[str, Any]:
+    """Compare the actual timings of the sections and transfer passes of a run against their estimates."""
+    estimates = section_estimates(records, model, [section["section"] for section in run["sections"]])
+    sections, liquid_handling = [], []
+    for section in run["sections"]:
+        estimate = estimates[section["section"]]
+        passes = []
+        for step_pass in section["passes"]:
+            pass_estimate = estimate["passes"].get(step_pass["pipette"], new_timing())
+            passes.append({"pipette": step_pass["pipette"], "transfers": step_pass["transfers"],
+                           **compare(step_pass["seconds"], pass_estimate["seconds"])})
+            # the actual liquid handling time of the pass is what is left once its commands of fixed duration are done,
+            # shared between pipette models as estimated
+            actual_handling = step_pass["seconds"] - (pass_estimate["seconds"] - pass_estimate["handling_seconds"])
+            liquid_handling += [{"pipette": pipette, "actual_seconds": actual_handling * handling / pass_estimate["handling_seconds"],
+                             "estimated_seconds": handling} for pipette, handling in pass_estimate["pipettes"].items() if handling]
+        sections.append({"name": section["section"], "transfers": section["transfers"], "pauses": section["pauses"],
+                         **compare(section["seconds"] - section["paused_seconds"], estimate["seconds"]), "passes": passes})
+    total = compare(sum(section["actual_seconds"] for section in sections), sum(section["estimated_seconds"] for section in sections))
+    return {"protocol": run["protocol"], "started": run["started"], "complete": run["complete"], **total,
+            "sections": sections, "liquid_handling": liquid_handling}
+
+def calibrate(model: Dict[str, Any], analyses: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Scale the liquid handling values of the timing model for each pipette model by the ratio of the actual to the
+    estimated liquid handling time of its transfer passes, returning the ratio of each pipette model."""
+    actual, estimated = {}, {}
+    for analysis in analyses:
+        for entry in analysis["liquid_handling"]:
+            actual[entry["pipette"]] = actual.get(entry["pipette"], 0.0) + entry["actual_seconds"]
+            estimated[entry["pipette"]] = estimated.get(entry["pipette"], 0.0) + entry["estimated_seconds"]
+    ratios = {}
+    for pipette, seconds in actual.items():
+        if seconds <= 0: # passes faster than their commands of fixed duration, e.g. interrupted
+            continue
+        ratios[pipette] = seconds / estimated[pipette]
+        values = model["pipettes"].setdefault(pipette, {})
+        values.update({name: round(values.get(name, model[name]) * ratios[pipette], 2) for name in LIQUID_HANDLING})
+    return ratios
+
+def format_report(analyses: Dict[str, Dict[str, Any]]) -> str:
+    """Format the actual and estimated timings of each run, of its sections and of their transfer passes as text."""
+    lines = []
+    for name, analysis in analyses.items():
+        status = "" if analysis["complete"] else ", interrupted"
+        lines.append(f"{name} ({analysis['protocol']}, started {analysis['started']}{status}): {format_comparison(analysis)}")
+        width = max((len(section["name"]) for section in analysis["sections"]), default=0)
+        for section in analysis["sections"]:
+            pauses = f", {section['pauses']} pause(s) not timed" if section["pauses"] else ""
+            lines.append(f"    {section['name']:<{width}}  {format_comparison(section)}{pauses}")
+            lines += [f"    {'':<{width}}    {step_pass['pipette']} pipette, {step_pass['transfers']} transfer(s): {format_comparison(step_pass)}"
+                      for step_pass in section["passes"]]
+    return "\n".join(lines) + "\n"
+
+def format_comparison(timing: Dict[str, Any]) -> str:
+    """Format actual and estimated seconds, with the difference of the actual timing to the estimate."""
+    difference = f" ({timing['ratio'] - 1:+.0%})" if timing["ratio"] is not None else ""
+    return f"{format_duration(timing['actual_seconds'])} actual, {format_duration(timing['estimated_seconds'])} estimated{difference}"
+
+def main():
+    args = docopt(__doc__)
+    model = load_timing_model(args["--timing-model"])
+
+    analyses = {}
+    for telemetry_file in args["<telemetry_files>"]:
+        run = read_telemetry(telemetry_file)
+        results_file = os.path.join(args["<simulation_dir>"], f"{run['protocol']}-simulation.json")
+        if not os.path.exists(results_file):
+            sys.exit(f"{telemetry_file}: cannot find the simulation of {run['protocol']}, {results_file}.")
+        with open(results_file) as f:
+            records = json.load(f)
+        analyses[os.path.basename(telemetry_file)[:-len("-telemetry.jsonl")]] = analyse_run(run, records, model)
+
+    ratios = calibrate(model, list(analyses.values())) if args["--calibration-file"] else {}
+    if args["--calibration-file"]:
+        with open(args["--calibration-file"], "w") as f:
+            json.dump(model, f, indent=1)
+    with open(args["--output-file"], "w") as f:
+        json.dump({"runs": analyses, "calibration": {pipette: round(ratio, 2) for pipette, ratio in ratios.items()}}, f, indent=1)
+    report = format_report(analyses)
+    report += "".join(f"calibration: {pipette} liquid handling scaled by {ratio:.2f}\n" for pipette, ratio in ratios.items())
+    with open(args["--report-file"], "w") as f:
+        f.write(report)
+    print(report, end="")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+"""benchmark-pipeline.py
+
+    Benchmark the pipeline stages on synthetic experiments of each protocol, to measure how they scale with
+    the number of wells and catch regressions between versions.
+
+    Each case generates an experiment with 96 or 384 rows (384-well destination plates, or four agar plates
+    for protocols 2 and 3) for an 8-channel ("multi") or single-channel ("single") pipette layout, with tip racks
+    on every free deck slot. Experiments needing more tips than the deck holds are split by shard-experiment.py.
+    The validation, sharding, compilation, labware table, dry run and simulation stages are then run as separate
+    processes, recording their wall time, peak memory (max RSS) and exit status to a JSON report.
+
+    In compare mode, the stages of two reports are matched by case, and stages slower than the baseline
+    by more than the threshold ratio are reported as regressions, with exit status 1.
+
+    Usage:
+        benchmark-pipeline.py [-O <out_dir>] [-o <report_file>] [-w <wells>] [-p <protocols>] [-L <layouts>] [-n] [-d <template_dir>] [-l <labware_dir>]
+        benchmark-pipeline.py compare [-t <threshold>] <baseline_file> <report_file>
+
+    Options:
+    -O, --output-dir <out_dir>          Directory of the generated experiments and outputs [default: benchmark].
+    -o, --output-file <report_file>     Benchmark report [default: benchmark.json].
+    -w, --wells <wells>                 Comma separated numbers of rows of the experiments [default: 96,384].
+    -p, --protocols <protocols>         Comma separated protocols to benchmark [default: protocol-1,protocol-2,protocol-3,protocol-4].
+    -L, --layouts <layouts>             Comma separated pipette layouts, multi and/or single [default: multi,single].
+    -n, --no-simulation                 Skip the simulation stage.
+    -d, --template-dir <template_dir>   Directory containing protocol templates [default: assets/protocols].
+    -l, --labware-dir <labware_dir>     Directory of the custom labware definitions [default: assets/labware].
+    -t, --threshold <threshold>         Slowdown ratio reported as a regression [default: 1.25].
+    -h --help                           Show this screen.
+"""
+
+import csv
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from importlib.metadata import PackageNotFoundError, version
+from typing import Any, Dict, List, Tuple
+
+from docopt import docopt
+
+BIN_DIR = os.path.dirname(os.path.abspath(__file__))
+# stages faster than this in both reports are too noisy to be compared, in seconds
+MIN_COMPARED_SECONDS = 0.5
+
+# pipettes of each layout, small one on the right mount
+LAYOUTS = {
+    "multi": ("p20_multi_gen2", "p300_multi_gen2"),
+    "single": ("p20_single_gen2", "p300_single_gen2"),
+}
+TIPRACKS = ("opentrons_96_tiprack_20ul", "opentrons_96_tiprack_300ul")
+
+PCR_PLATE = "armadillo_96_wellplate_200ul_pcr_full_skirt"
+DEEP_PLATE = "usascientific_96_wellplate_2.4ml_deep"
+PLATE_384 = "biorad_384_wellplate_50ul"
+AGAR_PLATE = "nunc96grid_96_wellplate_10ul"
+
+def well_names(rows: int) -> List[str]:
+    """Return the wells of a 96 or 384-well plate, column by column."""
+    row_names, columns = ("ABCDEFGH", 12) if rows <= 96 else ("ABCDEFGHIJKLMNOP", 24)
+    return [f"{row}{column}" for column in range(1, columns + 1) for row in row_names]
+
+def pipette_params(layout: str, free_slots: List[int]) -> Dict[str, Any]:
+    """Mount the pipettes of a layout, sharing the free deck slots between their tip racks."""
+    half = (len(free_slots) + 1) // 2
+    params = {}
+    for side, pipette_name, tiprack_name, slots in zip(["right", "left"], LAYOUTS[layout], TIPRACKS, [free_slots[:half], free_slots[half:]]):
+        params.update({f"{side}_pipette_name": pipette_name, f"{side}_pipette_tiprack_name": tiprack_name,
+                       f"{side}_pipette_tiprack_slot": slots})
+    return params
+
+def free_slots(*used: Any) -> List[int]:
+    """Return the deck slots not used by plates or by the thermocycler."""
+    taken = {slot for slot in used if slot != "thermocycler"} | ({7, 8, 10, 11} if "thermocycler" in used else set())
+    return [slot for slot in range(1, 12) if slot not in taken]
+
+def agar_params(plates: int, first_slot: int) -> Dict[str, Any]:
+    """Return the parameters of agar plates in consecutive slots."""
+    return {"agar_plate_name": AGAR_PLATE, "agar_plate_slot": list(range(first_slot, first_slot + plates)),
+            "agar_plate_area": 9469.2, "empty_agar_plate_weight": [38.92] * plates, "agar_plate_weight": [68.35] * plates,
+            "agar_density": 0.911}
+
+def generate_protocol_1(wells: int, layout: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Transform cells of a PCR plate with DNA of the same plate, in the thermocycler or in a 384-well plate."""
+    destination = ("thermocycler", PCR_PLATE) if wells <= 96 else (3, PLATE_384)
+    params = {**pipette_params(layout, free_slots(1, 2, destination[0])),
+              "dna_plate_name": PCR_PLATE, "dna_plate_slot": 1, "cells_plate_name": PCR_PLATE, "cells_plate_slot": 1,
+              "media_plate_name": DEEP_PLATE, "media_plate_slot": 2,
+              "destination_plate_name": destination[1], "destination_plate_slot": destination[0],
+              "pre_shock_incubation_temp": 4, "pre_shock_incubation_time": 30, "heat_shock_temp": 42, "heat_shock_time": 30,
+              "post_shock_incubation_temp": 4, "post_shock_incubation_time": 2, "recovery_temp": 37, "recovery_time": 60}
+    # DNA in the first six columns and cells in the last six of the source plate
+    sources = well_names(96)
+    volumes = (1, 10, 50) if wells <= 96 else (1, 5, 25)
+    rows = [{"dna_id": f"pEX{i % 48:02d}", "dna_well": sources[i % 48], "dna_volume": volumes[0],
+             "cells_id": "DH5a", "cells_well": sources[48 + i % 48], "cells_volume": volumes[1],
+             "media_id": "SOC", "media_well": sources[i % 96], "media_volume": volumes[2], "destination_well": well}
+            for i, well in enumerate(well_names(wells)[:wells])]
+    return params, rows
+
+def generate_protocol_2(wells: int, layout: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Spot each well of a PCR plate on one agar plate per 96 rows."""
+    plates = (wells + 95) // 96
+    pipette = pipette_params(layout, [])
+    params = {"pipette_name": pipette["right_pipette_name"], "pipette_mount": "right", "tiprack_name": TIPRACKS[0],
+              "tiprack_slots": free_slots(1, *range(2, 2 + plates)), "source_plate_name": PCR_PLATE, "source_plate_slot": 1,
+              **agar_params(plates, 2), "additional_volume": 1, "spotting_height": 0.5}
+    names = well_names(96)
+    rows = [{"id": f"pEX{i % 96:02d}-DH5a", "agar_plate_location": 2 + i // 96, "source_well": names[i % 96],
+             "destination_well": names[i % 96], "spotting_volume": 2} for i in range(wells)]
+    return params, rows
+
+def generate_protocol_3(wells: int, layout: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Sample the colonies of one agar plate per 96 rows into a deep or 384-well culture plate."""
+    plates = (wells + 95) // 96
+    # colonies are mixed in the media plate well of their destination, so both plates have the same format
+    destination, media_volume = (DEEP_PLATE, 500) if wells <= 96 else (PLATE_384, 20)
+    agar_slots = list(range(4, 4 + plates))
+    params = {**pipette_params(layout, free_slots(2, 3, *agar_slots)),
+              "media_plate_name": destination, "media_plate_slot": 2, "destination_plate_name": destination, "destination_plate_slot": 3,
+              **agar_params(plates, 4), "agar_pierce_depth": 0, "sampling_method": "spiral", "spot_radius": 2.5,
+              "spiral_points": 25, "spiral_rotations": 3}
+    names = well_names(96)
+    rows = [{"colony_id": f"pEX{i % 96:02d}-DH5a", "agar_plate_location": 4 + i // 96, "colony_well": names[i % 96],
+             "media_id": "LB-carb", "media_well": well, "media_volume": media_volume, "destination_well": well}
+            for i, well in enumerate(well_names(wells)[:wells])]
+    return params, rows
+
+def generate_protocol_4(wells: int, layout: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Induce cultures of a deep plate into a deep or 384-well expression plate."""
+    destination, volumes = (DEEP_PLATE, (5, 500, 5)) if wells <= 96 else (PLATE_384, (2, 40, 2))
+    params = {**pipette_params(layout, free_slots(1, 2, 3, 4)),
+              "media_plate_name": DEEP_PLATE, "media_plate_slot": 4, "culture_plate_name": DEEP_PLATE, "culture_plate_slot": 1,
+              "inducer_plate_name": PCR_PLATE, "inducer_plate_slot": 2, "destination_plate_name": destination, "destination_plate_slot": 3}
+    names = well_names(96)
+    rows = [{"culture_id": f"pEX{i % 96:02d}-BL21(DE3)", "culture_well": names[i % 96], "culture_volume": volumes[0],
+             "media_id": "LB-carb", "media_well": names[i % 96], "media_volume": volumes[1],
+             "inducer_id": "IPTG-0.1mM", "inducer_well": names[i % 96], "inducer_volume": volumes[2], "destination_well": well}
+            for i, well in enumerate(well_names(wells)[:wells])]
+    return params, rows
+
+GENERATORS = {
+    "protocol-1": generate_protocol_1,
+    "protocol-2": generate_protocol_2,
+    "protocol-3": generate_protocol_3,
+    "protocol-4": generate_protocol_4,
+}
+
+def save_experiment(case_dir: str, case: str, params: Dict[str, Any], rows: List[Dict[str, Any]]) -> Tuple[str, str]:
+    """Save the parameters and data of a generated experiment, returning the data and config files."""
+    os.makedirs(case_dir, exist_ok=True)
+    csv_file, json_file = os.path.join(case_dir, f"{case}-data.csv"), os.path.join(case_dir, f"{case}-config.json")
+    with open(csv_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]), lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(json_file, "w") as f:
+        json.dump(params, f, indent=4)
+    return csv_file, json_file
+
+def run_stage(script: str, *args: str) -> Dict[str, Any]:
+    """Run a pipeline script in its own process, measuring its wall time and peak memory."""
+    with tempfile.TemporaryFile(mode="w+") as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(BIN_DIR, script), *args], stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4 returns the resource usage of this process alone, unlike RUSAGE_CHILDREN
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        stderr.seek(0)
+        errors = stderr.read().strip().splitlines()
+    exit_code = os.waitstatus_to_exitcode(status)
+    return {"seconds": round(seconds, 3), "max_rss_mb": round(usage.ru_maxrss / 1024, 1), "status": exit_code,
+            **({"error": errors[-1]} if exit_code and errors else {})}
+
+def run_case(protocol: str, wells: int, layout: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate the experiment of a case and run every pipeline stage on it."""
+    case = f"{layout}-{wells}-{protocol}"
+    case_dir = os.path.abspath(os.path.join(args["--output-dir"], case))
+    csv_file, json_file = save_experiment(case_dir, case, *GENERATORS[protocol](wells, layout))
+    shard_dir = os.path.join(case_dir, "shards")
+
+    stages = {
+        "validate": run_stage("validate-experiment.py", "-l", args["--labware-dir"], "-o", os.path.join(case_dir, "validation.txt"), csv_file, json_file),
+        "shard": run_stage("shard-experiment.py", "-O", shard_dir, "-l", args["--labware-dir"], case, csv_file, json_file),
+        "labware": run_stage("create-labware.py", csv_file, json_file, os.path.join(case_dir, f"{case}-labware.csv")),
+    }
+    stages["compile"] = run_stage("protocol-compiler.py", "batch", "-d", args["--template-dir"], "-l", args["--labware-dir"], "-O", case_dir, os.path.join(shard_dir, "shards.csv"))
+    protocols = sorted(os.path.join(case_dir, name) for name in os.listdir(case_dir) if name.endswith(".py"))
+    stages["dry_run"] = run_stage("dry-run-protocol.py", "batch", "-O", case_dir, args["--labware-dir"], *protocols)
+    if not args["--no-simulation"]:
+        stages["simulate"] = run_stage("simulate-protocol.py", "batch", "-O", case_dir, args["--labware-dir"], *protocols)
+    return {"case": case, "protocol": protocol, "wells": wells, "layout": layout, "runs": len(protocols), "stages": stages}
+
+def versions() -> Dict[str, str]:
+    """Return the versions of Python and of the packages used by the pipeline."""
+    packages = {"python": platform.python_version()}
+    for package in ["opentrons", "jinja2", "pandas"]:
+        try:
+            packages[package] = version(package)
+        except PackageNotFoundError:
+            packages[package] = None
+    return packages
+
+def compare(baseline: Dict[str, Any], report: Dict[str, Any], threshold: float) -> List[str]:
+    """Compare the stage times of two reports case by case, returning the regressions."""
+    baseline_cases = {case["case"]: case for case in baseline["cases"]}
+    regressions = []
+    for case in report["cases"]:
+        if case["case"] not in baseline_cases:
+            continue
+        for stage, result in case["stages"].items():
+            before = baseline_cases[case["case"]]["stages"].get(stage)
+            if before is None or before["status"] or result["status"] or max(before["seconds"], result["seconds"]) < MIN_COMPARED_SECONDS:
+                continue
+            ratio = result["seconds"] / before["seconds"] if before["seconds"] else 1.0
+            line = f"{case['case']:<24} {stage:<9} {before['seconds']:>8.2f}s -> {result['seconds']:>8.2f}s ({ratio:.2f}x)"
+            print(line)
+            if ratio > threshold:
+                regressions.append(line)
+    return regressions
+
+def main():
+    args = docopt(__doc__)
+    if args["compare"]:
+        with open(args["<baseline_file>"]) as f:
+            baseline = json.load(f)
+        with open(args["<report_file>"]) as f:
+            report = json.load(f)
+        regressions = compare(baseline, report, float(args["--threshold"]))
+        if regressions:
+            sys.exit(f"{len(regressions)} stage(s) slower than {args['--threshold']}x the baseline:\n" + "\n".join(regressions))
+        return
+
+    cases = []
+    for protocol in args["--protocols"].split(","):
+        for wells in map(int, args["--wells"].split(",")):
+            for layout in args["--layouts"].split(","):
+                case = run_case(protocol, wells, layout, args)
+                cases.append(case)
+                print(f"{case['case']:<24} " + "  ".join(f"{stage} {result['seconds']:.2f}s{'' if result['status'] == 0 else ' FAILED'}"
+                                                        for stage, result in case["stages"].items()))
+
+    with open(args["--output-file"], "w") as f:
+        json.dump({"versions": versions(), "platform": platform.platform(), "cases": cases}, f, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""content_cache.py
+
+    Size-bounded, content-addressed on-disk cache shared by the APEX scripts.
+
+    Entries are stored as <cache_dir>/<namespace>/<key[:2]>/<key>, where the key is the SHA-256
+    of everything the entry depends on. Reading an entry refreshes its modification time, and
+    the least recently used entries are evicted once the namespace grows above its size limit.
+    Hit, miss and eviction counts are accumulated across runs in <namespace>/stats.json.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Optional, Union
+
+def hash_content(*parts: Union[bytes, str]) -> str:
+    """Return the SHA-256 hex digest of the given parts, each one length-prefixed to avoid collisions."""
+    digest = hashlib.sha256()
+    for part in parts:
+        part = part.encode("utf-8") if isinstance(part, str) else part
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+def hash_directory(directory: str, suffix: str = "") -> str:
+    """Return the SHA-256 of the names and contents of the files in a directory ending with suffix."""
+    parts = []
+    for file_name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, file_name)
+        if os.path.isfile(path) and file_name.endswith(suffix):
+            with open(path, "rb") as f:
+                parts += [file_name, f.read()]
+    return hash_content(*parts)
+
+class ContentCache:
+    """On-disk cache mapping content hashes to bytes, with least-recently-used eviction."""
+
+    def __init__(self, cache_dir: str, namespace: str, max_bytes: int):
+        self.root = os.path.join(cache_dir, namespace)
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached content for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            self.stats["misses"] += 1
+            return None
+        os.utime(path) # mark entry as recently used
+        self.stats["hits"] += 1
+        return content
+
+    def put(self, key: str, content: bytes) -> None:
+        """Store content under key; the write is atomic so concurrent writers never expose partial entries."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def evict(self) -> int:
+        """Delete the least recently used entries until the cache fits max_bytes, return the number evicted."""
+        entries, total = [], 0
+        for subdir in os.scandir(self.root):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            evicted += 1
+        self.stats["evictions"] += evicted
+        return evicted
+
+    def save_stats(self, counts: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """Add this run's counts (or the given ones) to the persisted statistics and return the totals."""
+        counts = counts if counts is not None else self.stats
+        stats_file = os.path.join(self.root, "stats.json")
+        try:
+            with open(stats_file) as f:
+                totals = json.load(f)
+        except (FileNotFoundError, ValueError):
+            totals = {}
+        for name, count in counts.items():
+            totals[name] = totals.get(name, 0) + count
+        with open(stats_file, "w") as f:
+            json.dump(totals, f)
+        return totals
@@ -1,168 +1,168 @@
 #!/usr/bin/env python3
 """
-    create_csv_labware.py
+    create-labware.py
 
     Usage:
-    create_csv_labware.py <csv_file> <json_file> <output_file>
+    create-labware.py [-f <format>] <csv_file> <json_file> <output_file>
+    create-labware.py batch [-f <format>] [-O <out_dir>] (<id> <csv_file> <json_file>)...
 
     Input:
     <csv_file>       Path to the CSV file containing experiment data.
     <json_file>      Path to the JSON file containing protocol parameters.
     <output_file>    Path to the output csv file with labware data.
+    <id>             Experiment identifier ending with its protocol (e.g. protocol-1), used to name
+                     the labware file <out_dir>/<id>-labware.<format> in batch mode.
+
+    The protocol of a single experiment is identified by the "protocol-N" in its CSV file name.
+
+    Options:
+    -f, --format <format>        Output format, one of csv, parquet or feather (Arrow IPC) [default: csv].
+    -O, --output-dir <out_dir>   Output directory for batch mode [default: .].
 """
 
 import pandas as pd
 import json
+import os
+import re
+from typing import Any, Dict, List
 from docopt import docopt
 
-def create_csv_protocol_1(data_csv, parameters_json, output_csv):
-    """This function creates a CSV file from CSV and JSON files of protocol 1 compatible with the labware visualisation script."""
-    df = pd.read_csv(data_csv)
-    with open(parameters_json, "r") as file:
-        plate_slots = json.load(file)
-
-    df_all_reactants = []
-    for reactant in ["dna", "cells", "media"]:
-        well_col = f"{reactant}_well"
-        volume_col = f"{reactant}_volume"
-        id_col = f"{reactant}_id"
-        df_id_well_volume = df.groupby(well_col).agg({volume_col: "sum", id_col: "first"}).reset_index() # Sum the volumes of reactants
-        df_id_well_volume.rename(columns={id_col: "id", well_col: "well_name", volume_col: "volume"}, inplace=True)
-        df_id_well_volume["location"] = plate_slots[f"{reactant}_plate_slot"]
-        df_id_well_volume["labware"] = plate_slots[f"{reactant}_plate_name"]
-        df_all_reactants.append(df_id_well_volume) 
-
-    df_destination = pd.DataFrame({
-        "id": df.apply(lambda row: f'{row["dna_id"]}/{row["cells_id"]}/{row["media_id"]}', axis=1),
-        "well_name": df["destination_well"],
-        "volume": df[["dna_volume", "cells_volume", "media_volume"]].sum(axis=1),
-        "labware": plate_slots["destination_plate_name"],
-        "location": plate_slots["destination_plate_slot"]
-    })
-    df_all_reactants.append(df_destination) 
-    result_df = pd.concat(df_all_reactants, ignore_index=True) # Concatenate the grouped dataframes vertically
-    result_df = result_df.reindex(columns=["id", "location", "labware", "well_name", "volume"]) # Reorder columns
-    result_df.to_csv(output_csv, index=False)
-
-def create_csv_protocol_2(data_csv, parameters_json, output_csv):
-    """
-    This function creates a CSV file from spotting CSV and JSON files compatible with the labware visualisation script.
-    """
-    df = pd.read_csv(data_csv)
-    with open(parameters_json, "r") as file:
-        params = json.load(file)
-
-    df_source_plate = pd.DataFrame({
-        "id": df["id"],
-        "well_name": df["source_well"],
-        "volume": df["spotting_volume"],
-        "labware": params["source_plate_name"],
-        "location": params["source_plate_slot"]
-    })
-
-    df_destination_plate = pd.DataFrame({
-        "id": df["id"],
-        "well_name": df["destination_well"],
-        "volume": df["spotting_volume"],
-        "labware": params["agar_plate_name"],
-        "location": df["agar_plate_location"]
-    })
-
-    result_df = pd.concat([df_source_plate, df_destination_plate], ignore_index=True)
-    result_df = result_df[["id", "location", "labware", "well_name", "volume"]]
-    result_df.to_csv(output_csv, index=False)
-
-def create_csv_protocol_3(data_csv: str, parameters_json: str, output_csv: str) -> None:
-    """
-    This function creates a csv file from picking CSV and JSON files for the labware visualisation.
-    """
-
-    df = pd.read_csv(data_csv)
-    with open(parameters_json, "r") as file:
-        params = json.load(file)
-
-    df_all_reactants = []
-
-    df_source_plate = pd.DataFrame({
-        "id": df["colony_id"],
-        "well_name": df["colony_well"],
-        "volume": 0,
-        "labware": params["agar_plate_name"],
-        "location": df["agar_plate_location"]
-    })
-    df_all_reactants.append(df_source_plate)
-
-    df_media_plate = pd.DataFrame({
-        "id": df["media_id"],
-        "well_name": df["media_well"],
-        "volume": df["media_volume"],
-        "labware": params["media_plate_name"],
-        "location": params["media_plate_slot"]
-    })
-    df_all_reactants.append(df_media_plate)
-
-    df_destination_plate = pd.DataFrame({
-        "id": df.apply(lambda row: f'{row["colony_id"]}/{row["media_id"]}', axis=1),
-        "well_name": df["destination_well"],
-        "volume": df["media_volume"],
-        "labware": params["destination_plate_name"],
-        "location": params["destination_plate_slot"]
-    })
-    df_all_reactants.append(df_destination_plate) 
-
-    result_df = pd.concat(df_all_reactants, ignore_index=True)
-    result_df = result_df.reindex(columns=["id", "location", "labware", "well_name", "volume"])
-    result_df.to_csv(output_csv, index=False)
-
-def create_csv_protocol_4(data_csv, parameters_json, output_csv):
-    """
-    Creates a CSV file for labware visualization using data from CSV and JSON configuration files.
-    This function aggregates lab data by wells, calculates combined IDs from multiple reactants, and outputs
-    a consolidated CSV file for visualizing labware placement in protocol 4 experiments.
-    """
-    df = pd.read_csv(data_csv)
-    with open(parameters_json, "r") as f:
-        plate_slots = json.load(f)
-
-    df_all_reactants = []
-    for reactant in ["culture", "media", "inducer"]:
-        well_col = f"{reactant}_well"
-        volume_col = f"{reactant}_volume"
-        id_col = f"{reactant}_id"
-        df_id_well_volume = df.groupby(well_col).agg({volume_col: "sum", id_col: "first"}).reset_index()
-        df_id_well_volume.rename(columns={id_col: "id", well_col: "well_name", volume_col: "volume"}, inplace=True)
-        df_id_well_volume["location"] = plate_slots[f"{reactant}_plate_slot"]
-        df_id_well_volume["labware"] = plate_slots[f"{reactant}_plate_name"]
-        df_all_reactants.append(df_id_well_volume) 
-
-    df_destination = pd.DataFrame({
-        "id": df.apply(lambda row: f'{row["culture_id"]}/{row["media_id"]}/{row["inducer_id"]}', axis=1),
-        "well_name": df["destination_well"],
-        "volume": df[["culture_volume", "media_volume", "inducer_volume"]].sum(axis=1),
-        "labware": plate_slots["destination_plate_name"],
-        "location": plate_slots["destination_plate_slot"]
+LABWARE_COLUMNS = ["id", "location", "labware", "well_name", "volume"]
+
+# Labware tables of each protocol. Reactant plates are aggregated by well from the <reactant>_well,
+# <reactant>_volume and <reactant>_id columns; every other plate has one well per data row, with the id
+# and volume summed or joined from the given columns, and the location read from a data column or a config key.
+# Optional plates are only listed when their location is set in the config.
+LABWARE_SCHEMAS = {
+    "protocol-1": {
+        "reactants": ["dna", "cells", "media"],
+        "plates": [
+            {"id": ["dna_id", "cells_id", "media_id"], "well": "destination_well", "volume": ["dna_volume", "cells_volume", "media_volume"],
+             "labware": "destination_plate_name", "location": "destination_plate_slot"},
+            {"id": ["media_id"], "well": "destination_well", "volume": ["media_volume"],
+             "labware": "media_staging_plate_name", "location": "media_staging_plate_slot", "optional": True},
+        ],
+    },
+    "protocol-2": {
+        "reactants": [],
+        "plates": [
+            {"id": ["id"], "well": "source_well", "volume": ["spotting_volume"],
+             "labware": "source_plate_name", "location": "source_plate_slot"},
+            {"id": ["id"], "well": "destination_well", "volume": ["spotting_volume"],
+             "labware": "agar_plate_name", "location_column": "agar_plate_location"},
+        ],
+    },
+    "protocol-3": {
+        "reactants": [],
+        "plates": [
+            {"id": ["colony_id"], "well": "colony_well", "volume": [],
+             "labware": "agar_plate_name", "location_column": "agar_plate_location"},
+            {"id": ["media_id"], "well": "media_well", "volume": ["media_volume"],
+             "labware": "media_plate_name", "location": "media_plate_slot"},
+            {"id": ["colony_id", "media_id"], "well": "destination_well", "volume": ["media_volume"],
+             "labware": "destination_plate_name", "location": "destination_plate_slot"},
+        ],
+    },
+    "protocol-4": {
+        "reactants": ["culture", "media", "inducer"],
+        "plates": [
+            {"id": ["culture_id", "media_id", "inducer_id"], "well": "destination_well", "volume": ["culture_volume", "media_volume", "inducer_volume"],
+             "labware": "destination_plate_name", "location": "destination_plate_slot"},
+        ],
+    },
+}
+
+def protocol_type(name: str) -> str:
+    """Return the protocol (e.g. protocol-1) identified in an experiment id or file name."""
+    match = re.search(r"protocol-\d+", os.path.basename(name))
+    if match is None or match.group(0) not in LABWARE_SCHEMAS:
+        raise ValueError(f"Cannot identify the protocol of {name}, expected one of {', '.join(LABWARE_SCHEMAS)}.")
+    return match.group(0)
+
+def join_ids(df: pd.DataFrame, id_cols: List[str]) -> pd.Series:
+    """Join the reactant ids of each row with "/" using vectorised string concatenation."""
+    if len(id_cols) == 1:
+        return df[id_cols[0]]
+    ids = df[id_cols].astype(str)
+    return ids[id_cols[0]].str.cat([ids[col] for col in id_cols[1:]], sep="/")
+
+def aggregate_reactants(df: pd.DataFrame, reactants: List[str], plate_slots: dict) -> pd.DataFrame:
+    """Sum the volumes drawn from each reactant well in a single grouped aggregation over all reactants."""
+    long_df = pd.concat([
+        pd.DataFrame({
+            "reactant": reactant,
+            "well_name": df[f"{reactant}_well"],
+            "volume": df[f"{reactant}_volume"],
+            "id": df[f"{reactant}_id"],
+        }) for reactant in reactants], ignore_index=True)
+    long_df["reactant"] = pd.Categorical(long_df["reactant"], categories=reactants, ordered=True) # Keep reactants in the given order
+
+    result_df = long_df.groupby(["reactant", "well_name"], observed=True).agg({"volume": "sum", "id": "first"}).reset_index() # Sum the volumes of reactants
+    result_df["location"] = result_df["reactant"].map({reactant: plate_slots[f"{reactant}_plate_slot"] for reactant in reactants}).astype(object)
+    result_df["labware"] = result_df["reactant"].map({reactant: plate_slots[f"{reactant}_plate_name"] for reactant in reactants}).astype(object)
+    return result_df.drop(columns="reactant")
+
+def plate_table(df: pd.DataFrame, params: dict, plate: Dict[str, Any]) -> pd.DataFrame:
+    """Build the labware table of a plate with one well per data row."""
+    return pd.DataFrame({
+        "id": join_ids(df, plate["id"]),
+        "well_name": df[plate["well"]],
+        "volume": df[plate["volume"]].sum(axis=1) if plate["volume"] else 0,
+        "labware": params[plate["labware"]],
+        "location": df[plate["location_column"]] if "location_column" in plate else params[plate["location"]],
     })
-    
-    df_all_reactants.append(df_destination)
 
-    result_df = pd.concat(df_all_reactants, ignore_index=True)
-    result_df = result_df.reindex(columns=["id", "location", "labware", "well_name", "volume"])
-    result_df.to_csv(output_csv, index=False)
+def build_labware(df: pd.DataFrame, params: dict, protocol: str) -> pd.DataFrame:
+    """Build the labware table of an experiment from its data and parameters, following the protocol schema."""
+    schema = LABWARE_SCHEMAS[protocol]
+    tables = [aggregate_reactants(df, schema["reactants"], params)] if schema["reactants"] else []
+    tables += [plate_table(df, params, plate) for plate in schema["plates"]
+               if not (plate.get("optional") and params.get(plate["location"], "NA") == "NA")]
+    return pd.concat(tables, ignore_index=True) # Concatenate the tables vertically
+
+def build_all_labware(experiments: List[Dict[str, str]]) -> Dict[str, pd.DataFrame]:
+    """Build the labware tables of all experiments, reading each data and parameters file only once."""
+    data, params = {}, {}
+    labware = {}
+    for experiment in experiments:
+        csv_file, json_file = experiment["data"], experiment["config"]
+        if csv_file not in data:
+            data[csv_file] = pd.read_csv(csv_file)
+        if json_file not in params:
+            with open(json_file, "r") as file:
+                params[json_file] = json.load(file)
+        labware[experiment["id"]] = build_labware(data[csv_file], params[json_file], experiment["protocol"])
+    return labware
+
+def save_labware(result_df: pd.DataFrame, output_file: str, output_format: str = "csv") -> None:
+    """Save the labware table as CSV, Parquet or Arrow IPC (feather)."""
+    result_df = result_df.reindex(columns=LABWARE_COLUMNS) # Reorder columns
+    if output_format == "csv":
+        result_df.to_csv(output_file, index=False)
+    elif output_format in ("parquet", "feather"):
+        # mixed slot types (e.g. 1 and "thermocycler") are not supported by Arrow columns
+        result_df = result_df.astype({"location": str})
+        getattr(result_df, f"to_{output_format}")(output_file)
+    else:
+        raise ValueError(f"Unsupported output format: {output_format}")
 
 def main():
     args = docopt(__doc__)
-    csv_data = args["<csv_file>"]
-    json_data = args["<json_file>"]
-    csv_output = args["<output_file>"]
-
-    if "1" in csv_data:
-        create_csv_protocol_1(csv_data, json_data, csv_output)
-    elif "2" in csv_data:
-        create_csv_protocol_2(csv_data, json_data, csv_output)
-    elif "3" in csv_data:
-        create_csv_protocol_3(csv_data, json_data, csv_output)
-    if "4" in csv_data:
-        create_csv_protocol_4(csv_data, json_data, csv_output)
+    output_format = args["--format"]
+
+    if args["batch"]:
+        experiments = [{"id": id, "protocol": protocol_type(id), "data": csv_file, "config": json_file}
+                       for id, csv_file, json_file in zip(args["<id>"], args["<csv_file>"], args["<json_file>"])]
+        output_files = {id: os.path.join(args["--output-dir"], f"{id}-labware.{output_format}") for id in args["<id>"]}
+        os.makedirs(args["--output-dir"], exist_ok=True)
+    else:
+        # docopt returns the repeated batch arguments as lists in both usages
+        csv_file, json_file = args["<csv_file>"][0], args["<json_file>"][0]
+        experiments = [{"id": csv_file, "protocol": protocol_type(csv_file), "data": csv_file, "config": json_file}]
+        output_files = {csv_file: args["<output_file>"]}
+
+    for id, result_df in build_all_labware(experiments).items():
+        save_labware(result_df, output_files[id], output_format)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
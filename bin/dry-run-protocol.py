@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""dry-run-protocol.py
+
+    Dry run compiled protocols in pure Python (see dry_run.py), without the Opentrons simulator, saving the
+    run log as text, as JSON records and as a JSON Lines event log in the formats of simulate-protocol.py,
+    and a summary of the commands, the tips used by each pipette and the volume drawn from and added to each well.
+
+    In batch mode, outputs are saved as <out_dir>/<name>-dryrun.txt/json/jsonl and <name>-dryrun-summary.json,
+    and a failing protocol is reported without stopping the others.
+
+    Usage:
+        dry-run-protocol.py [-o <out_file>] [-r <results_file>] [-e <events_file>] [-u <summary_file>] <protocol_file> <labware_dir>
+        dry-run-protocol.py batch [-O <out_dir>] <labware_dir> <protocol_files>...
+
+    Options:
+    -o, --output-file <out_file>        Dry run log [default: dryrun.txt].
+    -r, --results-file <results_file>   Dry run records as JSON [default: dryrun.json].
+    -e, --events-file <events_file>     Dry run events as JSON Lines [default: dryrun.jsonl].
+    -u, --summary-file <summary_file>   Commands, tips and well volumes of the dry run [default: dryrun-summary.json].
+    -O, --output-dir <out_dir>          Output directory for batch mode [default: .].
+    -h --help                           Show this screen.
+"""
+
+import json
+import os
+import sys
+
+from docopt import docopt
+
+from dry_run import DryRunError, dry_run, format_records, summarise
+from runtime_model import TIMING_MODEL
+from simulation_events import simulation_events, write_events
+
+def save_dry_run(protocol_file: str, labware_dir: str, out_file: str, results_file: str, events_file: str, summary_file: str) -> str:
+    """Dry run a protocol, save its outputs and return a one line summary."""
+    context = dry_run(protocol_file, labware_dir)
+    summary = summarise(context)
+    with open(out_file, "w", encoding="utf-8") as f:
+        f.write(format_records(context.records))
+    with open(results_file, "w", encoding="utf-8") as f:
+        json.dump(context.records, f, indent=1)
+    events = write_events(simulation_events(context.records, TIMING_MODEL), events_file)
+    with open(summary_file, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=1)
+    tips = ", ".join(f"{pipette} {entry['pick_ups']} tip pick-ups" for pipette, entry in summary["tips"].items())
+    return f"{protocol_file}: {events} commands, {tips or 'no pipettes'}"
+
+def main():
+    args = docopt(__doc__)
+    if not args["batch"]:
+        try:
+            print(save_dry_run(args["<protocol_file>"], args["<labware_dir>"], args["--output-file"], args["--results-file"],
+                               args["--events-file"], args["--summary-file"]))
+        except DryRunError as error:
+            sys.exit(f"{args['<protocol_file>']}: {error}")
+        return
+
+    out_dir = args["--output-dir"]
+    os.makedirs(out_dir, exist_ok=True)
+    failed = False
+    for protocol_file in args["<protocol_files>"]:
+        name = os.path.join(out_dir, f"{os.path.splitext(os.path.basename(protocol_file))[0]}-dryrun")
+        try:
+            print(save_dry_run(protocol_file, args["<labware_dir>"], f"{name}.txt", f"{name}.json", f"{name}.jsonl", f"{name}-summary.json"))
+        except DryRunError as error:
+            failed = True
+            print(f"{protocol_file}: {error}", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
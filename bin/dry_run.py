@@ -0,0 +1,605 @@
+"""dry_run.py
+
+    Pure-Python dry run of compiled protocols, without the Opentrons stack.
+
+    A compiled protocol is executed against a stub ProtocolContext implementing the part of the Opentrons API
+    used by the templates: labware loaded from the labware directory (or from the Opentrons standard library
+    when installed), pipettes picking up tips from their racks, the thermocycler module, and pause, delay and
+    comment. Commands are recorded with the texts and nesting of the run log records of simulate-protocol.py,
+    so that runtime_model.py and simulation_events.py apply unchanged, while the tips picked up by each pipette
+    and the volume drawn from and added to each well are tallied. Errors the robot would raise, such as running
+    out of tips or aspirating more than the pipette holds, raise a DryRunError.
+
+    A dry run takes milliseconds, which makes it the inner loop when editing templates or benchmarking the
+    pipeline; the Opentrons simulator remains the reference before running a protocol on the robot.
+"""
+
+import sys
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import lru_cache
+from types import ModuleType
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from labware_registry import registry
+from runtime_model import command_type, leaf_records
+
+# model name, channels, minimum and maximum volumes in uL and default flow rate in uL/s of each pipette
+PIPETTES = {
+    "p20_single_gen2": ("P20 Single-Channel GEN2", 1, 1.0, 20.0, 7.56),
+    "p20_multi_gen2": ("P20 8-Channel GEN2", 8, 1.0, 20.0, 7.6),
+    "p300_single_gen2": ("P300 Single-Channel GEN2", 1, 20.0, 300.0, 92.86),
+    "p300_multi_gen2": ("P300 8-Channel GEN2", 8, 20.0, 300.0, 94.0),
+    "p1000_single_gen2": ("P1000 Single-Channel GEN2", 1, 100.0, 1000.0, 274.7),
+}
+
+# OT-2 deck: distance between slot origins, fixed trash slot, and thermocycler slots and labware offset
+SLOT_PITCH = (132.5, 90.5)
+TRASH_SLOT = 12
+THERMOCYCLER = "Thermocycler Module GEN1"
+THERMOCYCLER_SLOTS = (7, 8, 10, 11)
+THERMOCYCLER_OFFSET = (0.0, 82.56, 97.8)
+
+# default height of aspirations and dispenses above the well bottom, in mm
+BOTTOM_CLEARANCE = 1.0
+
+# temperatures are reported rounded as sent to the thermocycler
+TEMPERATURE_DIGITS = 2
+
+class DryRunError(Exception):
+    """Raised when a protocol fails during the dry run."""
+
+class Unsupported:
+    """Report the parts of the Opentrons API not implemented by the dry run."""
+
+    def __getattr__(self, name: str) -> Any:
+        raise DryRunError(f"{type(self).__name__}.{name} is not supported by the dry run, use simulate-protocol.py.")
+
+class Point(NamedTuple):
+    """Position on the deck in mm, as opentrons.types.Point."""
+    x: float = 0.0
+    y: float = 0.0
+    z: float = 0.0
+
+    def __add__(self, other: "Point") -> "Point":
+        return Point(self.x + other.x, self.y + other.y, self.z + other.z)
+
+class Location(NamedTuple):
+    """Position relative to a well, as opentrons.types.Location."""
+    point: Point
+    labware: Optional["Well"]
+
+    def move(self, point: Point) -> "Location":
+        """Return the location moved by an offset."""
+        return Location(self.point + point, self.labware)
+
+class Well(Unsupported):
+    """Well of a loaded labware."""
+
+    def __init__(self, labware: "Labware", name: str, geometry: Dict[str, Any]):
+        self.parent = labware
+        self.well_name = name
+        self.geometry = geometry
+        self.max_volume = geometry["totalLiquidVolume"]
+        self._bottom = labware.offset + Point(geometry["x"], geometry["y"], geometry["z"])
+
+    def __repr__(self) -> str:
+        return f"{self.well_name} of {self.parent}"
+
+    def bottom(self, z: float = 0.0) -> Location:
+        """Return the location z mm above the well bottom."""
+        return Location(self._bottom + Point(z=z), self)
+
+    def top(self, z: float = 0.0) -> Location:
+        """Return the location z mm above the well top."""
+        return Location(self._bottom + Point(z=self.geometry["depth"] + z), self)
+
+    def center(self) -> Location:
+        """Return the location of the well center."""
+        return Location(self._bottom + Point(z=self.geometry["depth"] / 2), self)
+
+class Labware(Unsupported):
+    """Labware loaded on a deck slot or on a module."""
+
+    def __init__(self, load_name: str, definition: Dict[str, Any], slot: int, offset: Point, module: Optional[str] = None, label: Optional[str] = None):
+        self.load_name = load_name
+        self.name = label or definition["metadata"]["displayName"]
+        self.slot = slot
+        self.module = module
+        corner = definition.get("cornerOffsetFromSlot", {})
+        self.offset = offset + Point(corner.get("x", 0.0), corner.get("y", 0.0), corner.get("z", 0.0))
+        self.is_tiprack = definition.get("parameters", {}).get("isTiprack", False)
+        self.columns_by_name = definition["ordering"]
+        self._wells = {name: Well(self, name, definition["wells"][name]) for column in self.columns_by_name for name in column}
+        self.column_of = {name: column for column in self.columns_by_name for name in column}
+
+    def __repr__(self) -> str:
+        return f"{self.name} on {self.module} on slot {self.slot}" if self.module else f"{self.name} on slot {self.slot}"
+
+    def wells(self) -> List[Well]:
+        """Return the wells in order, column by column."""
+        return list(self._wells.values())
+
+    def wells_by_name(self) -> Dict[str, Well]:
+        """Return the wells by name."""
+        return dict(self._wells)
+
+    def columns(self) -> List[List[Well]]:
+        """Return the wells of each column."""
+        return [[self._wells[name] for name in column] for column in self.columns_by_name]
+
+    def __getitem__(self, name: str) -> Well:
+        return self._wells[name]
+
+def tiprack_definition(load_name: str) -> Dict[str, Any]:
+    """Return a 96 tip rack definition for standard tip racks when the Opentrons library is not installed."""
+    rows, columns = "ABCDEFGH", range(1, 13)
+    return {"metadata": {"displayName": load_name}, "parameters": {"isTiprack": True},
+            "ordering": [[f"{row}{column}" for row in rows] for column in columns],
+            "wells": {f"{row}{column}": {"x": 14.38 + 9 * (column - 1), "y": 74.38 - 9 * i, "z": 25.49, "depth": 39.2, "totalLiquidVolume": 0}
+                      for i, row in enumerate(rows) for column in columns}}
+
+# the fixed trash of the OT-2, where tips are dropped
+TRASH_DEFINITION = {"metadata": {"displayName": "Opentrons Fixed Trash"}, "ordering": [["A1"]],
+                    "wells": {"A1": {"x": 82.84, "y": 80.0, "z": 5.0, "depth": 77.0, "totalLiquidVolume": 1100000}}}
+
+@lru_cache(maxsize=None)
+def labware_definition(labware_dir: str, load_name: str) -> Dict[str, Any]:
+    """Return the definition of a labware, parsed once per process."""
+    definition = registry(labware_dir).definition(load_name)
+    if definition is None and "tiprack" in load_name:
+        definition = tiprack_definition(load_name)
+    if definition is None:
+        raise DryRunError(f"Unknown labware {load_name}, not found in {labware_dir} or in the Opentrons standard library.")
+    return definition
+
+def slot_offset(slot: int) -> Point:
+    """Return the origin of a deck slot."""
+    return Point(SLOT_PITCH[0] * ((slot - 1) % 3), SLOT_PITCH[1] * ((slot - 1) // 3), 0.0)
+
+class Clearances:
+    """Height of aspirations and dispenses above the well bottom, as InstrumentContext.well_bottom_clearance."""
+
+    def __init__(self):
+        self.aspirate = BOTTOM_CLEARANCE
+        self.dispense = BOTTOM_CLEARANCE
+
+class InstrumentContext(Unsupported):
+    """Pipette loaded on a mount, with its tip racks."""
+
+    def __init__(self, protocol: "ProtocolContext", instrument_name: str, mount: str, tip_racks: List[Labware]):
+        if instrument_name not in PIPETTES:
+            raise DryRunError(f"Unknown pipette {instrument_name}, expected one of {', '.join(PIPETTES)}.")
+        self.model, self.channels, self.min_volume, self.max_volume, self.flow_rate = PIPETTES[instrument_name]
+        self.name = instrument_name
+        self.mount = mount
+        self.tip_racks = list(tip_racks)
+        self.well_bottom_clearance = Clearances()
+        self.has_tip = False
+        self.current_volume = 0.0
+        self.tips_used = 0
+        self._protocol = protocol
+        self._used_tips = set()
+        self._location = None
+
+    def __repr__(self) -> str:
+        return f"{self.model} on {self.mount} mount"
+
+    def _next_tip(self) -> Well:
+        """Return the next tip of the racks, a full column at a time for 8-channel pipettes."""
+        for rack in self.tip_racks:
+            for column in rack.columns():
+                free = [tip for tip in column if (rack.slot, tip.well_name) not in self._used_tips]
+                if not free or (self.channels > 1 and len(free) < len(column)):
+                    continue
+                tips = free if self.channels > 1 else free[:1]
+                self._used_tips.update((rack.slot, tip.well_name) for tip in tips)
+                return tips[0]
+        raise DryRunError(f"{self} is out of tips after {self.tips_used} pick-ups from the tip racks in slots "
+                          f"{[rack.slot for rack in self.tip_racks]}.")
+
+    def _resolve(self, location: Union[Well, Location, None], clearance: float) -> Location:
+        """Return the location of a command, at the clearance above the bottom of a well, or the current location."""
+        if location is None:
+            if self._location is None or self._location.labware is None:
+                raise DryRunError(f"{self} has no current location to use.")
+            return self._location
+        if isinstance(location, Well):
+            return location.bottom(clearance)
+        return location
+
+    def _payload(self, **payload: Any) -> Dict[str, Any]:
+        """Return the payload of a command of the pipette."""
+        return {"instrument": str(self), **payload}
+
+    def pick_up_tip(self, location: Optional[Well] = None) -> "InstrumentContext":
+        """Pick up the next tip of the racks, or the tip at a location."""
+        if self.has_tip:
+            raise DryRunError(f"{self} already has a tip attached.")
+        tip = self._next_tip() if location is None else location
+        self._protocol._record(f"Picking up tip from {tip}", **self._payload(location=str(tip)))
+        self.has_tip, self.current_volume, self._location = True, 0.0, tip.top()
+        self.tips_used += 1
+        return self
+
+    def drop_tip(self, location: Optional[Well] = None) -> "InstrumentContext":
+        """Drop the tip into the fixed trash."""
+        if not self.has_tip:
+            raise DryRunError(f"{self} has no tip to drop.")
+        well = location if location is not None else self._protocol.trash["A1"]
+        self._protocol._record(f"Dropping tip into {well}", **self._payload(location=str(well)))
+        self.has_tip, self.current_volume, self._location = False, 0.0, well.top()
+        return self
+
+    def aspirate(self, volume: Optional[float] = None, location: Union[Well, Location, None] = None, rate: float = 1.0) -> "InstrumentContext":
+        """Aspirate a volume from a location, the whole free volume of the tip by default."""
+        target = self._resolve(location, self.well_bottom_clearance.aspirate)
+        if not self.has_tip:
+            raise DryRunError(f"{self} cannot aspirate from {target.labware} without a tip attached.")
+        volume = self.max_volume - self.current_volume if volume is None else volume
+        if self.current_volume + volume > self.max_volume + 1e-9:
+            raise DryRunError(f"{self} cannot aspirate {volume} uL from {target.labware}: it holds {self.current_volume} uL "
+                              f"out of {self.max_volume} uL.")
+        self._protocol._record(f"Aspirating {float(volume)} uL from {target.labware} at {self.flow_rate * rate} uL/sec",
+                               **self._payload(volume=volume, location=str(target), rate=rate))
+        self._protocol._tally(target.labware, self.channels, drawn=volume)
+        self.current_volume += volume
+        self._location = target
+        return self
+
+    def dispense(self, volume: Optional[float] = None, location: Union[Well, Location, None] = None, rate: float = 1.0) -> "InstrumentContext":
+        """Dispense a volume into a location, the whole volume of the tip by default."""
+        target = self._resolve(location, self.well_bottom_clearance.dispense)
+        volume = self.current_volume if volume is None else volume
+        if volume > self.current_volume + 1e-9:
+            raise DryRunError(f"{self} cannot dispense {volume} uL into {target.labware}: it holds {self.current_volume} uL.")
+        self._protocol._record(f"Dispensing {float(volume)} uL into {target.labware} at {self.flow_rate * rate} uL/sec",
+                               **self._payload(volume=volume, location=str(target), rate=rate))
+        self._protocol._tally(target.labware, self.channels, added=volume)
+        self.current_volume = max(self.current_volume - volume, 0.0)
+        self._location = target
+        return self
+
+    def mix(self, repetitions: int = 1, volume: Optional[float] = None, location: Union[Well, Location, None] = None, rate: float = 1.0) -> "InstrumentContext":
+        """Aspirate and dispense a volume repeatedly at a location, or at the current location."""
+        if not self.has_tip:
+            raise DryRunError(f"{self} cannot mix without a tip attached.")
+        volume = self.max_volume if volume is None else volume
+        text = f"Mixing {repetitions} times with a volume of {float(volume)} ul"
+        payload = self._payload(location=None if location is None else str(location), volume=volume, repetitions=repetitions)
+        with self._protocol._nested(text, **payload):
+            self.aspirate(volume, location, rate)
+            for _ in range(repetitions - 1):
+                self.dispense(volume, rate=rate)
+                self.aspirate(volume, rate=rate)
+            self.dispense(volume, rate=rate)
+        return self
+
+    def blow_out(self, location: Union[Well, Location, None] = None) -> "InstrumentContext":
+        """Blow out the liquid left in the tip, at the top of a well or at the current location."""
+        target = location.top() if isinstance(location, Well) else self._resolve(location, 0.0)
+        self._protocol._record(f"Blowing out at {target.labware}", **self._payload(location=str(target)))
+        if self.current_volume:
+            self._protocol._tally(target.labware, self.channels, added=self.current_volume)
+        self.current_volume = 0.0
+        self._location = target
+        return self
+
+    def move_to(self, location: Location) -> "InstrumentContext":
+        """Move the pipette to a location."""
+        self._protocol._record(f"Moving to {location.labware}", **self._payload(location=str(location)))
+        self._location = location
+        return self
+
+    def transfer(self, volume: Union[float, List[float]], source: Union[Well, List[Well]], dest: Union[Well, List[Well]],
+                 new_tip: str = "once", mix_before: Optional[Tuple[int, float]] = None, mix_after: Optional[Tuple[int, float]] = None,
+                 disposal_volume: float = 0.0, mode: str = "transfer", **options: Any) -> "InstrumentContext":
+        """Transfer volumes from sources to destinations, splitting volumes larger than the pipette, as the
+        TransferPlan of the Opentrons API."""
+        if options:
+            raise DryRunError(f"Transfer options {', '.join(options)} are not supported by the dry run, use simulate-protocol.py.")
+        sources = source if isinstance(source, list) else [source]
+        dests = dest if isinstance(dest, list) else [dest]
+        transfers = max(len(sources), len(dests))
+        volumes = volume if isinstance(volume, list) else [volume] * transfers
+        if len(volumes) != transfers:
+            raise DryRunError(f"{self} cannot transfer {len(volumes)} volumes between {len(sources)} sources and {len(dests)} destinations.")
+        if new_tip == "never" and not self.has_tip:
+            raise DryRunError(f"{self} cannot transfer without a tip attached when new_tip is never.")
+        text = f"Transferring {[float(v) for v in volume] if isinstance(volume, list) else float(volume)} from {sources[0]} to {dests[0]}"
+        payload = self._payload(locations=[str(sources[0]), str(dests[0])], volume=volume,
+                                source=[str(well) for well in source] if isinstance(source, list) else str(source),
+                                dest=[str(well) for well in dest] if isinstance(dest, list) else str(dest))
+        with self._protocol._nested(text, **payload):
+            if new_tip == "once":
+                self.pick_up_tip()
+            if mode == "distribute":
+                self._plan_distribute(volumes, sources[0], dests, new_tip, disposal_volume)
+            else:
+                self._plan_transfer(volumes, sources, dests, new_tip, mix_before, mix_after)
+            if new_tip == "once":
+                self.drop_tip()
+        return self
+
+    def _split(self, volumes: List[float], targets: List[Any], max_volume: float) -> Iterator[Tuple[float, Any]]:
+        """Split the volumes larger than the pipette, halving the last two parts as the Opentrons API does."""
+        for volume, target in zip(volumes, targets):
+            while volume > max_volume * 2:
+                yield max_volume, target
+                volume -= max_volume
+            if volume > max_volume:
+                volume /= 2
+                yield volume, target
+            yield volume, target
+
+    def _plan_transfer(self, volumes: List[float], sources: List[Well], dests: List[Well], new_tip: str,
+                       mix_before: Optional[Tuple[int, float]], mix_after: Optional[Tuple[int, float]]) -> None:
+        """Transfer each volume from its source to its destination, mixing when the tip is empty."""
+        # the shorter list is repeated to match the longer one
+        if max(len(sources), len(dests)) % min(len(sources), len(dests)):
+            raise DryRunError("Source and destination lists must be divisible.")
+        if len(sources) < len(dests):
+            sources = [well for well in sources for _ in range(len(dests) // len(sources))]
+        elif len(dests) < len(sources):
+            dests = [well for well in dests for _ in range(len(sources) // len(dests))]
+        for step_volume, (source, dest) in self._split(volumes, list(zip(sources, dests)), self.max_volume):
+            if new_tip == "always":
+                self.pick_up_tip()
+            transferred = 0.0
+            while transferred < step_volume:
+                part = min(self.max_volume, step_volume - transferred)
+                if mix_before and self.current_volume == 0:
+                    self.mix(*mix_before, location=source)
+                self.aspirate(part, source)
+                self.dispense(part, dest)
+                if mix_after and self.current_volume == 0:
+                    self.mix(*mix_after, location=dest)
+                transferred += part
+            if new_tip == "always":
+                self.drop_tip()
+
+    def _plan_distribute(self, volumes: List[float], source: Well, dests: List[Well], new_tip: str, disposal_volume: float) -> None:
+        """Distribute volumes from a source, aspirating as many volumes as fit in the tip at once."""
+        plan = [(volume, dest) for volume, dest in self._split(volumes, dests, self.max_volume - disposal_volume) if volume > 0]
+        if new_tip == "always":
+            self.pick_up_tip()
+        while plan:
+            # aspirate at once all the following volumes that fit in the tip with the disposal volume
+            group = [plan.pop(0)]
+            while plan and sum(volume for volume, _ in group) + disposal_volume + plan[0][0] <= self.max_volume:
+                group.append(plan.pop(0))
+            self.aspirate(sum(volume for volume, _ in group) + disposal_volume, source)
+            for volume, dest in group:
+                self.dispense(volume, dest)
+            if disposal_volume:
+                self.blow_out(self._protocol.trash["A1"])
+        if new_tip == "always":
+            self.drop_tip()
+
+    def distribute(self, volume: Union[float, List[float]], source: Well, dest: List[Well], **options: Any) -> "InstrumentContext":
+        """Distribute volumes from a source to destinations, aspirating as many volumes as fit in the tip."""
+        dests = dest if isinstance(dest, list) else [dest]
+        text = f"Distributing {[float(v) for v in volume] if isinstance(volume, list) else float(volume)} from {source} to {dests[0]}"
+        payload = self._payload(locations=[str(source), str(dests[0])], volume=volume, source=str(source),
+                                dest=[str(well) for well in dest] if isinstance(dest, list) else str(dest))
+        with self._protocol._nested(text, **payload):
+            self.transfer(volume, source, dest, mode="distribute", disposal_volume=options.pop("disposal_volume", self.min_volume), **options)
+        return self
+
+class ThermocyclerContext(Unsupported):
+    """Thermocycler module, holding one labware."""
+
+    def __init__(self, protocol: "ProtocolContext"):
+        self._protocol = protocol
+        self.labware = None
+
+    def __repr__(self) -> str:
+        return f"{THERMOCYCLER} on slot {THERMOCYCLER_SLOTS[0]}"
+
+    def load_labware(self, name: str, label: Optional[str] = None, **_: Any) -> Labware:
+        """Load a labware on the module."""
+        definition = labware_definition(self._protocol.labware_dir, name)
+        # labware definitions may lower themselves into the thermocycler block
+        stacking = definition.get("stackingOffsetWithModule", {})
+        stacking = stacking.get("thermocyclerModuleV1", stacking.get("thermocyclerModuleV2", {}))
+        offset = slot_offset(THERMOCYCLER_SLOTS[0]) + Point(*THERMOCYCLER_OFFSET) + Point(-stacking.get("x", 0.0), -stacking.get("y", 0.0), -stacking.get("z", 0.0))
+        self.labware = Labware(name, definition, THERMOCYCLER_SLOTS[0], offset, THERMOCYCLER, label)
+        self._protocol.loaded_labware.append(self.labware)
+        return self.labware
+
+    def set_block_temperature(self, temperature: float, hold_time_seconds: Optional[float] = None, hold_time_minutes: Optional[float] = None,
+                              ramp_rate: Optional[float] = None, block_max_volume: Optional[float] = None) -> None:
+        """Set the block temperature, holding it for a time when given."""
+        text = f"Setting Thermocycler well block temperature to {round(float(temperature), TEMPERATURE_DIGITS)} °C"
+        total_seconds = None
+        if hold_time_seconds or hold_time_minutes:
+            total_seconds = (hold_time_seconds or 0) + (hold_time_minutes or 0) * 60
+            seconds = total_seconds % 60
+            minutes = (total_seconds - seconds) / 60
+            text += " with a hold time of " + (f"{minutes} minutes and " if minutes > 0 else "") + f"{seconds} seconds"
+        self._protocol._record(text, temperature=temperature, hold_time=total_seconds)
+
+    def set_lid_temperature(self, temperature: float) -> None:
+        """Set the lid temperature."""
+        self._protocol._record(f"Setting Thermocycler lid temperature to {round(float(temperature), TEMPERATURE_DIGITS)} °C")
+
+    def open_lid(self) -> None:
+        """Open the lid."""
+        self._protocol._record("Opening Thermocycler lid")
+
+    def close_lid(self) -> None:
+        """Close the lid."""
+        self._protocol._record("Closing Thermocycler lid")
+
+    def deactivate_lid(self) -> None:
+        """Turn off the lid heater."""
+        self._protocol._record("Deactivating Thermocycler lid heating")
+
+    def deactivate_block(self) -> None:
+        """Turn off the block temperature control."""
+        self._protocol._record("Deactivating Thermocycler well block heating")
+
+    def deactivate(self) -> None:
+        """Turn off the lid heater and the block temperature control."""
+        self._protocol._record("Deactivating Thermocycler")
+
+class ProtocolContext(Unsupported):
+    """Protocol context of the dry run, recording the commands of the protocol and the liquid moved in each well."""
+
+    def __init__(self, labware_dir: str):
+        self.labware_dir = labware_dir
+        self.records = []
+        self.loaded_labware = []
+        self.loaded_instruments = {}
+        self.wells = {}
+        self._deck = {}
+        self._level = 0
+        self.trash = Labware("opentrons_1_trash_1100ml_fixed", TRASH_DEFINITION, TRASH_SLOT, slot_offset(TRASH_SLOT))
+
+    def _record(self, text: str, **payload: Any) -> None:
+        self.records.append({"level": self._level, **payload, "text": text})
+
+    @contextmanager
+    def _nested(self, text: str, **payload: Any) -> Iterator[None]:
+        """Record a composite command, nesting the commands run within it."""
+        self._record(text, **payload)
+        self._level += 1
+        try:
+            yield
+        finally:
+            self._level -= 1
+
+    def _tally(self, well: Optional[Well], channels: int, drawn: float = 0.0, added: float = 0.0) -> None:
+        """Add the volume drawn from or added to the wells reached by the channels of a pipette."""
+        if well is None:
+            return
+        labware = well.parent
+        column = labware.column_of[well.well_name]
+        if channels == 1:
+            wells = [well.well_name]
+        elif len(column) < channels:
+            # all channels reach the same well of reservoirs and tubes
+            wells = [well.well_name] * channels
+        else:
+            wells = column[column.index(well.well_name)::len(column) // channels][:channels]
+        for name in wells:
+            entry = self.wells.setdefault((labware.slot, name), {"slot": labware.slot, "well": name, "labware": labware.load_name,
+                                                                 "drawn": 0.0, "added": 0.0, "capacity": labware[name].max_volume})
+            entry["drawn"] += drawn
+            entry["added"] += added
+
+    def _occupy(self, slots: Tuple[int, ...], item: Any) -> None:
+        for slot in slots:
+            if slot in self._deck or slot == TRASH_SLOT:
+                raise DryRunError(f"Cannot load {item} on slot {slot}, already occupied by {self._deck.get(slot, self.trash)}.")
+        self._deck.update({slot: item for slot in slots})
+
+    def load_labware(self, load_name: str, location: Union[int, str], label: Optional[str] = None, **_: Any) -> Labware:
+        """Load a labware on a deck slot."""
+        try:
+            slot = int(location)
+        except (TypeError, ValueError):
+            raise DryRunError(f"Cannot load {load_name} on {location}: only deck slots 1 to 11 are supported by the dry run.")
+        labware = Labware(load_name, labware_definition(self.labware_dir, load_name), slot, slot_offset(slot), label=label)
+        self._occupy((slot,), labware)
+        self.loaded_labware.append(labware)
+        return labware
+
+    def load_instrument(self, instrument_name: str, mount: str, tip_racks: Optional[List[Labware]] = None, **_: Any) -> InstrumentContext:
+        """Load a pipette on a mount."""
+        if mount in self.loaded_instruments:
+            raise DryRunError(f"Cannot load {instrument_name} on the {mount} mount, already holding {self.loaded_instruments[mount]}.")
+        self.loaded_instruments[mount] = InstrumentContext(self, instrument_name, mount, tip_racks or [])
+        return self.loaded_instruments[mount]
+
+    def load_module(self, module_name: str, location: Optional[Union[int, str]] = None, **_: Any) -> ThermocyclerContext:
+        """Load the thermocycler, the only module used by the protocols."""
+        if "thermocycler" not in module_name.lower():
+            raise DryRunError(f"Module {module_name} is not supported by the dry run, use simulate-protocol.py.")
+        module = ThermocyclerContext(self)
+        self._occupy(THERMOCYCLER_SLOTS, module)
+        return module
+
+    def comment(self, msg: str) -> None:
+        """Add a comment to the run log."""
+        self._record(msg)
+
+    def pause(self, msg: Optional[str] = None) -> None:
+        """Pause the protocol until resumed by the user."""
+        self._record("Pausing robot operation" + (f": {msg}" if msg else ""), userMessage=msg)
+
+    def delay(self, seconds: float = 0, minutes: float = 0, msg: Optional[str] = None) -> None:
+        """Wait for a time."""
+        total_minutes, total_seconds = divmod(timedelta(minutes=minutes, seconds=seconds).total_seconds(), 60)
+        text = f"Delaying for {int(total_minutes)} minutes and {round(total_seconds, 3)} seconds" + (f". {msg}" if msg else "")
+        self._record(text, minutes=total_minutes, seconds=total_seconds)
+
+    def is_simulating(self) -> bool:
+        """Return True, as the dry run is a simulation."""
+        return True
+
+    def set_rail_lights(self, on: bool) -> None:
+        """Turn the rail lights on or off, which is not recorded in the run log."""
+
+    def home(self) -> None:
+        """Home the robot."""
+        self._record("Homing")
+
+def opentrons_modules() -> Dict[str, ModuleType]:
+    """Return the stub opentrons package imported by the protocols during the dry run."""
+    opentrons, protocol_api, types = ModuleType("opentrons"), ModuleType("opentrons.protocol_api"), ModuleType("opentrons.types")
+    protocol_api.ProtocolContext, protocol_api.InstrumentContext = ProtocolContext, InstrumentContext
+    protocol_api.Labware, protocol_api.Well = Labware, Well
+    types.Point, types.Location = Point, Location
+    opentrons.protocol_api, opentrons.types = protocol_api, types
+    return {"opentrons": opentrons, "opentrons.protocol_api": protocol_api, "opentrons.types": types}
+
+@contextmanager
+def stub_opentrons() -> Iterator[None]:
+    """Replace the opentrons package by the stubs while a protocol is loaded, restoring it afterwards."""
+    modules = opentrons_modules()
+    saved = {name: sys.modules.get(name) for name in modules}
+    sys.modules.update(modules)
+    try:
+        yield
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+def dry_run(protocol_file: str, labware_dir: str) -> ProtocolContext:
+    """Run a compiled protocol against the stub protocol context and return the context with its records."""
+    with open(protocol_file) as f:
+        source = f.read()
+    context = ProtocolContext(labware_dir)
+    with stub_opentrons():
+        try:
+            namespace = {"__name__": "protocol", "__file__": protocol_file}
+            exec(compile(source, protocol_file, "exec"), namespace)
+            namespace["run"](context)
+        except DryRunError:
+            raise
+        except Exception as error:
+            raise DryRunError(f"{type(error).__name__}: {error} after {len(context.records)} commands.") from error
+    return context
+
+def summarise(context: ProtocolContext) -> Dict[str, Any]:
+    """Count the commands of a dry run by type, the tips used by each pipette and the liquid moved in each well."""
+    commands = {}
+    for record in leaf_records(context.records):
+        command = command_type(record)
+        if command is not None:
+            commands[command] = commands.get(command, 0) + 1
+    tips = {str(pipette): {"pipette": pipette.name, "tip_racks": [rack.slot for rack in pipette.tip_racks],
+                           "pick_ups": pipette.tips_used, "tips": pipette.tips_used * pipette.channels,
+                           "available": sum(len(rack.wells()) for rack in pipette.tip_racks)}
+            for pipette in context.loaded_instruments.values()}
+    wells = [{**entry, "drawn": round(entry["drawn"], 3), "added": round(entry["added"], 3)}
+             for _, entry in sorted(context.wells.items(), key=lambda item: (item[0][0], len(item[0][1]), item[0][1]))]
+    return {"commands": commands, "tips": tips, "wells": wells}
+
+def format_records(records: List[Dict[str, Any]]) -> str:
+    """Format the records as the run log of opentrons_simulate."""
+    return "\n".join("\t" * record["level"] + record["text"] for record in records) + "\n"
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""estimate-runtime.py
+
+    Estimate the run time of simulated protocols on the OT-2 from their simulation results
+    (<name>-simulation.json, as saved by simulate-protocol.py).
+
+    Every liquid handling, movement, delay and thermocycler command of the run log is timed with a
+    timing model, and durations are summed per protocol step, where steps are delimited by the comments
+    of the protocol (e.g. "Adding DNA:") and thermocycler commands are reported as steps of their own.
+    Aspirate and dispense times account for their volume and flow rate; thermocycler commands account
+    for block and lid temperature ramps and hold times. Pauses wait for the user and are counted, but not timed.
+    Liquid handling run during an overlapped thermocycler hold (see Hold in protocol-runtime.py) is deducted
+    from the hold, which only adds the time left once the liquid handling is done.
+
+    The timeline lays out the steps and thermocycler holds of each protocol in time, listing the steps run during
+    each overlapped hold and the time the robot is left idle by every hold.
+
+    The default timing model can be calibrated with a JSON file overriding any of its values, with
+    per-pipette values under "pipettes", e.g. {"pipettes": {"P300 8-Channel GEN2": {"pick_up_tip": 9.0}}}.
+
+    Usage:
+        estimate-runtime.py [-m <model_file>] [-o <out_file>] [-r <report_file>] [-t <timeline_file>] <results_files>...
+
+    Options:
+    -m, --timing-model <model_file>     JSON file overriding the default timing model.
+    -o, --output-file <out_file>        Run time summary as JSON [default: runtime.json].
+    -r, --report-file <report_file>     Run time report as text [default: runtime.txt].
+    -t, --timeline-file <timeline_file> Timeline of the steps and thermocycler holds as text [default: timeline.txt].
+    -h --help                           Show this screen.
+"""
+
+import json
+import os
+from typing import Any, Dict, List
+
+from docopt import docopt
+
+from runtime_model import THERMOCYCLER_COMMANDS, RuntimeModel, command_type, format_duration, is_comment, leaf_records, load_timing_model
+
+def estimate_runtime(records: List[Dict[str, Any]], model: Dict[str, Any]) -> Dict[str, Any]:
+    """Estimate the duration of each step of a simulated protocol and of the whole protocol."""
+    runtime = RuntimeModel(model)
+    steps = [{"name": "setup", "seconds": 0.0, "commands": {}}]
+    step_name, pauses = "setup", 0
+    for record in leaf_records(records):
+        if is_comment(record):
+            runtime.comment(record)
+            step_name = record["text"].rstrip(":.")
+            continue
+        command = command_type(record)
+        if command is None:
+            continue
+        pauses += command == "pause"
+
+        # thermocycler commands interrupting liquid handling are reported as a step of their own
+        name = "thermocycler" if command in THERMOCYCLER_COMMANDS and step_name != "setup" else step_name
+        if steps[-1]["name"] != name:
+            steps.append({"name": name, "seconds": 0.0, "commands": {}})
+        step = steps[-1]
+        step["seconds"] += runtime.duration(command, record)
+        step["commands"][command] = step["commands"].get(command, 0) + 1
+
+    steps = [dict(step, seconds=round(step["seconds"], 1)) for step in steps if step["commands"]]
+    return {"total_seconds": round(sum(step["seconds"] for step in steps), 1), "pauses": pauses, "steps": steps}
+
+def protocol_timeline(records: List[Dict[str, Any]], model: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Lay out the steps and thermocycler holds of a simulated protocol in time. Holds list the seconds of each step
+    run during them, and the seconds the robot is left idle."""
+    runtime = RuntimeModel(model)
+    timeline, seconds, step_name, hold = [], 0.0, "setup", None
+    for record in leaf_records(records):
+        if is_comment(record):
+            runtime.comment(record)
+            if runtime.hold is not None and hold is None:
+                hold = {"name": f"hold at {runtime.block_temperature:g} °C", "start_seconds": seconds,
+                        "hold_seconds": runtime.hold, "overlapped": {}}
+                timeline.append(hold)
+            step_name = record["text"].rstrip(":.")
+            continue
+        command = command_type(record)
+        if command is None:
+            continue
+
+        duration = runtime.duration(command, record)
+        if hold is not None and command == "delay":
+            # the rest of an overlapped hold, once its liquid handling is done
+            overlapped = sum(hold["overlapped"].values())
+            hold.update(seconds=overlapped + duration, idle_seconds=duration, overrun_seconds=max(overlapped - hold["hold_seconds"], 0.0))
+            hold = None
+        elif hold is not None:
+            hold["overlapped"][step_name] = hold["overlapped"].get(step_name, 0.0) + duration
+        elif command == "block_temperature" and record.get("hold_time"):
+            timeline.append({"name": f"hold at {float(record['temperature']):g} °C", "start_seconds": seconds, "seconds": duration,
+                             "hold_seconds": float(record["hold_time"]), "overlapped": {}, "idle_seconds": duration, "overrun_seconds": 0.0})
+        else:
+            name = "thermocycler" if command in THERMOCYCLER_COMMANDS and step_name != "setup" else step_name
+            if not timeline or timeline[-1]["name"] != name or "hold_seconds" in timeline[-1]:
+                timeline.append({"name": name, "start_seconds": seconds, "seconds": 0.0})
+            timeline[-1]["seconds"] += duration
+        seconds += duration
+
+    rounded = lambda value: {name: round(step_seconds, 1) for name, step_seconds in value.items()} if isinstance(value, dict) else round(value, 1)
+    return [{key: rounded(value) if key != "name" else value for key, value in entry.items()}
+            for entry in timeline if entry.get("seconds") or entry.get("hold_seconds")]
+
+def format_report(runtimes: Dict[str, Dict[str, Any]]) -> str:
+    """Format the run time of each protocol and of its steps as text."""
+    lines = []
+    for protocol, runtime in runtimes.items():
+        pauses = f" + {runtime['pauses']} pause(s)" if runtime["pauses"] else ""
+        lines.append(f"{protocol}: {format_duration(runtime['total_seconds'])}{pauses}")
+        width = max(len(step["name"]) for step in runtime["steps"]) if runtime["steps"] else 0
+        lines += [f"    {step['name']:<{width}}  {format_duration(step['seconds'])}" for step in runtime["steps"]]
+    return "\n".join(lines) + "\n"
+
+def format_timeline(timelines: Dict[str, List[Dict[str, Any]]]) -> str:
+    """Format the timeline of each protocol as text, with the steps overlapped with each hold and its idle time."""
+    lines = []
+    for protocol, timeline in timelines.items():
+        lines.append(f"{protocol}:")
+        width = max((len(entry["name"]) for entry in timeline), default=0)
+        for entry in timeline:
+            line = f"    {format_duration(entry['start_seconds']):>11}  {entry['name']:<{width}}  {format_duration(entry['seconds']):>11}"
+            if "hold_seconds" in entry:
+                overlapped = ", ".join(f"{name} {format_duration(seconds)}" for name, seconds in entry["overlapped"].items())
+                line += f"  overlapped with {overlapped}," if overlapped else " "
+                line += f" idle {format_duration(entry['idle_seconds'])}"
+                if entry["overrun_seconds"]:
+                    line += f", hold overrun by {format_duration(entry['overrun_seconds'])}"
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+def protocol_name(results_file: str) -> str:
+    """Return the protocol name of a simulation results file."""
+    name = os.path.splitext(os.path.basename(results_file))[0]
+    return name[:-len("-simulation")] if name.endswith("-simulation") else name
+
+def main():
+    args = docopt(__doc__)
+    model = load_timing_model(args["--timing-model"])
+
+    runtimes, timelines = {}, {}
+    for results_file in args["<results_files>"]:
+        with open(results_file) as f:
+            records = json.load(f)
+        name = protocol_name(results_file)
+        timelines[name] = protocol_timeline(records, model)
+        runtimes[name] = {**estimate_runtime(records, model), "timeline": timelines[name]}
+
+    with open(args["--output-file"], "w") as f:
+        json.dump({"protocols": runtimes, "total_seconds": round(sum(r["total_seconds"] for r in runtimes.values()), 1),
+                   "timing_model": model}, f, indent=1)
+    report = format_report(runtimes)
+    with open(args["--report-file"], "w") as f:
+        f.write(report)
+    with open(args["--timeline-file"], "w") as f:
+        f.write(format_timeline(timelines))
+    print(report, end="")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""experiment_validator.py
+
+    Fast validation of the JSON parameters and CSV data of an experiment, before compilation and simulation.
+
+    Parameters and columns are checked against the schema of each protocol, and the data against the labware
+    definitions of the labware directory (or of the Opentrons standard library): wells must exist on their plate,
+    the volume drawn from or added to each well must fit in it, a deck slot cannot hold two different labware,
+    a single aspiration must fit in its pipette and agar plate locations must be configured agar plate slots.
+    All errors of an experiment are collected and reported together.
+"""
+
+import csv
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from labware_registry import STANDARD_LIBRARY, registry
+from step_plan import PlanError, mounted_pipettes, pipette_max_volume, select_pipette, select_sampling_pipette
+
+# deck slots of the OT-2, and the slots covered by the thermocycler
+DECK_SLOTS = set(range(1, 12))
+THERMOCYCLER_SLOTS = (7, 8, 10, 11)
+# protocols loading plates of the same labware in the same slot only once
+REUSED_PLATES = {"protocol-1", "protocol-4"}
+
+PIPETTE_PARAMS = {f"{side}_pipette_{key}": kind for side in ["right", "left"]
+                  for key, kind in [("name", "pipette"), ("tiprack_name", "labware"), ("tiprack_slot", "slots")]}
+AGAR_PARAMS = {"agar_plate_name": "labware", "agar_plate_slot": "slots", "agar_plate_area": "number",
+               "empty_agar_plate_weight": "numbers", "agar_plate_weight": "numbers", "agar_density": "number"}
+
+# volumes aspirated at once by the protocols, without being split by transfer(), as (volume column selecting the pipette of the
+# step, or None for the sampling pipette, fixed mixing volume or None for the volume of each row in the volume column)
+SINGLE_ASPIRATIONS = {
+    "protocol-1": [("dna_volume", None)],
+    "protocol-3": [(None, 20.0)],
+    "protocol-4": [("culture_volume", 20.0), ("inducer_volume", 20.0)],
+}
+
+# Parameters of each protocol with their kind, optional parameters (all required when any of them is set, other than "NA"),
+# CSV columns, and plates: the wells of a plate are read from a column ("NA" wells are skipped where the planner skips them,
+# "|" separates several wells), with the volume drawn from (source) or added to (destination) each well summed from the
+# volume columns, and the plate slot read from a parameter or from a column. Optional plates are only used when their slot is set.
+VALIDATION_SCHEMAS = {
+    "protocol-1": {
+        "params": {**PIPETTE_PARAMS,
+                   **{f"{plate}_plate_{key}": kind for plate in ["dna", "cells", "media", "destination"]
+                      for key, kind in [("name", "labware"), ("slot", "slot")]},
+                   **{f"{step}_{key}": "number" for step in ["pre_shock_incubation", "heat_shock", "post_shock_incubation", "recovery"]
+                      for key in ["temp", "time"]}},
+        "optional_params": {"media_staging_plate_name": "labware", "media_staging_plate_slot": "slot"},
+        "columns": ["dna_id", "dna_well", "dna_volume", "cells_id", "cells_well", "cells_volume",
+                    "media_id", "media_well", "media_volume", "destination_well"],
+        "plates": [
+            {"well": "dna_well", "volume": ["dna_volume"], "labware": "dna_plate_name", "slot": "dna_plate_slot", "skip_na": True},
+            {"well": "cells_well", "volume": ["cells_volume"], "labware": "cells_plate_name", "slot": "cells_plate_slot", "skip_na": True},
+            {"well": "media_well", "volume": ["media_volume"], "labware": "media_plate_name", "slot": "media_plate_slot", "skip_na": True},
+            {"well": "destination_well", "volume": ["dna_volume", "cells_volume", "media_volume"],
+             "labware": "destination_plate_name", "slot": "destination_plate_slot", "destination": True},
+            # recovery media staged in the destination wells of the staging plate during the pre-shock incubation
+            {"well": "destination_well", "volume": ["media_volume"], "labware": "media_staging_plate_name",
+             "slot": "media_staging_plate_slot", "destination": True, "optional": True},
+        ],
+    },
+    "protocol-2": {
+        "params": {"pipette_name": "pipette", "pipette_mount": "mount", "tiprack_name": "labware", "tiprack_slots": "slots",
+                   "source_plate_name": "labware", "source_plate_slot": "slot", **AGAR_PARAMS,
+                   "additional_volume": "number", "spotting_height": "number"},
+        "columns": ["id", "agar_plate_location", "source_well", "destination_well", "spotting_volume"],
+        "plates": [
+            {"well": "source_well", "volume": ["spotting_volume"], "labware": "source_plate_name", "slot": "source_plate_slot"},
+            {"well": "destination_well", "volume": ["spotting_volume"], "labware": "agar_plate_name",
+             "location_column": "agar_plate_location", "destination": True},
+        ],
+    },
+    "protocol-3": {
+        "params": {**PIPETTE_PARAMS, "media_plate_name": "labware", "media_plate_slot": "slot",
+                   "destination_plate_name": "labware", "destination_plate_slot": "slot", **AGAR_PARAMS,
+                   "agar_pierce_depth": "number", "sampling_method": "text"},
+        "columns": ["colony_id", "agar_plate_location", "colony_well", "media_id", "media_well", "media_volume", "destination_well"],
+        "plates": [
+            {"well": "colony_well", "volume": [], "labware": "agar_plate_name", "location_column": "agar_plate_location"},
+            {"well": "media_well", "volume": ["media_volume"], "labware": "media_plate_name", "slot": "media_plate_slot"},
+            {"well": "destination_well", "volume": ["media_volume"], "labware": "destination_plate_name",
+             "slot": "destination_plate_slot", "destination": True},
+            # colonies are mixed in the media plate well named after their destination well
+            {"well": "destination_well", "volume": [], "labware": "media_plate_name", "slot": "media_plate_slot"},
+        ],
+    },
+    "protocol-4": {
+        "params": {**PIPETTE_PARAMS,
+                   **{f"{plate}_plate_{key}": kind for plate in ["media", "culture", "inducer", "destination"]
+                      for key, kind in [("name", "labware"), ("slot", "slot")]}},
+        "columns": ["culture_id", "culture_well", "culture_volume", "media_id", "media_well", "media_volume",
+                    "inducer_id", "inducer_well", "inducer_volume", "destination_well"],
+        "plates": [
+            {"well": "culture_well", "volume": ["culture_volume"], "labware": "culture_plate_name", "slot": "culture_plate_slot", "skip_na": True},
+            {"well": "media_well", "volume": ["media_volume"], "labware": "media_plate_name", "slot": "media_plate_slot", "skip_na": True},
+            {"well": "inducer_well", "volume": ["inducer_volume"], "labware": "inducer_plate_name", "slot": "inducer_plate_slot", "skip_na": True},
+            {"well": "destination_well", "volume": ["culture_volume", "media_volume", "inducer_volume"],
+             "labware": "destination_plate_name", "slot": "destination_plate_slot", "destination": True},
+        ],
+    },
+}
+
+class ValidationError(ValueError):
+    """Raised when an experiment does not pass validation, with the list of its errors."""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+def slot_number(slot: Any) -> Optional[int]:
+    """Return the deck slot of a parameter value (e.g. 1 or "1"), or None if it is not a slot."""
+    try:
+        return int(slot) if int(slot) in DECK_SLOTS else None
+    except (TypeError, ValueError):
+        return None
+
+def check_param(key: str, value: Any, kind: str) -> Optional[str]:
+    """Check the type of a parameter, returning an error message if invalid."""
+    if kind == "number" and not (isinstance(value, (int, float)) and not isinstance(value, bool)):
+        return f"Parameter {key} must be a number, got {value!r}."
+    if kind == "numbers" and not (isinstance(value, list) and all(isinstance(v, (int, float)) for v in value)):
+        return f"Parameter {key} must be a list of numbers, got {value!r}."
+    if kind == "slot" and value != "thermocycler" and slot_number(value) is None:
+        return f"Parameter {key} must be a deck slot (1-11) or thermocycler, got {value!r}."
+    if kind == "slots" and not (isinstance(value, list) and value and all(slot_number(v) is not None for v in value)):
+        return f"Parameter {key} must be a list of deck slots (1-11), got {value!r}."
+    if kind == "mount" and value not in ("left", "right"):
+        return f"Parameter {key} must be left or right, got {value!r}."
+    if kind in ("text", "labware", "pipette") and not isinstance(value, str):
+        return f"Parameter {key} must be a string, got {value!r}."
+    if kind == "pipette" and value != "NA":
+        try:
+            pipette_max_volume(value)
+        except PlanError as error:
+            return str(error)
+    return None
+
+def unmounted(key: str, params: Dict[str, Any]) -> bool:
+    """Check whether a parameter belongs to the tip racks of an unmounted ("NA") pipette."""
+    side = key.split("_")[0]
+    return key.startswith(f"{side}_pipette_tiprack") and params.get(f"{side}_pipette_name") == "NA"
+
+def schema_params(protocol: str, params: Dict[str, Any]) -> Dict[str, str]:
+    """Return the kind of every parameter of the protocol, including its optional parameters if any of them is set."""
+    optional = VALIDATION_SCHEMAS[protocol].get("optional_params", {})
+    if any(params.get(key, "NA") != "NA" for key in optional):
+        return {**VALIDATION_SCHEMAS[protocol]["params"], **optional}
+    return VALIDATION_SCHEMAS[protocol]["params"]
+
+def check_params(protocol: str, params: Dict[str, Any]) -> List[str]:
+    """Check that every parameter of the protocol is present and of the right kind."""
+    errors = []
+    for key, kind in schema_params(protocol, params).items():
+        if key not in params:
+            errors.append(f"Missing parameter in the JSON file: {key}")
+        elif not unmounted(key, params):
+            errors.append(check_param(key, params[key], kind))
+    if "agar_plate_slot" in params:
+        for key in ["empty_agar_plate_weight", "agar_plate_weight"]:
+            if isinstance(params.get(key), list) and len(params[key]) != len(params["agar_plate_slot"]):
+                errors.append(f"Parameter {key} must have one value per agar_plate_slot.")
+    return [error for error in errors if error is not None]
+
+def check_deck(protocol: str, params: Dict[str, Any]) -> List[str]:
+    """Check that no deck slot holds two labware, except plates of the same labware reused by the protocol."""
+    slots, errors = {}, []
+    for key, kind in schema_params(protocol, params).items():
+        if kind not in ("slot", "slots") or unmounted(key, params):
+            continue
+        value = params[key]
+        if value == "thermocycler":
+            placed = [(slot, "thermocycler") for slot in THERMOCYCLER_SLOTS]
+        else:
+            name = params["tiprack_name"] if key == "tiprack_slots" else params[key.replace("_slot", "_name")]
+            placed = [(slot_number(slot), name) for slot in (value if kind == "slots" else [value])]
+        for slot, name in placed:
+            if slot in slots and not (protocol in REUSED_PLATES and kind == "slot" and slots[slot] == (name, kind)):
+                errors.append(f"Slot {slot} of {key} already holds {slots[slot][0]}, cannot load {name}.")
+            slots.setdefault(slot, (name, kind))
+    return errors
+
+def well_volumes(protocol: str, params: Dict[str, Any], rows: List[Dict[str, Any]], labware_dir: str) -> Tuple[Dict[Tuple[Any, str], Dict[str, Any]], List[str]]:
+    """Sum the volumes drawn from and added to each well of the plates of the protocol, in a single pass over the CSV rows.
+    Return the volumes by (slot, well) with the labware of the well, and the errors of wells that cannot be placed."""
+    errors, volumes = [], {}
+    agar_slots = {slot_number(slot) for slot in params.get("agar_plate_slot", [])}
+    plates = []
+    for plate in VALIDATION_SCHEMAS[protocol]["plates"]:
+        if plate.get("optional") and params.get(plate["slot"], "NA") == "NA":
+            continue
+        labware_name = params.get(plate["labware"])
+        plates.append((plate, labware_name, registry(labware_dir).get(labware_name) if isinstance(labware_name, str) else None))
+
+    for line, row in enumerate(rows, start=2):
+        for plate, labware_name, labware in plates:
+            # wells of a plate whose location is not configured are still checked, but their volumes are not summed
+            placed = True
+            if "location_column" in plate:
+                slot = slot_number(row[plate["location_column"]])
+                if slot not in agar_slots:
+                    errors.append(f"Line {line}: {plate['location_column']} {row[plate['location_column']]} is not in agar_plate_slot {params.get('agar_plate_slot')}.")
+                    placed = False
+            else:
+                slot = params.get(plate["slot"])
+                slot = slot if slot == "thermocycler" else slot_number(slot)
+            volume = sum(float(row[column]) for column in plate["volume"])
+            for well in row[plate["well"]].split("|"):
+                if well == "NA" and plate.get("skip_na"):
+                    continue
+                if labware is not None and well not in labware.wells:
+                    errors.append(f"Line {line}: well {well} of {plate['well']} does not exist on {labware_name}.")
+                    continue
+                if not placed:
+                    continue
+                entry = volumes.setdefault((slot, well), {"labware": labware, "drawn": 0.0, "added": 0.0})
+                entry["added" if plate.get("destination") else "drawn"] += volume
+    return volumes, errors
+
+def volume_errors(volumes: Dict[Tuple[Any, str], Dict[str, Any]]) -> List[str]:
+    """Check that the volumes drawn from and added to each well fit in the well."""
+    errors = []
+    for (slot, well), entry in volumes.items():
+        labware = entry["labware"]
+        if labware is None:
+            continue
+        capacity = labware.wells[well].volume
+        for volume, action in [(entry["drawn"], "drawn from"), (entry["added"], "added to")]:
+            if volume > capacity:
+                errors.append(f"{volume:g} uL {action} well {well} in slot {slot} exceed the {capacity:g} uL of {labware.name}.")
+    return errors
+
+def check_wells(protocol: str, params: Dict[str, Any], rows: List[Dict[str, Any]], labware_dir: str) -> List[str]:
+    """Check the wells and volumes of the CSV rows against the labware of each plate."""
+    volumes, errors = well_volumes(protocol, params, rows, labware_dir)
+    return errors + volume_errors(volumes)
+
+def check_pipettes(protocol: str, params: Dict[str, Any], rows: List[Dict[str, str]]) -> List[str]:
+    """Check that volumes aspirated at once, without being split by transfer(), fit in the pipette selected for them."""
+    if protocol == "protocol-2":
+        max_volume = pipette_max_volume(params["pipette_name"])
+        return [f"Line {line}: spotting_volume {row['spotting_volume']} plus additional_volume {params['additional_volume']} "
+                f"exceeds the {max_volume:g} uL of {params['pipette_name']}."
+                for line, row in enumerate(rows, start=2)
+                if float(row["spotting_volume"]) + params["additional_volume"] > max_volume]
+
+    pipettes, errors = mounted_pipettes(params), []
+    for column, mix_volume in SINGLE_ASPIRATIONS.get(protocol, []):
+        try:
+            mount = select_pipette([float(row[column]) for row in rows], pipettes) if column else select_sampling_pipette(pipettes)
+        except PlanError as error:
+            errors.append(str(error))
+            continue
+        pipette_name = pipettes[mount]
+        max_volume = pipette_max_volume(pipette_name)
+        if mix_volume is not None:
+            if mix_volume > max_volume:
+                step = column[:-len("_volume")] if column else "sampling"
+                errors.append(f"The {mix_volume:g} uL mix of the {step} step exceeds the {max_volume:g} uL of {pipette_name}.")
+            continue
+        # wells without a source are skipped by the planner
+        errors += [f"Line {line}: {column} {row[column]} exceeds the {max_volume:g} uL of {pipette_name}, "
+                   f"selected for the smallest {column} of {min(float(row[column]) for row in rows):g} uL, and is aspirated at once."
+                   for line, row in enumerate(rows, start=2)
+                   if row[column.replace("_volume", "_well")] != "NA" and float(row[column]) > max_volume]
+    return errors
+
+def check_rows(protocol: str, rows: List[Dict[str, str]]) -> List[str]:
+    """Check that every column of the protocol is present and that volumes are non-negative numbers."""
+    columns = VALIDATION_SCHEMAS[protocol]["columns"]
+    missing = [column for column in columns if rows and column not in rows[0]]
+    if missing:
+        return [f"Missing column in the CSV file: {column}" for column in missing]
+    errors = []
+    for line, row in enumerate(rows, start=2):
+        for column in columns:
+            if row[column] is None or row[column] == "":
+                errors.append(f"Line {line}: empty value in column {column}.")
+            elif "volume" in column:
+                try:
+                    if float(row[column]) < 0:
+                        errors.append(f"Line {line}: negative volume in column {column}: {row[column]}.")
+                except ValueError:
+                    errors.append(f"Line {line}: invalid volume in column {column}: {row[column]}.")
+    return errors
+
+def validate_experiment(protocol: str, params: Dict[str, Any], rows: List[Dict[str, str]], labware_dir: str) -> List[str]:
+    """Validate the parameters and CSV rows of an experiment, returning all errors found."""
+    errors = check_params(protocol, params) + check_rows(protocol, rows)
+    if not rows:
+        errors.append("The CSV file has no rows.")
+    if errors:
+        # the labware and volume checks need well-formed parameters and rows
+        return errors
+
+    errors += check_deck(protocol, params)
+    for key, kind in schema_params(protocol, params).items():
+        if kind == "labware" and not unmounted(key, params) and registry(labware_dir).get(params[key]) is None and STANDARD_LIBRARY:
+            errors.append(f"Unknown labware {params[key]} of {key}, not found in {labware_dir} or the Opentrons labware library.")
+    return errors + check_wells(protocol, params, rows, labware_dir) + check_pipettes(protocol, params, rows)
+
+def validate_files(protocol: str, json_file: str, csv_file: str, labware_dir: str) -> None:
+    """Validate the JSON parameters and CSV data files of an experiment, raising ValidationError with all errors found."""
+    try:
+        with open(json_file) as f:
+            params = json.load(f)
+    except json.JSONDecodeError as error:
+        raise ValidationError([f"Invalid JSON file {json_file}: {error}"])
+    with open(csv_file, newline="") as f:
+        rows = list(csv.DictReader(f))
+    errors = validate_experiment(protocol, params, rows, labware_dir)
+    if errors:
+        raise ValidationError(errors)
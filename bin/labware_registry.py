@@ -0,0 +1,79 @@
+"""labware_registry.py
+
+    Registry of labware definitions, indexed once per directory and loaded lazily.
+
+    The index maps the load name of each definition of the labware directory to its file, without parsing it.
+    Definitions are parsed on first use, falling back to the Opentrons standard library when installed, and kept
+    in a compact form: the plate dimensions and a well lookup of name -> (x, y, z, depth, volume).
+"""
+
+import json
+import os
+from functools import lru_cache
+from typing import Any, Dict, NamedTuple, Optional
+
+try:
+    from opentrons_shared_data.labware import load_definition
+except ImportError: # standard labware is not available without the Opentrons package
+    load_definition = None
+
+# whether labware missing from the directory can be looked up in the standard library
+STANDARD_LIBRARY = load_definition is not None
+
+class Well(NamedTuple):
+    """Position of the well bottom in the labware, depth and maximum volume of a well."""
+    x: float
+    y: float
+    z: float
+    depth: float
+    volume: float
+
+class Labware(NamedTuple):
+    """Compact labware definition: footprint dimensions and wells by name."""
+    name: str
+    dimensions: Dict[str, float]
+    wells: Dict[str, Well]
+
+class LabwareRegistry:
+    """Index of the labware definitions of a directory, parsing each definition on first use."""
+
+    def __init__(self, labware_dir: str):
+        self.labware_dir = labware_dir
+        self._index = None
+        self._labware = {}
+
+    @property
+    def index(self) -> Dict[str, str]:
+        """Map the load name of each definition of the labware directory to its file."""
+        if self._index is None:
+            entries = os.scandir(self.labware_dir) if os.path.isdir(self.labware_dir) else []
+            self._index = {entry.name[:-len(".json")]: entry.path for entry in entries if entry.name.endswith(".json")}
+        return self._index
+
+    def definition(self, name: str) -> Optional[Dict[str, Any]]:
+        """Parse the full definition of a labware, or return None if it is unknown."""
+        if name in self.index:
+            with open(self.index[name]) as f:
+                return json.load(f)
+        if load_definition is not None:
+            try:
+                return load_definition(name, 1)
+            except Exception: # unknown load names raise errors specific to each Opentrons version
+                return None
+        return None
+
+    def get(self, name: str) -> Optional[Labware]:
+        """Return the compact definition of a labware, or None if it is unknown."""
+        if name not in self._labware:
+            definition = self.definition(name)
+            self._labware[name] = None if definition is None else Labware(
+                name=name,
+                dimensions=definition["dimensions"],
+                wells={well: Well(info["x"], info["y"], info["z"], info["depth"], info["totalLiquidVolume"])
+                       for well, info in definition["wells"].items()})
+        return self._labware[name]
+
+@lru_cache(maxsize=None)
+def registry(labware_dir: str) -> LabwareRegistry:
+    """Return the registry of a labware directory, shared by all callers of the process."""
+    return LabwareRegistry(labware_dir)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""optimise-layout.py
+
+    Propose deck layouts minimising the head travel of experiments, and optionally apply them.
+
+    The transfers of each experiment are planned as when compiled (see step_plan.py, and transfer_optimiser.py
+    with --optimise), and the path of the head over the deck during every step is traced with the deck model of
+    transfer_optimiser.py, wells positioned from the labware definitions. Labware are then moved between deck slots, swapping two labware or moving one to a
+    free slot at a time, as long as the path gets shorter. Plates sharing a slot move together, while the
+    thermocycler, the trash and the labware of the parameters given with --fixed keep their slots.
+
+    The new slots of each experiment, its head travel before and after, and the estimated time saved are saved
+    as JSON to the report file. With --apply, each experiment is saved with its new layout as <out_dir>/<id>-config.json
+    and <out_dir>/<id>-data.csv, with agar plate locations of the data moved along with their plates.
+
+    Usage:
+        optimise-layout.py [-O <out_dir>] [-r <report_file>] [-l <labware_dir>] [-f <params>] [-p] [-a] (<id> <csv_file> <json_file>)...
+
+    Input:
+    <id>             Experiment identifier ending with its protocol (e.g. protocol-1).
+    <csv_file>       Path to the CSV file containing experiment data.
+    <json_file>      Path to the JSON file containing protocol parameters.
+
+    Options:
+    -O, --output-dir <out_dir>        Output directory of the experiments with --apply [default: layout].
+    -r, --report <report_file>        Proposed layouts and estimated savings [default: layout.json].
+    -l, --labware-dir <labware_dir>   Directory of the custom labware definitions [default: assets/labware].
+    -f, --fixed <params>              Comma separated slot parameters whose labware are not moved, e.g. media_plate_slot.
+    -p, --optimise                    Trace the transfers as optimised by protocol-compiler.py --optimise.
+    -a, --apply                       Save the experiments with their proposed layouts.
+    -h --help                         Show this screen.
+"""
+
+import csv
+import json
+import math
+import os
+import re
+import sys
+import warnings
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from docopt import docopt
+
+from experiment_validator import DECK_SLOTS, THERMOCYCLER_SLOTS, VALIDATION_SCHEMAS, schema_params, unmounted
+import step_plan
+from transfer_optimiser import HEAD_SPEED, STEP_RULES, labware_definition, optimise_plan, step_path, well_position
+
+# head moves between two (slot, well, labware) locations, with their number
+Location = Tuple[Any, Optional[str], Optional[str]]
+Moves = Dict[Tuple[Location, Location], int]
+
+def deck_slot(slot: Any) -> Any:
+    """Return a deck slot as a number, or "thermocycler"."""
+    return slot if slot == "thermocycler" else int(slot)
+
+def head_moves(protocol: str, params: Dict[str, Any], plan: Dict[str, Any]) -> Moves:
+    """Count the moves of the head between (slot, well, labware) locations over the steps of a plan, each pipette
+    picking up tips from its racks in order."""
+    moves, tips = Counter(), Counter()
+    for name, step in plan.items():
+        rule = STEP_RULES[protocol][name]
+        for step_pass in step_plan.step_passes(step):
+            mount = step_pass["pipette"]
+            path, step_tips, _ = step_path(step_pass["transfers"], rule, params, mount, step.get("multi_dispense", False), tips[mount])
+            tips[mount] += step_tips
+            path = [(deck_slot(slot), well, labware) for slot, well, labware in path]
+            moves.update(zip(path, path[1:]))
+    return moves
+
+def travel(moves: Moves, layout: Dict[int, int], labware_dir: Optional[str] = None) -> float:
+    """Return the head travel in mm of the moves, with the labware of each slot of the layout moved to its new slot."""
+    position = lambda slot, well, labware: well_position(layout.get(slot, slot), well, labware_definition(labware_dir, labware))
+    return sum(count * math.dist(position(*location), position(*other)) for (location, other), count in moves.items())
+
+def slot_values(params: Dict[str, Any], key: str, kind: str) -> List[Any]:
+    """Return the slots of a slot or slots parameter."""
+    return params[key] if kind == "slots" else [params[key]]
+
+def deck_slots(protocol: str, params: Dict[str, Any], fixed: Set[str]) -> Tuple[List[int], List[int]]:
+    """Return the slots of the labware that can be moved, and the slots they can be moved to."""
+    movable, pinned = set(), set()
+    for key, kind in schema_params(protocol, params).items():
+        if kind not in ("slot", "slots") or unmounted(key, params):
+            continue
+        slots = slot_values(params, key, kind)
+        if "thermocycler" in slots:
+            pinned |= set(THERMOCYCLER_SLOTS)
+        else:
+            (pinned if key in fixed else movable).update(int(slot) for slot in slots)
+    return sorted(movable - pinned), sorted(DECK_SLOTS - pinned)
+
+def optimise_layout(moves: Moves, movable: List[int], slots: List[int], labware_dir: Optional[str] = None) -> Dict[int, int]:
+    """Move labware between slots while the head travel decreases, returning the new slot of each movable slot."""
+    layout = {slot: slot for slot in movable}
+    best, improved = travel(moves, layout, labware_dir), True
+    while improved:
+        improved = False
+        for slot in movable:
+            for target in slots:
+                if target == layout[slot]:
+                    continue
+                # the labware already in the target slot, if any, takes the place of the moved one
+                candidate = {other: layout[slot] if new_slot == target else new_slot for other, new_slot in layout.items()}
+                candidate[slot] = target
+                distance = travel(moves, candidate, labware_dir)
+                if distance < best - 1e-6:
+                    layout, best, improved = candidate, distance, True
+    return {slot: new_slot for slot, new_slot in layout.items() if new_slot != slot}
+
+def move_params(protocol: str, params: Dict[str, Any], layout: Dict[int, int]) -> Dict[str, Any]:
+    """Return the parameters of an experiment with the slots of its labware moved as given by the layout."""
+    moved = dict(params)
+    for key, kind in schema_params(protocol, params).items():
+        if kind not in ("slot", "slots") or unmounted(key, params) or params[key] == "thermocycler":
+            continue
+        slots = [layout.get(int(slot), slot) for slot in slot_values(params, key, kind)]
+        moved[key] = slots if kind == "slots" else slots[0]
+    return moved
+
+def move_rows(protocol: str, rows: List[Dict[str, str]], layout: Dict[int, int]) -> List[Dict[str, str]]:
+    """Return the data rows of an experiment with the agar plate locations moved as given by the layout."""
+    columns = [plate["location_column"] for plate in VALIDATION_SCHEMAS[protocol]["plates"] if "location_column" in plate]
+    return [{**row, **{column: str(layout.get(int(row[column]), row[column])) for column in columns}} for row in rows]
+
+def propose_layout(protocol: str, params: Dict[str, Any], csv_content: str, fixed: Set[str], optimise: bool,
+                   labware_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Propose the layout of an experiment, with the slots moved, its head travel before and after, and the time saved."""
+    plan = step_plan.build_plan(protocol, params, csv_content, labware_dir)
+    if optimise:
+        plan, _ = optimise_plan(protocol, params, plan, labware_dir)
+    moves = head_moves(protocol, params, plan)
+    layout = optimise_layout(moves, *deck_slots(protocol, params, fixed), labware_dir)
+    before, after = travel(moves, {}, labware_dir), travel(moves, layout, labware_dir)
+    moved = move_params(protocol, params, layout)
+    return {"layout": layout,
+            "params": {key: {"before": params[key], "after": moved[key]} for key in params if moved[key] != params[key]},
+            "travel_mm": {"before": round(before, 1), "after": round(after, 1)},
+            "seconds_saved": round((before - after) / HEAD_SPEED, 1)}
+
+def save_experiment(experiment: Dict[str, str], protocol: str, layout: Dict[int, int], out_dir: str) -> None:
+    """Save the config and data of an experiment with its new layout."""
+    with open(experiment["config"]) as f:
+        params = json.load(f)
+    with open(experiment["data"], newline="") as f:
+        reader = csv.DictReader(f)
+        fieldnames, rows = reader.fieldnames, list(reader)
+    with open(os.path.join(out_dir, f"{experiment['id']}-config.json"), "w") as f:
+        json.dump(move_params(protocol, params, layout), f, indent=4)
+    with open(os.path.join(out_dir, f"{experiment['id']}-data.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(move_rows(protocol, rows, layout))
+
+def main():
+    args = docopt(__doc__)
+    fixed = set(args["--fixed"].split(",")) if args["--fixed"] else set()
+    warnings.simplefilter("ignore", step_plan.PlanWarning) # reported when the experiments are compiled
+    if args["--apply"]:
+        os.makedirs(args["--output-dir"], exist_ok=True)
+
+    proposals = {}
+    for id, csv_file, json_file in zip(args["<id>"], args["<csv_file>"], args["<json_file>"]):
+        protocol = re.search(r"protocol-\d+", id)
+        if protocol is None or protocol.group(0) not in step_plan.PLANNERS:
+            sys.exit(f"Cannot identify the protocol of {id}, expected one of {', '.join(step_plan.PLANNERS)}.")
+        with open(json_file) as f:
+            params = json.load(f)
+        with open(csv_file) as f:
+            csv_content = f.read()
+        try:
+            proposal = propose_layout(protocol.group(0), params, csv_content, fixed, args["--optimise"], args["--labware-dir"])
+        except step_plan.PlanError as error:
+            sys.exit(f"{id}: {error}")
+        if args["--apply"]:
+            save_experiment({"id": id, "data": csv_file, "config": json_file}, protocol.group(0), proposal["layout"], args["--output-dir"])
+        moves = ", ".join(f"{key} {value['before']} -> {value['after']}" for key, value in proposal["params"].items())
+        print(f"{id}: {proposal['travel_mm']['before']:g} -> {proposal['travel_mm']['after']:g} mm of head travel, "
+              f"{proposal['seconds_saved']:g} s saved (estimated){': ' + moves if moves else ''}")
+        proposals[id] = {**proposal, "layout": {str(slot): new_slot for slot, new_slot in proposal["layout"].items()}}
+
+    with open(args["--report"], "w") as f:
+        json.dump({"protocols": proposals, "applied": args["--apply"],
+                   "seconds_saved": round(sum(proposal["seconds_saved"] for proposal in proposals.values()), 1)}, f, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""plot-labware.py
+
+    Plot the plate layouts of a labware CSV (see create-labware.py) with visualise-labware.R, one plot per
+    plate saved as plots/NN-slot-<location>-<labware>-labware.png, drawing the plates in parallel.
+
+    With a cache directory, each plate is fingerprinted from its CSV rows, its labware definition and the
+    plotting script, and its plot is copied from the cache when unchanged: only new or modified plates are
+    drawn, in a single R process.
+
+    Usage:
+        plot-labware.py [-j <jobs>] [-c <cache_dir>] [-s <cache_size>] <csv_file> <labware_dir>
+
+    Options:
+    -j, --jobs <jobs>                   Number of plates drawn in parallel [default: 1].
+    -c, --cache-dir <cache_dir>         Directory of the plate plots cache, disabled if not set.
+    -s, --cache-size <cache_size>       Maximum size of the plate plots cache in MB [default: 256].
+    -h --help                           Show this screen.
+"""
+
+import csv
+import glob
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+from docopt import docopt
+
+from content_cache import ContentCache, hash_content
+
+VISUALISE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "visualise-labware.R")
+
+Plate = Tuple[str, str]
+
+def split_plates(csv_file: str) -> Dict[Plate, List[Dict[str, str]]]:
+    """Split the rows of a labware CSV by deck location and labware, in order of appearance as done by visualise-labware.R."""
+    plates = {}
+    with open(csv_file, newline="") as f:
+        for row in csv.DictReader(f):
+            plates.setdefault((row["location"], row["labware"]), []).append(row)
+    return plates
+
+def plates_csv(plates: Dict[Plate, List[Dict[str, str]]]) -> str:
+    """Format the rows of plates as a labware CSV."""
+    output = io.StringIO()
+    fieldnames = list(next(iter(plates.values()))[0])
+    writer = csv.DictWriter(output, fieldnames=fieldnames, lineterminator="\n")
+    writer.writeheader()
+    for rows in plates.values():
+        writer.writerows(rows)
+    return output.getvalue()
+
+def plate_key(plate: Plate, rows: List[Dict[str, str]], labware_dir: str) -> str:
+    """Fingerprint everything the plot of a plate depends on."""
+    location, labware_name = plate
+    labware_file = os.path.join(labware_dir, f"{labware_name}.json")
+    # unknown labware are reported by visualise-labware.R
+    labware = b""
+    if os.path.exists(labware_file):
+        with open(labware_file, "rb") as f:
+            labware = f.read()
+    with open(VISUALISE_SCRIPT, "rb") as f:
+        script = f.read()
+    return hash_content(location, labware_name, plates_csv({plate: rows}), labware, script)
+
+def plot_plates(csv_file: str, labware_dir: str, work_dir: str, jobs: int) -> None:
+    """Plot every plate of a labware CSV to <work_dir>/plots."""
+    subprocess.run(["Rscript", VISUALISE_SCRIPT, os.path.abspath(csv_file), os.path.abspath(labware_dir), str(jobs)],
+                   cwd=work_dir, check=True)
+
+def plot_name(index: int, plate: Plate) -> str:
+    """Return the file name of the plot of the index-th plate, as named by visualise-labware.R."""
+    location, labware = plate
+    return f"{index:02d}-slot-{location}-{labware}-labware.png"
+
+def main():
+    args = docopt(__doc__)
+    csv_file, labware_dir, jobs = args["<csv_file>"], args["<labware_dir>"], int(args["--jobs"])
+    if not args["--cache-dir"]:
+        plot_plates(csv_file, labware_dir, ".", jobs)
+        return
+
+    cache = ContentCache(args["--cache-dir"], "plots", int(args["--cache-size"]) * 1024 * 1024)
+    os.makedirs("plots", exist_ok=True)
+    plates = split_plates(csv_file)
+    keys, missing = {}, {}
+    for index, (plate, rows) in enumerate(plates.items(), start=1):
+        keys[plate] = plate_key(plate, rows, labware_dir)
+        content = cache.get(keys[plate])
+        if content is None:
+            missing[plate] = rows
+            continue
+        with open(os.path.join("plots", plot_name(index, plate)), "wb") as f:
+            f.write(content)
+
+    if missing:
+        # plot only the missing plates, then number their plots by their position among all plates
+        with tempfile.TemporaryDirectory() as work_dir:
+            missing_file = os.path.join(work_dir, "labware.csv")
+            with open(missing_file, "w") as f:
+                f.write(plates_csv(missing))
+            plot_plates(missing_file, labware_dir, work_dir, jobs)
+            for index, plate in enumerate(plates, start=1):
+                if plate not in missing:
+                    continue
+                plot_file, = glob.glob(os.path.join(work_dir, "plots", "*-slot-{}-{}-labware.png".format(*map(glob.escape, plate))))
+                with open(plot_file, "rb") as f:
+                    cache.put(keys[plate], f.read())
+                shutil.move(plot_file, os.path.join("plots", plot_name(index, plate)))
+
+    cache.evict()
+    cache.save_stats()
+    print(f"plot cache: {cache.stats['hits']} hits, {cache.stats['misses']} misses", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,316 @@
 #!/usr/bin/env python
 
-"""protocol-compiler.py 
+"""protocol-compiler.py
 
-    Build a protocol for the Opentrons OT2 using a template protocol file, 
+    Build a protocol for the Opentrons OT2 using a template protocol file,
     a json parameters file, and CSV file.
 
+    The CSV data is validated and planned at compile time (see step_plan.py): compiled protocols embed
+    the parameters as PROTOCOL_PARAMS and the resolved pipettes and transfers of each step as STEP_PLAN.
+    The helpers shared by the templates live in the runtime library of the template directory (protocol-runtime.py):
+    the definitions used by a template are inlined as RUNTIME_LIBRARY, with the imports they need as RUNTIME_IMPORTS.
+    With --optimise, transfers are reordered and media is multi-dispensed where contamination rules allow
+    (see transfer_optimiser.py), and the estimated savings of each protocol are saved as JSON to the report file.
+    Every protocol is checked against its volume ledger and tip inventory (see volume_ledger.py): compilation fails
+    if a well is overdrawn or overfilled or a pipette runs out of tips, and ledgers are saved as JSON with --ledger.
+    With --telemetry, compiled protocols time each of their sections and transfer passes when run on the robot, saving
+    the timings to a telemetry file of the given directory of the robot (see Telemetry in protocol-runtime.py and
+    analyse-telemetry.py), named after the id of the protocol and the start of the run.
+
+    In batch mode, compile every protocol listed in a manifest CSV (columns: id, template, config, data)
+    or every <id>-config.json/<id>-data.csv pair found in a directory, loading the templates only once.
+    For directories, the template is inferred from the trailing "protocol-N" of the id.
+
+    With a cache directory, protocols whose template, runtime library, JSON, CSV and compiler version are unchanged
+    are copied from the cache instead of being rendered again.
+
     Usage:
-        protocol-compiler.py [-d --template-dir <template_dir>] [-o --output-file <out_file>] <template_file> <json_file> <csv_file>
+        protocol-compiler.py [-d <template_dir>] [-o <out_file>] [-l <labware_dir>] [-L <ledger_file>] [-c <cache_dir>] [-s <cache_size>] [-t <telemetry_dir>] [-p [-R <report_file>]] <template_file> <json_file> <csv_file>
+        protocol-compiler.py batch [-d <template_dir>] [-O <out_dir>] [-j <jobs>] [-l <labware_dir>] [-L <ledger_file>] [-c <cache_dir>] [-s <cache_size>] [-t <telemetry_dir>] [-p [-R <report_file>]] <manifest>
 
     Options:
-    -d, --template-dir            Directory containing protocol templates [default: templates/]
-    -o, --output-file             Output file [default: compiled_protocol.py].
-    -h --help                     Show this screen.
-    --version                     Show version.
+    -d, --template-dir <template_dir>   Directory containing protocol templates [default: templates/]
+    -o, --output-file <out_file>        Output file [default: compiled_protocol.py].
+    -O, --output-dir <out_dir>          Output directory for batch mode, protocols are saved as <id>.py [default: .].
+    -j, --jobs <jobs>                   Number of worker processes for batch mode [default: 1].
+    -l, --labware-dir <labware_dir>     Directory of the custom labware definitions [default: assets/labware].
+    -L, --ledger <ledger_file>          Volume ledgers and tip inventories of the protocols as JSON.
+    -c, --cache-dir <cache_dir>         Directory of the compiled protocols cache, disabled if not set.
+    -s, --cache-size <cache_size>       Maximum size of the compiled protocols cache in MB [default: 256].
+    -t, --telemetry <telemetry_dir>     Directory of the robot saving the timings of the protocol runs, disabled if not set.
+    -p, --optimise                      Optimise the order of transfers and multi-dispense media.
+    -R, --report <report_file>          Estimated savings of the optimised protocols [default: optimisation.json].
+    -h --help                           Show this screen.
+    --version                           Show version.
 """
 
+import ast
+import copy
+import csv
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pprint import pformat
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from docopt import docopt
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, TemplateNotFound
 
-if __name__ == "__main__":
-    # parse command line arguments
-    arguments = docopt(__doc__, version="plots")
+from content_cache import ContentCache, hash_content, hash_directory
+import experiment_validator
+import labware_registry
+import step_plan
+import transfer_optimiser
+import volume_ledger
+
+__version__ = "0.3.2"
+
+# runtime library of the templates, inlined into the compiled protocols
+RUNTIME_LIBRARY = "protocol-runtime.py"
+IDENTIFIER = re.compile(r"[A-Za-z_]\w*")
+# parts of a compile cache entry, stored as a single JSON object
+CACHE_ENTRY = ["protocol", "savings", "ledger"]
+# jinja environment, runtime library source, compile cache and labware directory shared by all compilations in the current process
+_environment = None
+_runtime = None
+_cache = None
+_labware_dir = None
+
+@lru_cache(maxsize=None)
+def compiler_fingerprint() -> str:
+    """Identify the compiler version and source, with the helper modules it plans and checks protocols with, so that
+    cached protocols are invalidated when the compiler changes."""
+    sources = []
+    modules = [step_plan, transfer_optimiser, volume_ledger, experiment_validator, labware_registry]
+    for module_file in [__file__] + [module.__file__ for module in modules]:
+        with open(module_file, "rb") as f:
+            sources.append(f.read())
+    return hash_content(__version__, *sources)
+
+@lru_cache(maxsize=None)
+def labware_fingerprint(labware_dir: str) -> str:
+    """Hash the custom labware definitions once per process, as the volume ledger depends on them."""
+    return hash_directory(labware_dir, ".json") if os.path.isdir(labware_dir) else ""
+
+@lru_cache(maxsize=None)
+def runtime_definitions(library_source: str) -> Tuple[Tuple[ast.stmt, ...], Dict[str, str]]:
+    """Split a runtime library into its import statements and the source of its top-level definitions by name."""
+    lines = library_source.splitlines()
+    imports, definitions = [], {}
+    for node in ast.parse(library_source).body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            imports.append(node)
+            continue
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names = [node.name]
+        elif isinstance(node, ast.Assign):
+            names = [target.id for target in node.targets if isinstance(target, ast.Name)]
+        else: # the module docstring
+            continue
+        start = min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", [])])
+        definitions.update({name: "\n".join(lines[start - 1:node.end_lineno]) for name in names})
+    return tuple(imports), definitions
+
+def imported_names(source: str) -> Set[str]:
+    """Return the names imported by the import lines of a template."""
+    names = set()
+    for line in source.splitlines():
+        if line.startswith(("import ", "from ")):
+            for node in ast.parse(line).body:
+                names.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+    return names
+
+def inline_runtime(template_source: str, library_source: str) -> Tuple[str, str]:
+    """Return the imports and the definitions of the runtime library used by a template, directly or through
+    other definitions, leaving out the rest of the library and the names the template already imports."""
+    imports, definitions = runtime_definitions(library_source)
+    used, pending = set(), [name for name in definitions if name in set(IDENTIFIER.findall(template_source))]
+    while pending:
+        name = pending.pop()
+        if name not in used:
+            used.add(name)
+            pending.extend(word for word in IDENTIFIER.findall(definitions[name]) if word in definitions)
+    inlined = [source for name, source in definitions.items() if name in used]
+
+    needed, available = set(IDENTIFIER.findall("\n".join(inlined))), imported_names(template_source)
+    import_lines = []
+    for node in imports:
+        aliases = [alias for alias in node.names if (alias.asname or alias.name) in needed - available]
+        if aliases:
+            trimmed = copy.copy(node)
+            trimmed.names = aliases
+            import_lines.append(ast.unparse(trimmed))
+    return "\n".join(import_lines), "\n\n".join(inlined)
+
+@lru_cache(maxsize=None)
+def template_runtime(template_file: str) -> Tuple[str, str, str]:
+    """Return the source of a template with the runtime imports and definitions it uses, once per process."""
+    template_source = _environment.loader.get_source(_environment, template_file)[0]
+    return (template_source, *inline_runtime(template_source, _runtime))
 
-    # loading templates
-    environment = Environment(loader=FileSystemLoader(arguments["<template_dir>"]))
-    template = environment.get_template(arguments["<template_file>"])
+def init_compiler(template_dir: str, cache_dir: Optional[str] = None, cache_size: int = 256,
+                  labware_dir: str = "assets/labware") -> Environment:
+    """Create the jinja environment used to load protocol templates and the runtime library, and open the compile cache."""
+    global _environment, _runtime, _cache, _labware_dir
+    _environment = Environment(loader=FileSystemLoader(template_dir), auto_reload=False)
+    try:
+        _runtime = _environment.loader.get_source(_environment, RUNTIME_LIBRARY)[0]
+    except TemplateNotFound: # templates without shared helpers
+        _runtime = ""
+    template_runtime.cache_clear()
+    _cache = ContentCache(cache_dir, "protocols", cache_size * 1024 * 1024) if cache_dir else None
+    _labware_dir = labware_dir
+    return _environment
 
+def compile_protocol(template_file: str, json_file: str, csv_file: str, out_file: str, optimise: bool = False,
+                     telemetry_dir: Optional[str] = None) -> Tuple[bool, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Render a protocol template with the JSON parameters and CSV data, and save it to file,
+    instrumented to save its timings to the telemetry directory of the robot if set.
+    Return whether the protocol was found in the compile cache, the estimated savings if optimised, and its volume ledger.
+    Raise PlanError if the ledger has shortfalls."""
     # read files directly in memory
-    json_file = open(arguments["<json_file>"]).read()
-    csv_file = open(arguments["<csv_file>"]).read()
+    with open(json_file) as f:
+        json_content = f.read()
+    with open(csv_file) as f:
+        csv_content = f.read()
 
-    # render customized template
-    content = template.render(INPUT_JSON_FILE=json_file, INPUT_CSV_FILE=csv_file)
+    content, savings, ledger, key = None, None, None, None
+    telemetry = {"directory": telemetry_dir, "protocol": os.path.splitext(os.path.basename(out_file))[0]} if telemetry_dir else None
+    template_source, runtime_imports, runtime_library = template_runtime(template_file)
+    if _cache is not None:
+        key = hash_content(compiler_fingerprint(), template_file, template_source, _runtime, json_content, csv_content, str(optimise),
+                           labware_fingerprint(_labware_dir), str(telemetry))
+        cached = _cache.get(key)
+        entry = json.loads(cached) if cached is not None else {}
+        # the protocol, savings and ledger are evicted together, and an entry missing any of them is compiled again
+        if all(part in entry for part in CACHE_ENTRY):
+            content, savings, ledger = (entry[part] for part in CACHE_ENTRY)
+
+    hit = content is not None
+    if not hit:
+        # render customized template
+        template = _environment.get_template(template_file)
+        params = json.loads(json_content)
+        protocol = step_plan.protocol_type(template_file)
+        plan = step_plan.build_plan(protocol, params, csv_content, _labware_dir) if protocol is not None else {}
+        if optimise and protocol is not None:
+            plan, savings = transfer_optimiser.optimise_plan(protocol, params, plan, _labware_dir)
+        if protocol is not None:
+            ledger = volume_ledger.build_ledger(protocol, params, step_plan.load_csv_rows(csv_content), plan, _labware_dir)
+            if ledger["shortfalls"]:
+                raise step_plan.PlanError(f"{csv_file} cannot run with {json_file}:\n" + "\n".join(ledger["shortfalls"]))
+        content = template.render(INPUT_JSON_FILE=json_content, INPUT_CSV_FILE=csv_content,
+                                  PROTOCOL_PARAMS=pformat(params, width=120, compact=True, sort_dicts=False),
+                                  STEP_PLAN=pformat(plan, width=120, compact=True, sort_dicts=False),
+                                  TELEMETRY=pformat(telemetry, sort_dicts=False),
+                                  RUNTIME_IMPORTS=runtime_imports, RUNTIME_LIBRARY=runtime_library)
+        if _cache is not None:
+            _cache.put(key, json.dumps(dict(zip(CACHE_ENTRY, (content, savings, ledger)))).encode("utf-8"))
 
     # save template to file
-    with open(arguments["<out_file>"], mode="w", encoding="utf-8") as compiled_protocol:
-        compiled_protocol.write(content)
\ No newline at end of file
+    with open(out_file, mode="w", encoding="utf-8") as compiled_protocol:
+        compiled_protocol.write(content)
+    return hit, savings, ledger
+
+def read_manifest(manifest: str) -> List[Dict[str, str]]:
+    """Read the protocols to compile from a manifest CSV or from a directory of config/data pairs."""
+    if not os.path.isdir(manifest):
+        base_dir = os.path.dirname(manifest)
+        with open(manifest, newline="") as f:
+            entries = list(csv.DictReader(f))
+        for entry in entries:
+            entry["config"] = os.path.join(base_dir, entry["config"])
+            entry["data"] = os.path.join(base_dir, entry["data"])
+        return entries
+
+    entries = []
+    for file_name in sorted(os.listdir(manifest)):
+        if not file_name.endswith("-config.json"):
+            continue
+        protocol_id = file_name[:-len("-config.json")]
+        data_file = os.path.join(manifest, f"{protocol_id}-data.csv")
+        protocol_type = re.search(r"protocol-\d+$", protocol_id)
+        if not os.path.exists(data_file) or protocol_type is None:
+            continue
+        entries.append({
+            "id": protocol_id,
+            "template": f"{protocol_type.group(0)}-template.py",
+            "config": os.path.join(manifest, file_name),
+            "data": data_file,
+        })
+    return entries
+
+def compile_batch(entries: List[Dict[str, str]], template_dir: str, out_dir: str, jobs: int = 1,
+                  cache_dir: Optional[str] = None, cache_size: int = 256, optimise: bool = False,
+                  labware_dir: str = "assets/labware", telemetry_dir: Optional[str] = None) -> List[Tuple[bool, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+    """Compile all manifest entries in this process, or across a pool of worker processes.
+    Return for each entry whether it was found in the compile cache, its estimated savings if optimised, and its volume ledger."""
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [(entry["template"], entry["config"], entry["data"], os.path.join(out_dir, f"{entry['id']}.py"), optimise, telemetry_dir)
+             for entry in entries]
+
+    if jobs <= 1 or len(tasks) <= 1:
+        init_compiler(template_dir, cache_dir, cache_size, labware_dir)
+        return [compile_protocol(*task) for task in tasks]
+
+    # each worker loads the jinja environment once and reuses it for all its protocols
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_compiler, initargs=(template_dir, cache_dir, cache_size, labware_dir)) as pool:
+        return list(pool.map(compile_protocol, *zip(*tasks), chunksize=max(1, len(tasks) // (jobs * 4))))
+
+def report_savings(report_file: str, savings: Dict[str, Optional[Dict[str, Any]]]) -> None:
+    """Save the estimated savings of the optimised protocols and report their totals on stderr."""
+    savings = {protocol_id: report for protocol_id, report in savings.items() if report is not None}
+    totals = {metric: round(sum(report["saved"][metric] for report in savings.values()), 1)
+              for metric in ["tips", "aspirations", "travel_mm", "seconds"]}
+    with open(report_file, "w") as f:
+        json.dump({"protocols": savings, "saved": totals}, f, indent=1)
+    print(f"optimiser: {totals['tips']} tips, {totals['aspirations']} aspirations, {totals['travel_mm']} mm of travel "
+          f"and {totals['seconds']} s saved (estimated)", file=sys.stderr)
+
+def report_ledgers(ledger_file: str, ledgers: Dict[str, Optional[Dict[str, Any]]]) -> None:
+    """Save the volume ledgers and tip inventories of the protocols and report the tips needed on stderr."""
+    ledgers = {protocol_id: ledger for protocol_id, ledger in ledgers.items() if ledger is not None}
+    with open(ledger_file, "w") as f:
+        json.dump({"protocols": ledgers}, f, indent=1)
+    tips = sum(tips["needed"] for ledger in ledgers.values() for tips in ledger["tips"].values())
+    print(f"ledger: {len(ledgers)} protocols, {tips} tip pick-ups", file=sys.stderr)
+
+def report_cache(cache_dir: str, cache_size: int, hits: List[bool]) -> None:
+    """Evict old protocols from the compile cache and report hit/miss statistics on stderr."""
+    cache = ContentCache(cache_dir, "protocols", cache_size * 1024 * 1024)
+    counts = {"hits": sum(hits), "misses": len(hits) - sum(hits), "evictions": cache.evict()}
+    totals = cache.save_stats(counts)
+    print(f"compile cache: {counts['hits']} hits, {counts['misses']} misses, {counts['evictions']} evictions "
+          f"({totals['hits']} hits, {totals['misses']} misses overall)", file=sys.stderr)
+
+if __name__ == "__main__":
+    # parse command line arguments
+    arguments = docopt(__doc__, version=__version__)
+    cache_dir, cache_size = arguments["--cache-dir"], int(arguments["--cache-size"])
+    optimise = arguments["--optimise"]
+
+    try:
+        if arguments["batch"]:
+            entries = read_manifest(arguments["<manifest>"])
+            results = compile_batch(entries, arguments["--template-dir"], arguments["--output-dir"],
+                                    int(arguments["--jobs"]), cache_dir, cache_size, optimise, arguments["--labware-dir"],
+                                    arguments["--telemetry"])
+            ids = [entry["id"] for entry in entries]
+        else:
+            init_compiler(arguments["--template-dir"], cache_dir, cache_size, arguments["--labware-dir"])
+            results = [compile_protocol(arguments["<template_file>"], arguments["<json_file>"],
+                                        arguments["<csv_file>"], arguments["--output-file"], optimise, arguments["--telemetry"])]
+            ids = [os.path.splitext(os.path.basename(arguments["--output-file"]))[0]]
+    except step_plan.PlanError as error:
+        sys.exit(str(error))
+
+    hits = [hit for hit, _, _ in results]
+    if optimise:
+        report_savings(arguments["--report"], {protocol_id: savings for protocol_id, (_, savings, _) in zip(ids, results)})
+    if arguments["--ledger"]:
+        report_ledgers(arguments["--ledger"], {protocol_id: ledger for protocol_id, (_, _, ledger) in zip(ids, results)})
+    if cache_dir:
+        report_cache(cache_dir, cache_size, hits)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""render-instructions.py
+
+    Render the instructions of an experiment from its R Markdown template, JSON parameters and labware plots,
+    as PDF (through LaTeX) or as a lightweight self-contained HTML page for quick iteration.
+
+    With a cache directory, the instructions are fingerprinted from the template, the parameters, the name
+    and content of each plot, the output format and this script, and copied from the cache when none of them
+    changed, without starting R, pandoc or LaTeX.
+
+    Usage:
+        render-instructions.py [-f <format>] [-o <out_file>] [-c <cache_dir>] [-s <cache_size>] <markdown_file> <json_file> <plots_dir>
+
+    Options:
+    -f, --format <format>               Output format, pdf or html [default: pdf].
+    -o, --output-file <out_file>        Rendered instructions [default: instructions.<format>].
+    -c, --cache-dir <cache_dir>         Directory of the rendered instructions cache, disabled if not set.
+    -s, --cache-size <cache_size>       Maximum size of the rendered instructions cache in MB [default: 256].
+    -h --help                           Show this screen.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from docopt import docopt
+
+from content_cache import ContentCache, hash_content, hash_directory
+
+# rmarkdown output formats of each instructions format
+OUTPUT_FORMATS = {"pdf": "pdf_document", "html": "html_document"}
+
+def instructions_key(markdown_file: str, json_file: str, plots_dir: str, output_format: str) -> str:
+    """Fingerprint everything the rendered instructions depend on."""
+    contents = []
+    for path in [__file__, markdown_file, json_file]:
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    return hash_content(output_format, *contents, hash_directory(plots_dir))
+
+def render(markdown_file: str, json_file: str, plots_dir: str, output_format: str, out_file: str) -> None:
+    """Render the instructions with rmarkdown, keeping intermediate files out of the working directory."""
+    with tempfile.TemporaryDirectory() as intermediates_dir:
+        # JSON strings are valid R strings, which escapes quotes and backslashes of the paths
+        arguments = {name: json.dumps(value) for name, value in [
+            ("input", os.path.abspath(markdown_file)), ("output_format", OUTPUT_FORMATS[output_format]),
+            ("output_file", os.path.basename(out_file)), ("output_dir", os.path.abspath(os.path.dirname(out_file) or ".")),
+            ("intermediates_dir", intermediates_dir), ("json_path", os.path.abspath(json_file)),
+            ("labware_images_dir", os.path.abspath(plots_dir))]}
+        expression = (f"rmarkdown::render({arguments['input']}, output_format = {arguments['output_format']}, "
+                      f"output_file = {arguments['output_file']}, output_dir = {arguments['output_dir']}, "
+                      f"intermediates_dir = {arguments['intermediates_dir']}, quiet = TRUE, "
+                      f"params = list(json_path = {arguments['json_path']}, labware_images_dir = {arguments['labware_images_dir']}))")
+        subprocess.run(["Rscript", "-e", expression], check=True)
+
+def main():
+    args = docopt(__doc__)
+    output_format = args["--format"]
+    if output_format not in OUTPUT_FORMATS:
+        sys.exit(f"Unknown format {output_format}, expected one of {', '.join(OUTPUT_FORMATS)}.")
+    out_file = args["--output-file"].replace("<format>", output_format)
+    markdown_file, json_file, plots_dir = args["<markdown_file>"], args["<json_file>"], args["<plots_dir>"]
+
+    if not args["--cache-dir"]:
+        render(markdown_file, json_file, plots_dir, output_format, out_file)
+        return
+
+    cache = ContentCache(args["--cache-dir"], "instructions", int(args["--cache-size"]) * 1024 * 1024)
+    key = instructions_key(markdown_file, json_file, plots_dir, output_format)
+    content = cache.get(key)
+    if content is not None:
+        with open(out_file, "wb") as f:
+            f.write(content)
+    else:
+        render(markdown_file, json_file, plots_dir, output_format, out_file)
+        with open(out_file, "rb") as f:
+            cache.put(key, f.read())
+    cache.evict()
+    cache.save_stats()
+    print(f"instructions cache: {cache.stats['hits']} hits, {cache.stats['misses']} misses", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""runtime_model.py
+
+    Parsing and timing of the commands of simulated run logs, shared by the APEX scripts.
+
+    Commands are identified by the start of their text in the run log records saved by simulate-protocol.py,
+    and timed with a timing model of the OT-2, which can be calibrated by overriding any of its values.
+"""
+
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+# Durations in seconds of each command, speeds of the thermocycler in °C/s, and temperatures in °C.
+# Liquid handling commands include the move of the gantry to the well.
+TIMING_MODEL = {
+    "aspirate": 2.0,
+    "dispense": 2.0,
+    "pick_up_tip": 8.0,
+    "drop_tip": 6.0,
+    "blow_out": 1.5,
+    "touch_tip": 3.0,
+    "air_gap": 1.5,
+    "move_to": 0.5,
+    "home": 10.0,
+    "open_lid": 20.0,
+    "close_lid": 20.0,
+    "block_heating_rate": 4.0,
+    "block_cooling_rate": 2.0,
+    "lid_heating_rate": 0.5,
+    "ambient_temperature": 25.0,
+    "pipettes": {},
+}
+
+# run log commands identified by the start of their text
+COMMANDS = [
+    ("Aspirating", "aspirate"),
+    ("Dispensing", "dispense"),
+    ("Picking up tip", "pick_up_tip"),
+    ("Dropping tip", "drop_tip"),
+    ("Returning tip", "drop_tip"),
+    ("Blowing out", "blow_out"),
+    ("Touching tip", "touch_tip"),
+    ("Air gap", "air_gap"),
+    ("Moving to", "move_to"),
+    ("Homing", "home"),
+    ("Delaying", "delay"),
+    ("Pausing", "pause"),
+    ("Setting Thermocycler well block temperature", "block_temperature"),
+    ("Setting Thermocycler lid temperature", "lid_temperature"),
+    ("Opening Thermocycler lid", "open_lid"),
+    ("Closing Thermocycler lid", "close_lid"),
+    ("Deactivating Thermocycler lid", "deactivate_lid"),
+    ("Deactivating Thermocycler", "deactivate_block"),
+]
+
+THERMOCYCLER_COMMANDS = {"block_temperature", "lid_temperature", "open_lid", "close_lid", "deactivate_lid", "deactivate_block"}
+
+FLOW_RATE = re.compile(r"at ([\d.]+) uL/sec")
+# comment starting a thermocycler hold overlapped with liquid handling (see Hold in protocol-runtime.py), ended by a delay
+OVERLAPPED_HOLD = re.compile(r"Holding the thermocycler block at .+ for ([\d.]+) seconds")
+
+def load_timing_model(model_file: Optional[str] = None) -> Dict[str, Any]:
+    """Load the default timing model, overridden by the values of a calibration file."""
+    model = {**TIMING_MODEL, "pipettes": {}}
+    if model_file is not None:
+        with open(model_file) as f:
+            calibration = json.load(f)
+        model.update({key: value for key, value in calibration.items() if key != "pipettes"})
+        model["pipettes"] = calibration.get("pipettes", {})
+    return model
+
+def command_type(record: Dict[str, Any]) -> Optional[str]:
+    """Return the type of a run log command, or None for comments and unknown commands."""
+    for prefix, name in COMMANDS:
+        if record["text"].startswith(prefix):
+            return name
+    return None
+
+def is_comment(record: Dict[str, Any]) -> bool:
+    """Check whether a run log record is a comment of the protocol."""
+    return record["level"] == 0 and set(record) == {"level", "text"} and command_type(record) is None
+
+def leaf_records(records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Drop composite commands (transfer, distribute, mix...), whose duration is the one of their nested commands."""
+    previous = None
+    for record in records:
+        # a command is composite when the following one is nested in it
+        if previous is not None and record["level"] <= previous["level"]:
+            yield previous
+        previous = record
+    if previous is not None:
+        yield previous
+
+def pipette_model(record: Dict[str, Any]) -> str:
+    """Return the pipette model of a command, e.g. "P20 8-Channel GEN2" for "P20 8-Channel GEN2 on right mount"."""
+    return record.get("instrument", "").split(" on ")[0]
+
+def format_duration(seconds: float) -> str:
+    """Format a duration as hours, minutes and seconds."""
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m {seconds:02d}s" if hours else f"{minutes}m {seconds:02d}s"
+
+class RuntimeModel:
+    """Time the commands of a run log, keeping track of the thermocycler temperatures and overlapped holds."""
+
+    def __init__(self, model: Dict[str, Any]):
+        self.model = model
+        self.block_temperature = model["ambient_temperature"]
+        self.lid_temperature = model["ambient_temperature"]
+        # seconds left of the overlapped hold in progress
+        self.hold = None
+
+    def value(self, name: str, record: Dict[str, Any]) -> float:
+        """Return a timing value, calibrated for the pipette of the command if available."""
+        return self.model["pipettes"].get(pipette_model(record), {}).get(name, self.model[name])
+
+    def ramp(self, current: float, target: float, heating_rate: str, cooling_rate: str) -> float:
+        """Return the time needed to reach a temperature."""
+        rate = self.model[heating_rate] if target >= current else self.model[cooling_rate]
+        return abs(target - current) / rate
+
+    def comment(self, record: Dict[str, Any]) -> None:
+        """Start an overlapped hold on the comment announcing it."""
+        match = OVERLAPPED_HOLD.match(record["text"])
+        if match is not None:
+            self.hold = float(match.group(1))
+
+    def duration(self, command: str, record: Dict[str, Any]) -> float:
+        """Return the estimated duration of a command in seconds. The delay ending an overlapped hold
+        only lasts for the part of the hold not spent on the commands run since it started."""
+        seconds = self.command_duration(command, record)
+        if self.hold is not None:
+            if command == "delay":
+                seconds, self.hold = max(self.hold, 0.0), None
+            else:
+                self.hold -= seconds
+        return seconds
+
+    def command_duration(self, command: str, record: Dict[str, Any]) -> float:
+        """Return the estimated duration of a command in seconds, as run on its own."""
+        if command in ("aspirate", "dispense"):
+            flow_rate = FLOW_RATE.search(record["text"])
+            volume = float(record.get("volume") or 0.0)
+            return self.value(command, record) + (volume / float(flow_rate.group(1)) if flow_rate else 0.0)
+        if command == "delay":
+            return 60.0 * float(record.get("minutes") or 0.0) + float(record.get("seconds") or 0.0)
+        if command == "block_temperature":
+            target = float(record["temperature"])
+            seconds = self.ramp(self.block_temperature, target, "block_heating_rate", "block_cooling_rate")
+            self.block_temperature = target
+            return seconds + float(record.get("hold_time") or 0.0)
+        if command == "lid_temperature":
+            target = float(record.get("temperature", self.lid_temperature))
+            seconds = self.ramp(self.lid_temperature, target, "lid_heating_rate", "lid_heating_rate")
+            self.lid_temperature = target
+            return seconds
+        if command == "deactivate_block":
+            self.block_temperature = self.model["ambient_temperature"]
+            return 0.0
+        if command == "deactivate_lid":
+            self.lid_temperature = self.model["ambient_temperature"]
+            return 0.0
+        if command == "pause":
+            return 0.0
+        return self.value(command, record)
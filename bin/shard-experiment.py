@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+"""shard-experiment.py
+
+    Split experiments too large for a single OT-2 run into deck-feasible shards, and balance the
+    shards across several robots by estimated run time.
+
+    Rows of the data CSV are kept together by destination plate and column, whatever their order in the CSV,
+    so that 8-channel columns are never split; a destination well used again belongs to a new destination plate.
+    A new shard is started when a destination well is used again, when the agar plates of its rows would not
+    fit in the deck slots left free by the other labware, or when the tips needed by any pipette would exceed
+    the capacity of its tip racks. Agar plates are identified by their location, one of agar_plate_slot,
+    which may list more plates than the deck holds: each shard loads only the agar plates of its rows, kept
+    in their slot when it is free and moved to the remaining free slots otherwise, with their weights and
+    the locations of the rows rewritten to match. Other parameters are shared by all shards.
+
+    Each shard is saved as <out_dir>/<id>-shard-NN-config.json and <id>-shard-NN-data.csv, and listed
+    with its robot and estimated run time in <out_dir>/shards.csv, a manifest for protocol-compiler.py batch.
+
+    Usage:
+        shard-experiment.py [-O <out_dir>] [-n <robots>] [-l <labware_dir>] (<id> <csv_file> <json_file>)...
+
+    Input:
+    <id>             Experiment identifier ending with its protocol (e.g. protocol-1).
+    <csv_file>       Path to the CSV file containing experiment data.
+    <json_file>      Path to the JSON file containing protocol parameters.
+
+    Options:
+    -O, --output-dir <out_dir>        Output directory of the shards [default: shards].
+    -n, --robots <robots>             Number of robots running the shards [default: 1].
+    -l, --labware-dir <labware_dir>   Directory of the custom labware definitions [default: assets/labware].
+    -h --help                         Show this screen.
+"""
+
+import csv
+import json
+import os
+import re
+import sys
+import warnings
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from docopt import docopt
+
+from experiment_validator import VALIDATION_SCHEMAS
+import step_plan
+import transfer_optimiser
+from volume_ledger import free_slots, tip_capacity
+
+# columns identifying the destination well of a row, which can be used only once per run
+DESTINATION_KEYS = {
+    "protocol-1": ["destination_well"],
+    "protocol-2": ["agar_plate_location", "destination_well"],
+    "protocol-3": ["destination_well"],
+    "protocol-4": ["destination_well"],
+}
+# parameters giving a value for each agar plate of agar_plate_slot
+AGAR_PLATE_PARAMS = ["empty_agar_plate_weight", "agar_plate_weight"]
+
+class ShardError(ValueError):
+    """Raised when rows of an experiment cannot fit on a single deck."""
+
+def read_experiment(csv_file: str) -> Tuple[List[str], List[Dict[str, str]]]:
+    """Read the columns and raw rows of an experiment data CSV."""
+    with open(csv_file, newline="") as f:
+        reader = csv.DictReader(f)
+        return reader.fieldnames, list(reader)
+
+def parse_rows(rows: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    """Convert volume columns of raw rows to float, as the step planner does."""
+    return [{key: float(value) if "volume" in key else value for key, value in row.items() if key} for row in rows]
+
+def column_units(protocol: str, rows: List[Dict[str, str]]) -> List[List[int]]:
+    """Group the indexes of rows sharing a destination plate and column, in order of first appearance, the smallest
+    units of a shard. The n-th use of a destination well is a well of the n-th destination plate."""
+    units, uses = {}, Counter()
+    for index, row in enumerate(rows):
+        destination = tuple(row[key] for key in DESTINATION_KEYS[protocol])
+        column = destination[:-1] + (uses[destination], step_plan.WELL_ROW.sub("", row["destination_well"]))
+        uses[destination] += 1
+        units.setdefault(column, []).append(index)
+    return list(units.values())
+
+def location_columns(protocol: str) -> List[str]:
+    """Return the CSV columns giving the agar plate location of each row."""
+    return [plate["location_column"] for plate in VALIDATION_SCHEMAS[protocol]["plates"] if "location_column" in plate]
+
+def agar_plates(protocol: str, rows: List[Dict[str, str]]) -> Set[int]:
+    """Return the locations of the agar plates used by rows."""
+    return {int(row[column]) for row in rows for column in location_columns(protocol)}
+
+def agar_slots(params: Dict[str, Any]) -> List[int]:
+    """Return the deck slots that agar plates can be loaded in, i.e. not used by any other labware."""
+    return free_slots({key: value for key, value in params.items() if key != "agar_plate_slot"})
+
+def place_plates(protocol: str, params: Dict[str, Any], rows: List[Dict[str, str]]) -> Tuple[Dict[str, Any], List[Dict[str, str]]]:
+    """Return the parameters and rows of a shard loading only the agar plates of its rows, each kept in its slot when
+    free for agar plates and moved to the first remaining free slot otherwise."""
+    if not location_columns(protocol):
+        return params, rows
+    configured = [int(slot) for slot in params["agar_plate_slot"]]
+    used = agar_plates(protocol, rows)
+    missing = sorted(used - set(configured))
+    if missing:
+        raise ShardError(f"Agar plate locations {missing} are not in agar_plate_slot {params['agar_plate_slot']}.")
+    locations = [location for location in configured if location in used]
+    slots = agar_slots(params)
+    if len(locations) > len(slots):
+        raise ShardError(f"Agar plates {locations} do not fit in the {len(slots)} free deck slot(s) {slots}.")
+
+    kept = [location for location in locations if location in slots]
+    moved = iter(slot for slot in slots if slot not in kept)
+    placed = {location: location if location in kept else next(moved) for location in locations}
+    shard_params = {**params, "agar_plate_slot": [placed[location] for location in locations],
+                    **{key: [params[key][configured.index(location)] for location in locations] for key in AGAR_PLATE_PARAMS if key in params}}
+    placed_rows = [{**row, **{column: str(placed[int(row[column])]) for column in location_columns(protocol)}} for row in rows]
+    return shard_params, placed_rows
+
+def plan_usage(protocol: str, params: Dict[str, Any], rows: List[Dict[str, Any]],
+               labware_dir: Optional[str] = None) -> Tuple[Dict[Tuple[str, str], int], float]:
+    """Plan rows of an experiment, returning the tips used by each (pipette mount, step) and the estimated liquid handling time."""
+    plan = step_plan.PLANNERS[protocol](params, rows, labware_dir)
+    tips, seconds = {}, 0.0
+    for name, step in plan.items():
+        rule = transfer_optimiser.STEP_RULES[protocol][name]
+        for step_pass in step_plan.step_passes(step):
+            if not step_pass["transfers"]:
+                continue
+            estimate = transfer_optimiser.estimate_step(step_pass["transfers"], rule, params, step_pass["pipette"], False, labware_dir)
+            tips[step_pass["pipette"], name] = tips.get((step_pass["pipette"], name), 0) + estimate["tips"]
+            if not rule.get("overlapped"):
+                seconds += estimate["seconds"]
+    return tips, seconds
+
+def add_tips(protocol: str, tips: Dict[Tuple[str, str], int], other: Dict[Tuple[str, str], int]) -> Dict[Tuple[str, str], int]:
+    """Add the tips of the rows of a column to the tips of a shard, steps keeping a single tip sharing it across columns."""
+    combine = lambda key, a, b: max(a, b) if transfer_optimiser.STEP_RULES[protocol][key[1]]["new_tip"] == "once" else a + b
+    return {key: combine(key, tips.get(key, 0), other.get(key, 0)) for key in {**tips, **other}}
+
+def fixed_seconds(protocol: str, params: Dict[str, Any]) -> float:
+    """Return the time spent by every run of a protocol on the robot regardless of its rows, i.e. thermocycler holds."""
+    if protocol == "protocol-1" and params.get("destination_plate_slot") == "thermocycler":
+        return (60.0 * (params["pre_shock_incubation_time"] + params["post_shock_incubation_time"] + params["recovery_time"])
+                + params["heat_shock_time"])
+    return 0.0
+
+def fits_deck(protocol: str, params: Dict[str, Any], plates: Set[int], tips: Dict[Tuple[str, str], int]) -> bool:
+    """Check whether agar plates fit in the free deck slots, and tips in the tip racks of each pipette."""
+    mount_tips = {}
+    for (mount, _), count in tips.items():
+        mount_tips[mount] = mount_tips.get(mount, 0) + count
+    return len(plates) <= len(agar_slots(params)) and all(count <= tip_capacity(params, mount) for mount, count in mount_tips.items())
+
+def rows_usage(protocol: str, params: Dict[str, Any], rows: List[Dict[str, str]], labware_dir: Optional[str] = None) -> Tuple[Set[int], Dict[Tuple[str, str], int]]:
+    """Return the agar plates and the tips of rows, planned with their plates placed on the deck."""
+    shard_params, placed_rows = place_plates(protocol, params, rows)
+    tips, _ = plan_usage(protocol, shard_params, parse_rows(placed_rows), labware_dir)
+    return agar_plates(protocol, rows), tips
+
+def shard_rows(protocol: str, params: Dict[str, Any], rows: List[Dict[str, str]], labware_dir: Optional[str] = None) -> List[List[int]]:
+    """Split the rows of an experiment into shards of row indexes that fit on a single deck, in the order of the CSV.
+    Each column is planned once, and its tips added to those of the current shard. As the pipettes are selected over
+    all the rows of a step, each shard is planned once in full when closed, its last columns moved to the next shard
+    until it fits."""
+    destination = lambda index: tuple(rows[index][key] for key in DESTINATION_KEYS[protocol])
+    pending = deque()
+    for unit in column_units(protocol, rows):
+        plates, tips = rows_usage(protocol, params, [rows[index] for index in unit], labware_dir)
+        if not fits_deck(protocol, params, set(), tips):
+            raise ShardError(f"Rows {', '.join(str(index + 2) for index in unit)} need more tips than the tip racks hold.")
+        pending.append((unit, {destination(index) for index in unit}, plates, tips))
+
+    shards, current, used, plates, tips = [], [], set(), set(), {}
+    while pending or current:
+        if pending:
+            unit, unit_keys, unit_plates, unit_tips = pending[0]
+            if not current or (not unit_keys & used and fits_deck(protocol, params, plates | unit_plates, add_tips(protocol, tips, unit_tips))):
+                current.append(pending.popleft())
+                used, plates, tips = used | unit_keys, plates | unit_plates, add_tips(protocol, tips, unit_tips)
+                continue
+        shard = lambda: sorted(index for unit, *_ in current for index in unit)
+        while len(current) > 1 and not fits_deck(protocol, params, *rows_usage(protocol, params, [rows[index] for index in shard()], labware_dir)):
+            pending.appendleft(current.pop())
+        shards.append(shard())
+        current, used, plates, tips = [], set(), set(), {}
+    return shards
+
+def balance(shards: List[Dict[str, Any]], robots: int) -> List[float]:
+    """Assign shards to robots, longest first to the least loaded robot, and return the load of each robot."""
+    loads = [0.0] * robots
+    for shard in sorted(shards, key=lambda shard: -shard["estimated_seconds"]):
+        robot = min(range(robots), key=lambda robot: loads[robot])
+        shard["robot"] = robot + 1
+        loads[robot] += shard["estimated_seconds"]
+    return loads
+
+def save_shards(experiment: Dict[str, str], protocol: str, out_dir: str, labware_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Shard an experiment, saving the config and data of each shard, and return the shards."""
+    with open(experiment["config"]) as f:
+        params = json.load(f)
+    fieldnames, rows = read_experiment(experiment["data"])
+
+    shards = []
+    for number, indexes in enumerate(shard_rows(protocol, params, rows, labware_dir), start=1):
+        shard_id = f"{experiment['id']}-shard-{number:02d}"
+        shard_params, placed_rows = place_plates(protocol, params, [rows[index] for index in indexes])
+        with open(os.path.join(out_dir, f"{shard_id}-data.csv"), "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(placed_rows)
+        with open(os.path.join(out_dir, f"{shard_id}-config.json"), "w") as f:
+            json.dump(shard_params, f, indent=4)
+
+        _, seconds = plan_usage(protocol, shard_params, parse_rows(placed_rows), labware_dir)
+        shards.append({"id": shard_id, "template": f"{protocol}-template.py",
+                       "config": f"{shard_id}-config.json", "data": f"{shard_id}-data.csv",
+                       "rows": len(indexes), "estimated_seconds": round(seconds + fixed_seconds(protocol, params), 1)})
+    return shards
+
+def main():
+    args = docopt(__doc__)
+    out_dir, robots = args["--output-dir"], int(args["--robots"])
+    warnings.simplefilter("ignore", step_plan.PlanWarning) # reported when the shards are compiled
+    os.makedirs(out_dir, exist_ok=True)
+
+    shards = []
+    for id, csv_file, json_file in zip(args["<id>"], args["<csv_file>"], args["<json_file>"]):
+        protocol = re.search(r"protocol-\d+", id)
+        if protocol is None or protocol.group(0) not in step_plan.PLANNERS:
+            sys.exit(f"Cannot identify the protocol of {id}, expected one of {', '.join(step_plan.PLANNERS)}.")
+        try:
+            shards += save_shards({"id": id, "data": csv_file, "config": json_file}, protocol.group(0), out_dir, args["--labware-dir"])
+        except (ShardError, step_plan.PlanError) as error:
+            sys.exit(f"{id}: {error}")
+
+    loads = balance(shards, robots)
+    with open(os.path.join(out_dir, "shards.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["id", "template", "config", "data", "robot", "rows", "estimated_seconds"], lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(sorted(shards, key=lambda shard: (shard["robot"], shard["id"])))
+
+    for robot, load in enumerate(loads, start=1):
+        robot_shards = [shard["id"] for shard in shards if shard["robot"] == robot]
+        print(f"robot {robot}: {len(robot_shards)} shard(s), {load / 60:.1f} min estimated: {', '.join(robot_shards)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""simulate-protocol.py
+
+    Simulate compiled protocols with the Opentrons simulator, saving the run log as text
+    (same format as opentrons_simulate), as JSON records, and as a JSON Lines event log
+    (see simulation_events.py) written one event at a time.
+
+    In batch mode, all protocols are simulated in a single process, so opentrons is imported only once; outputs are
+    saved as <out_dir>/<name>-simulation.txt/json/jsonl. The custom labware definitions are passed to each simulation
+    through the public custom_labware_paths argument, so the labware directory should only hold the definitions used.
+    In worker mode, protocol paths are read from standard input, one per line, and a JSON line describing
+    the outputs of each simulation is written to standard output as soon as it is done.
+
+    With a cache directory, the simulation is skipped when the same protocol was already simulated
+    with the same labware definitions and opentrons version.
+
+    Usage:
+        simulate-protocol.py [-o <out_file>] [-r <results_file>] [-e <events_file>] [-c <cache_dir>] [-s <cache_size>] <protocol_file> <labware_dir>
+        simulate-protocol.py batch [-O <out_dir>] [-c <cache_dir>] [-s <cache_size>] <labware_dir> <protocol_files>...
+        simulate-protocol.py worker [-O <out_dir>] [-c <cache_dir>] [-s <cache_size>] <labware_dir>
+
+    Options:
+    -o, --output-file <out_file>        Simulation run log [default: simulation.txt].
+    -r, --results-file <results_file>   Simulation results as JSON [default: simulation.json].
+    -e, --events-file <events_file>     Simulation events as JSON Lines [default: simulation.jsonl].
+    -O, --output-dir <out_dir>          Output directory for batch and worker modes [default: .].
+    -c, --cache-dir <cache_dir>         Directory of the simulation cache, disabled if not set.
+    -s, --cache-size <cache_size>       Maximum size of the simulation cache in MB [default: 512].
+    -h --help                           Show this screen.
+"""
+
+import json
+import os
+import sys
+from functools import lru_cache
+from importlib.metadata import version
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from docopt import docopt
+
+from content_cache import ContentCache, hash_content, hash_directory
+from runtime_model import TIMING_MODEL
+from simulation_events import simulation_events, write_events
+
+class SimulationError(Exception):
+    """Raised when a protocol fails during simulation."""
+
+def json_value(value: Any) -> Any:
+    """Convert a run log payload value into a JSON serialisable value."""
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [json_value(v) for v in value]
+    return str(value)
+
+def runlog_to_records(runlog: List[Mapping[str, Any]]) -> List[Dict[str, Any]]:
+    """Convert the opentrons run log into JSON serialisable records."""
+    return [{"level": command["level"], **{key: json_value(value) for key, value in command["payload"].items()}}
+            for command in runlog]
+
+@lru_cache(maxsize=None)
+def load_simulator():
+    """Import the opentrons simulator once per process."""
+    from opentrons import simulate
+    from opentrons.util.entrypoint_util import ProtocolEngineExecuteError
+
+    return simulate, ProtocolEngineExecuteError
+
+def run_simulation(protocol_file: str, labware_dir: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Simulate the protocol and return the formatted run log and its records."""
+    simulate, ProtocolEngineExecuteError = load_simulator()
+
+    with open(protocol_file) as f:
+        try:
+            runlog, _ = simulate.simulate(f, file_name=os.path.basename(protocol_file), custom_labware_paths=[labware_dir])
+        except ProtocolEngineExecuteError as error:
+            raise SimulationError(error.to_stderr_string()) from error
+    return simulate.format_runlog(runlog) + "\n", runlog_to_records(runlog)
+
+@lru_cache(maxsize=None)
+def labware_fingerprint(labware_dir: str) -> str:
+    """Hash the custom labware definitions once per process."""
+    return hash_directory(labware_dir, ".json")
+
+def simulate_protocol(protocol_file: str, labware_dir: str, cache: ContentCache = None) -> Tuple[str, List[Dict[str, Any]], bool]:
+    """Simulate the protocol, reusing the cached results of an identical simulation when available.
+    Return the run log, its records, and whether they were found in the cache."""
+    if cache is None:
+        return (*run_simulation(protocol_file, labware_dir), False)
+
+    with open(protocol_file, "rb") as f:
+        key = hash_content(f.read(), labware_fingerprint(labware_dir), version("opentrons"))
+    cached = cache.get(key)
+    if cached is not None:
+        entry = json.loads(cached)
+        return entry["text"], entry["results"], True
+
+    text, results = run_simulation(protocol_file, labware_dir)
+    cache.put(key, json.dumps({"text": text, "results": results}).encode("utf-8"))
+    return text, results, False
+
+def save_simulation(text: str, results: List[Dict[str, Any]], out_file: str, results_file: str, events_file: str) -> None:
+    """Save the run log, its records and its events, timed with the default timing model."""
+    with open(out_file, "w", encoding="utf-8") as f:
+        f.write(text)
+    with open(results_file, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    write_events(simulation_events(results, TIMING_MODEL), events_file)
+
+def simulate_queue(protocol_files: Iterable[str], labware_dir: str, out_dir: str, cache: Optional[ContentCache] = None) -> Iterable[Dict[str, Any]]:
+    """Simulate a queue of protocols in this process, yielding the outcome of each simulation.
+    A failing protocol is reported and does not stop the queue."""
+    os.makedirs(out_dir, exist_ok=True)
+    for protocol_file in protocol_files:
+        name = os.path.splitext(os.path.basename(protocol_file))[0]
+        outcome = {"protocol": protocol_file,
+                   "log": os.path.join(out_dir, f"{name}-simulation.txt"),
+                   "results": os.path.join(out_dir, f"{name}-simulation.json"),
+                   "events": os.path.join(out_dir, f"{name}-simulation.jsonl"),
+                   "cached": False, "error": None}
+        try:
+            text, results, outcome["cached"] = simulate_protocol(protocol_file, labware_dir, cache)
+            save_simulation(text, results, outcome["log"], outcome["results"], outcome["events"])
+        except Exception as error:
+            outcome["error"] = str(error) or repr(error)
+        yield outcome
+
+def main():
+    args = docopt(__doc__)
+    cache_dir = args["--cache-dir"]
+    cache = ContentCache(cache_dir, "simulations", int(args["--cache-size"]) * 1024 * 1024) if cache_dir else None
+
+    failed = False
+    if args["batch"] or args["worker"]:
+        # worker mode consumes protocol paths as they are queued on standard input
+        queue = args["<protocol_files>"] if args["batch"] else (line.strip() for line in sys.stdin if line.strip())
+        for outcome in simulate_queue(queue, args["<labware_dir>"], args["--output-dir"], cache):
+            failed = failed or outcome["error"] is not None
+            if args["worker"]:
+                print(json.dumps(outcome), flush=True)
+            elif outcome["error"] is not None:
+                print(f"{outcome['protocol']}: {outcome['error']}", file=sys.stderr)
+    else:
+        try:
+            text, results, _ = simulate_protocol(args["<protocol_file>"], args["<labware_dir>"], cache)
+        except SimulationError as error:
+            sys.exit(str(error))
+        save_simulation(text, results, args["--output-file"], args["--results-file"], args["--events-file"])
+
+    if cache is not None:
+        cache.evict()
+        cache.save_stats()
+        print(f"simulation cache: {cache.stats['hits']} hits, {cache.stats['misses']} misses", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""simulation_events.py
+
+    Structured event log of simulated protocols, as JSON Lines.
+
+    Every liquid handling, movement and module command of a run log is converted into an event with its type,
+    pipette, labware, slot, well, volume, the tip and liquid held by the pipette after the command, the protocol
+    step and its estimated start time on the robot. Composite commands (transfer, distribute, mix...) are
+    represented by their nested commands, and comments only name the step of the following events.
+    Events are generated and written one at a time, so that large run logs are never converted as a whole.
+"""
+
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from runtime_model import FLOW_RATE, RuntimeModel, command_type, is_comment, leaf_records, pipette_model
+
+# location of a command, e.g. "A1 of Opentrons OT-2 96 Tip Rack 20 µL on slot 6", possibly within
+# "Location(point=Point(x=..., y=..., z=...), labware=...)", with labware on a module
+LOCATION = re.compile(r"(?:(?P<well>[A-Z]+\d+) of )?(?P<labware>.+?)(?: on (?P<module>[^,]+?))? on slot (?P<slot>\d+)\)?$")
+POINT = re.compile(r"Point\(x=(?P<x>[-\d.]+), y=(?P<y>[-\d.]+), z=(?P<z>[-\d.]+)\)")
+
+def parse_location(location: Optional[str]) -> Dict[str, Any]:
+    """Return the labware, module, slot, well and position of a run log location, when given."""
+    if not location:
+        return {}
+    fields = {}
+    point = POINT.search(location)
+    if point is not None:
+        fields["position"] = [round(float(point.group(axis)), 2) for axis in "xyz"]
+        location = location.split("labware=", 1)[-1]
+    match = LOCATION.search(location)
+    if match is not None:
+        fields.update({key: value for key, value in match.groupdict().items() if value is not None})
+        fields["slot"] = int(fields["slot"])
+    return fields
+
+class PipetteState:
+    """Tip and liquid held by each pipette (model and mount), updated by the commands of a run log."""
+
+    def __init__(self):
+        self.tips = {}
+
+    def update(self, command: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply a command to the state of its pipette and return the new state."""
+        tip = self.tips.setdefault(record["instrument"], {"tip_attached": False, "tips_used": 0, "tip_volume": 0.0})
+        volume = float(record.get("volume") or 0.0)
+        if command == "pick_up_tip":
+            tip.update(tip_attached=True, tips_used=tip["tips_used"] + 1, tip_volume=0.0)
+        elif command == "drop_tip":
+            tip.update(tip_attached=False, tip_volume=0.0)
+        elif command == "aspirate":
+            tip["tip_volume"] = round(tip["tip_volume"] + volume, 3)
+        elif command == "dispense":
+            tip["tip_volume"] = round(max(tip["tip_volume"] - volume, 0.0), 3)
+        elif command == "blow_out":
+            tip["tip_volume"] = 0.0
+        return dict(tip)
+
+def simulation_events(records: Iterable[Dict[str, Any]], model: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Convert the records of a run log into events, timed with a timing model."""
+    runtime, pipettes = RuntimeModel(model), PipetteState()
+    step, seconds, index = "setup", 0.0, 0
+    for record in leaf_records(records):
+        if is_comment(record):
+            runtime.comment(record)
+            step = record["text"].rstrip(":.")
+            continue
+        index += 1
+        command = command_type(record) or "other"
+        event = {"index": index, "command": command, "step": step, "start_seconds": round(seconds, 2)}
+        if command != "other":
+            seconds += runtime.duration(command, record)
+        if "instrument" in record:
+            event["pipette"] = pipette_model(record)
+            event["mount"] = record["instrument"].rsplit(" on ", 1)[-1].replace(" mount", "")
+            event.update(pipettes.update(command, record))
+        event.update(parse_location(record.get("location")))
+        if record.get("volume") is not None:
+            event["volume"] = float(record["volume"])
+        flow_rate = FLOW_RATE.search(record["text"])
+        if flow_rate is not None:
+            event["flow_rate"] = float(flow_rate.group(1))
+        for key in ("temperature", "hold_time", "minutes", "seconds"):
+            if record.get(key) is not None:
+                event[key] = record[key]
+        event["text"] = record["text"]
+        yield event
+
+def write_events(events: Iterable[Dict[str, Any]], events_file: str) -> int:
+    """Write events as JSON Lines, one at a time, and return their number."""
+    count = 0
+    with open(events_file, "w", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+def read_events(events_file: str) -> Iterator[Dict[str, Any]]:
+    """Read the events of a JSON Lines file one at a time."""
+    with open(events_file, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
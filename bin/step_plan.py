@@ -0,0 +1,349 @@
+"""step_plan.py
+
+    Compile-time planning of the protocol steps.
+
+    The experiment CSV is parsed and validated against the protocol parameters, pipettes are selected,
+    "NA" sources are dropped and rows are collapsed to one transfer per column for 8-channel pipettes,
+    so that the compiled protocol only iterates over a compact plan of pre-resolved transfers.
+
+    When both an 8-channel and a single-channel pipette of the same size are mounted, uniform columns (eight rows filled
+    from the same rows of one source column with the same volume) are transferred with the 8-channel
+    pipette and every other well with the single-channel one, in a second "single_channel" pass of the step.
+    The rows reached by the 8 channels are derived from the row count of the plates (see labware_registry.py), e.g.
+    every other row from A on 384-well plates, and columns are only batched between plates with the same rows.
+"""
+
+import csv
+import math
+import re
+import warnings
+from typing import Any, Dict, List, Optional, Tuple
+
+from labware_registry import registry
+
+# rows reached at once by an 8-channel pipette on a 96-well plate
+CHANNEL_ROWS = "ABCDEFGH"
+WELL_ROW = re.compile(r"[A-Z]+")
+
+class PlanError(ValueError):
+    """Raised when the experiment data cannot be planned with the protocol parameters."""
+
+class PlanWarning(UserWarning):
+    """Issued when the experiment data is planned with a possibly unintended layout."""
+
+def load_csv_rows(csv_content: str) -> List[Dict[str, Any]]:
+    """Parse CSV content with experiment data, converting volume columns to float."""
+    rows = []
+    for line, row in enumerate(csv.DictReader(csv_content.splitlines()), start=2):
+        try:
+            rows.append({key: float(value) if "volume" in key else value for key, value in row.items() if key})
+        except (TypeError, ValueError):
+            raise PlanError(f"Invalid volume on line {line} of the CSV file: {row}")
+    return rows
+
+def column(rows: List[Dict[str, Any]], name: str) -> List[Any]:
+    """Return the values of a CSV column."""
+    try:
+        return [row[name] for row in rows]
+    except KeyError:
+        raise PlanError(f"Missing column in the CSV file: {name}")
+
+def pipette_max_volume(pipette_name: str) -> float:
+    """Return the maximum volume of a pipette from its name, e.g. 20 for p20_multi_gen2."""
+    match = re.match(r"p(\d+)_", pipette_name)
+    if match is None:
+        raise PlanError(f"Unknown pipette: {pipette_name}")
+    return float(match.group(1))
+
+def is_multichannel(pipette_name: str) -> bool:
+    """Check whether the pipette is an 8-channel pipette."""
+    return "multi" in pipette_name
+
+def mounted_pipettes(params: Dict[str, Any]) -> Dict[str, str]:
+    """Return the pipette names by mount, in the order they are loaded by the protocol."""
+    return {side: params[f"{side}_pipette_name"] for side in ["right", "left"] if params[f"{side}_pipette_name"] != "NA"}
+
+def select_pipette(volumes: List[float], pipettes: Dict[str, str]) -> str:
+    """Determine the mount of the appropriate pipette based on the volume and available pipettes."""
+    if len(pipettes) == 1:
+        return next(iter(pipettes))
+    pipette_type = "p20" if min(volumes, default=float("inf")) <= 20 else "p300"
+    for mount, pipette_name in pipettes.items():
+        if pipette_type in pipette_name:
+            return mount
+    if pipette_type == "p300":
+        # large volumes are split over several aspirations of the largest pipette
+        return max(pipettes, key=lambda mount: pipette_max_volume(pipettes[mount]))
+    raise PlanError(f"No {pipette_type} pipette available for volumes {min(volumes)}-{max(volumes)} uL.")
+
+def select_sampling_pipette(pipettes: Dict[str, str]) -> str:
+    """Determine the mount of the smallest pipette, used for colony sampling."""
+    return min(pipettes, key=lambda mount: pipette_max_volume(pipettes[mount]))
+
+def collapse_transfers(sources: List[str], volumes: Optional[List[float]], destinations: List[str], multichannel: bool,
+                       skip_na: bool = True, locations: Optional[List[str]] = None, per_location: bool = False) -> List[Tuple]:
+    """Drop "NA" sources and, for 8-channel pipettes, move wells to row A keeping only the first transfer of each
+    destination column (per agar plate location if per_location is set).
+    Return (source, volume, destination, location) tuples, with volume and location set to None when not given."""
+    seen_columns, transfers = set(), []
+    volumes = volumes if volumes is not None else [None] * len(sources)
+    locations = locations if locations is not None else [None] * len(sources)
+
+    for source, volume, destination, location in zip(sources, volumes, destinations, locations):
+        if skip_na and source == "NA":
+            continue
+        formatted_destination = "A" + destination[1:] if multichannel else destination
+        key = (formatted_destination, location) if per_location else formatted_destination
+        if key in seen_columns:
+            continue
+        seen_columns.add(key)
+        formatted_source = "A" + source[1:] if multichannel else source
+        transfers.append((formatted_source, volume, formatted_destination, int(location) if location is not None else None))
+    return transfers
+
+def channel_rows(labware_dir: Optional[str], *plate_names: str) -> Optional[str]:
+    """Return the rows reached at once by an 8-channel pipette from row A of the plates, or None if the plates
+    have different rows or fewer than eight. Plates whose definition is unknown are taken as 96-well plates."""
+    row_counts = set()
+    for name in plate_names:
+        labware = registry(labware_dir).get(name) if labware_dir is not None else None
+        row_counts.add(len({WELL_ROW.match(well).group(0) for well in labware.wells}) if labware is not None else len(CHANNEL_ROWS))
+    rows = row_counts.pop() if len(row_counts) == 1 else 0
+    if rows < len(CHANNEL_ROWS):
+        return None
+    return "".join(chr(ord("A") + row) for row in range(0, rows, rows // len(CHANNEL_ROWS)))[:len(CHANNEL_ROWS)]
+
+def is_uniform_column(transfers: List[Tuple], rows: str = CHANNEL_ROWS) -> bool:
+    """Check whether the transfers of a destination column can be run at once by an 8-channel pipette reaching rows."""
+    sources, volumes, destinations, locations = zip(*transfers)
+    return (sorted(WELL_ROW.match(destination).group(0) for destination in destinations) == list(rows)
+            and all(WELL_ROW.match(source).group(0) == WELL_ROW.match(destination).group(0) for source, destination in zip(sources, destinations))
+            and len({WELL_ROW.sub("", source) for source in sources}) == 1 and len(set(volumes)) == 1 and len(set(locations)) == 1)
+
+def batch_columns(transfers: List[Tuple], rows: str = CHANNEL_ROWS) -> Tuple[List[Tuple], List[Tuple]]:
+    """Split single-well transfers into uniform columns, moved to row A for an 8-channel pipette reaching rows,
+    and the transfers of the remaining wells, both in order of first appearance."""
+    columns = {}
+    for transfer in transfers:
+        columns.setdefault(WELL_ROW.sub("", transfer[2]), []).append(transfer)
+
+    column_transfers, well_transfers = [], []
+    for column_wells in columns.values():
+        if is_uniform_column(column_wells, rows):
+            source, volume, destination, location = column_wells[0]
+            column_transfers.append(("A" + WELL_ROW.sub("", source), volume, "A" + WELL_ROW.sub("", destination), location))
+        else:
+            well_transfers += column_wells
+    return column_transfers, well_transfers
+
+def plan_transfers(sources: List[str], volumes: Optional[List[float]], destinations: List[str], mount: str,
+                   pipettes: Dict[str, str], skip_na: bool = True, locations: Optional[List[str]] = None,
+                   batch: bool = True, rows: Optional[str] = CHANNEL_ROWS) -> Dict[str, Any]:
+    """Plan the transfers of a step with the pipette on mount. If batch is set and both an 8-channel and a single-channel
+    pipette of its size are mounted, uniform columns go to the 8-channel pipette and the other wells to a single-channel pass.
+    rows are the rows reached by the 8-channel pipette (see channel_rows): if None, every well goes to the single-channel pipette."""
+    same_size = {other: name for other, name in pipettes.items() if pipette_max_volume(name) == pipette_max_volume(pipettes[mount])}
+    multichannel = [other for other, name in same_size.items() if is_multichannel(name)]
+    single_channel = [other for other, name in same_size.items() if not is_multichannel(name)]
+    if batch and multichannel and single_channel and rows is None:
+        return {"pipette": single_channel[0], "transfers": collapse_transfers(sources, volumes, destinations, False, skip_na, locations)}
+    if not (batch and multichannel and single_channel):
+        transfers = collapse_transfers(sources, volumes, destinations, is_multichannel(pipettes[mount]), skip_na, locations)
+        if is_multichannel(pipettes[mount]):
+            mixed_columns = sorted({int(destination[1:]) for _, _, destination, _ in
+                                    batch_columns(collapse_transfers(sources, volumes, destinations, False, skip_na, locations), rows or CHANNEL_ROWS)[1]})
+            if mixed_columns:
+                warnings.warn(f"Destination columns {mixed_columns} are not uniform and are transferred from row A with {pipettes[mount]}.", PlanWarning)
+        return {"pipette": mount, "transfers": transfers}
+
+    columns, wells = batch_columns(collapse_transfers(sources, volumes, destinations, False, skip_na, locations), rows)
+    if not columns:
+        return {"pipette": single_channel[0], "transfers": wells}
+    step = {"pipette": multichannel[0], "transfers": columns}
+    if wells:
+        step["single_channel"] = {"pipette": single_channel[0], "transfers": wells}
+    return step
+
+def step_passes(step: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the 8-channel and single-channel passes of a step, each with its pipette mount and transfers."""
+    return [step] + ([step["single_channel"]] if "single_channel" in step else [])
+
+def map_transfers(step: Dict[str, Any], function) -> Dict[str, Any]:
+    """Apply function to the transfers of every pass of a step, returning the new step."""
+    mapped = {**step, "transfers": function(step["transfers"], step["pipette"])}
+    if "single_channel" in step:
+        mapped["single_channel"] = {**step["single_channel"], "transfers": function(step["single_channel"]["transfers"], step["single_channel"]["pipette"])}
+    return mapped
+
+def capped_mix_volume(volume: float, pipette_name: str) -> float:
+    """Limit a mixing volume to the pipette capacity, as done by the original protocols."""
+    max_volume = pipette_max_volume(pipette_name)
+    return volume if volume <= max_volume / 2 else max_volume
+
+def check_agar_locations(transfers: List[Tuple], params: Dict[str, Any]) -> None:
+    """Check that every agar plate location of the CSV file is one of the configured agar plate slots."""
+    agar_slots = {int(slot) for slot in params["agar_plate_slot"]}
+    missing = sorted({location for *_, location in transfers if location not in agar_slots})
+    if missing:
+        raise PlanError(f"Agar plate locations {missing} are not in agar_plate_slot {sorted(agar_slots)}.")
+
+def agar_heights(params: Dict[str, Any], offset_key: str) -> Dict[int, float]:
+    """Compute the height of the agar surface of each agar plate slot from the plate weights, plus an offset parameter."""
+    heights = {}
+    for slot, empty_weight, plate_weight in zip(params["agar_plate_slot"], params["empty_agar_plate_weight"], params["agar_plate_weight"]):
+        agar_weight = float(plate_weight) - float(empty_weight)
+        heights[int(slot)] = agar_weight / (params["agar_plate_area"] * (params["agar_density"] / 1000)) + params[offset_key]
+    return heights
+
+def spiral_path(max_radius: float, num_points: int = 25, total_rotations: float = 3) -> Tuple[Tuple[float, float], ...]:
+    """Compute the (x, y) offsets of an Archimedean spiral of num_points points from the centre of a colony to max_radius."""
+    b = max_radius / (total_rotations * 2 * math.pi)
+    end_theta = total_rotations * 2 * math.pi
+    thetas = [end_theta * i / (num_points - 1) for i in range(num_points)] if num_points > 1 else [0.0]
+    return tuple((b * theta * math.cos(theta), b * theta * math.sin(theta)) for theta in thetas)
+
+def stages_media(params: Dict[str, Any]) -> bool:
+    """Check whether recovery media is staged during the pre-shock incubation, in the plate of media_staging_plate_slot."""
+    if params.get("media_staging_plate_slot", "NA") == "NA":
+        return False
+    if params["destination_plate_slot"] != "thermocycler":
+        raise PlanError("Recovery media can only be staged in media_staging_plate_slot with destination_plate_slot thermocycler.")
+    return True
+
+def staging_seconds(params: Dict[str, Any], media: Dict[str, Any], staged: Dict[str, Any], labware_dir: Optional[str] = None) -> Tuple[float, float]:
+    """Estimate the seconds spent adding recovery media after the pre-shock incubation starts, from the media plate and
+    from the staging plate; staging only adds the time it runs over the pre-shock incubation."""
+    # imported here, as the transfer optimiser is built on this module
+    from transfer_optimiser import STEP_RULES, estimate_passes
+
+    estimate = lambda name, step: estimate_passes(step, STEP_RULES["protocol-1"][name], params, False, labware_dir)["seconds"]
+    overrun = max(estimate("media_staging", staged["media_staging"]) - 60 * params["pre_shock_incubation_time"], 0.0)
+    return estimate("media", media), round(estimate("staged_media", staged["staged_media"]) + overrun, 1)
+
+def plan_protocol_1(params: Dict[str, Any], rows: List[Dict[str, Any]], labware_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Plan cells, DNA and recovery media transfers of the heat shock transformation. When media is staged, media is moved
+    to the destination wells of a staging plate during the pre-shock incubation ("media_staging"), and from there to the
+    destination plate, column by column, after the heat shock ("staged_media"). Media is only staged when estimated to
+    save time over adding it from the media plate, otherwise a PlanWarning reports that staging was skipped."""
+    pipettes = mounted_pipettes(params)
+    destinations = column(rows, "destination_well")
+    media_volumes = column(rows, "media_volume")
+    media_mount = select_pipette(media_volumes, pipettes)
+    plate_rows = lambda source_plate, destination_plate="destination_plate_name": channel_rows(labware_dir, params[source_plate], params[destination_plate])
+    plan = {reactant: plan_transfers(column(rows, f"{reactant}_well"), column(rows, f"{reactant}_volume"), destinations,
+                                     select_pipette(column(rows, f"{reactant}_volume"), pipettes), pipettes,
+                                     rows=plate_rows(f"{reactant}_plate_name"))
+            for reactant in ["cells", "dna"]}
+    plan["media"] = plan_transfers(column(rows, "media_well"), media_volumes, destinations, media_mount, pipettes,
+                                   rows=plate_rows("media_plate_name"))
+    if stages_media(params):
+        media_wells = column(rows, "media_well")
+        staged = {"media_staging": map_transfers(plan_transfers(media_wells, media_volumes, destinations, media_mount, pipettes,
+                                                                rows=plate_rows("media_plate_name", "media_staging_plate_name")),
+                                                 lambda transfers, _: [(source, volume, destination) for source, volume, destination, _ in transfers])}
+        staged_wells = [destination if media_well != "NA" else "NA" for media_well, destination in zip(media_wells, destinations)]
+        staged["staged_media"] = plan_transfers(staged_wells, media_volumes, destinations, media_mount, pipettes,
+                                                rows=plate_rows("media_staging_plate_name"))
+        direct_seconds, staged_seconds = staging_seconds(params, plan["media"], staged, labware_dir)
+        if staged_seconds < direct_seconds:
+            del plan["media"]
+            plan.update(staged)
+        else:
+            warnings.warn(f"Recovery media is not staged in media_staging_plate_slot, as adding it after the heat shock takes an estimated "
+                          f"{staged_seconds:g} s staged and {direct_seconds:g} s from the media plate.", PlanWarning)
+
+    def mix_cells(transfers: List[Tuple], mount: str) -> List[Tuple]:
+        """Mix cells once per source well, with half of the total volume drawn from it."""
+        cumulative_cell_volumes = {}
+        for source, volume, _, _ in transfers:
+            cumulative_cell_volumes[source] = cumulative_cell_volumes.get(source, 0.0) + volume
+        cells_transfers, mixed_wells = [], set()
+        for source, volume, destination, _ in transfers:
+            mix_volume = capped_mix_volume(cumulative_cell_volumes[source] / 2, pipettes[mount]) if source not in mixed_wells else 0.0
+            mixed_wells.add(source)
+            cells_transfers.append((source, volume, destination, mix_volume))
+        return cells_transfers
+
+    # DNA and media are mixed in the destination well with the cells transferred to it, and 8-channel transfers,
+    # moved to row A, with the cells transferred to the first well of their column
+    cells_volumes, column_cells_volumes = {}, {}
+    for destination, volume in zip(destinations, column(rows, "cells_volume")):
+        cells_volumes.setdefault(destination, volume)
+        column_cells_volumes.setdefault("A" + destination[1:], volume)
+
+    def mix_destination(transfers: List[Tuple], mount: str) -> List[Tuple]:
+        """Mix the destination well with half of its volume."""
+        volumes = column_cells_volumes if is_multichannel(pipettes[mount]) else cells_volumes
+        missing = sorted({destination for _, _, destination, _ in transfers if destination not in volumes})
+        if missing:
+            raise PlanError(f"No cells are transferred to destination wells {missing}.")
+        return [(source, volume, destination, capped_mix_volume((volume + volumes[destination]) / 2, pipettes[mount]))
+                for source, volume, destination, _ in transfers]
+
+    plan["cells"] = map_transfers(plan["cells"], mix_cells)
+    plan["dna"] = map_transfers(plan["dna"], mix_destination)
+    media_step = "staged_media" if "staged_media" in plan else "media"
+    plan[media_step] = map_transfers(plan[media_step], mix_destination)
+    return plan
+
+def plan_protocol_2(params: Dict[str, Any], rows: List[Dict[str, Any]], labware_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Plan the spotting of each source well onto one or more agar plate wells."""
+    transfers = collapse_transfers(column(rows, "source_well"), column(rows, "spotting_volume"), column(rows, "destination_well"),
+                                   is_multichannel(params["pipette_name"]), skip_na=False,
+                                   locations=column(rows, "agar_plate_location"), per_location=True)
+    check_agar_locations(transfers, params)
+    return {"spotting": {"pipette": params["pipette_mount"],
+                         "transfers": [(location, source, volume, tuple(destination.split("|")))
+                                       for source, volume, destination, location in transfers],
+                         "agar_heights": agar_heights(params, "spotting_height")}}
+
+def plan_protocol_3(params: Dict[str, Any], rows: List[Dict[str, Any]], labware_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Plan the media distribution and the sampling of each colony into the culture plate."""
+    pipettes = mounted_pipettes(params)
+    destinations = column(rows, "destination_well")
+
+    media = plan_transfers(column(rows, "media_well"), column(rows, "media_volume"), destinations,
+                           select_pipette(column(rows, "media_volume"), pipettes), pipettes, skip_na=False,
+                           rows=channel_rows(labware_dir, params["media_plate_name"], params["destination_plate_name"]))
+    # colonies are always sampled with the smallest pipette
+    sampling = plan_transfers(column(rows, "colony_well"), None, destinations, select_sampling_pipette(pipettes), pipettes,
+                              skip_na=False, locations=column(rows, "agar_plate_location"), batch=False)
+    for sampling_pass in step_passes(sampling):
+        check_agar_locations(sampling_pass["transfers"], params)
+    sampling = map_transfers(sampling, lambda transfers, _: [(location, source, destination) for source, _, destination, location in transfers])
+    sampling["agar_heights"] = agar_heights(params, "agar_pierce_depth")
+    if params["sampling_method"] == "spiral":
+        sampling["spiral"] = spiral_path(params["spot_radius"], params.get("spiral_points", 25), params.get("spiral_rotations", 3))
+    return {"media": map_transfers(media, lambda transfers, _: [(source, volume, destination) for source, volume, destination, _ in transfers]),
+            "sampling": sampling}
+
+def plan_protocol_4(params: Dict[str, Any], rows: List[Dict[str, Any]], labware_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Plan media, culture and inducer transfers of the protein expression induction."""
+    pipettes = mounted_pipettes(params)
+    destinations = column(rows, "destination_well")
+    plan = {}
+    for reactant in ["media", "culture", "inducer"]:
+        step = plan_transfers(column(rows, f"{reactant}_well"), column(rows, f"{reactant}_volume"), destinations,
+                              select_pipette(column(rows, f"{reactant}_volume"), pipettes), pipettes,
+                              rows=channel_rows(labware_dir, params[f"{reactant}_plate_name"], params["destination_plate_name"]))
+        plan[reactant] = map_transfers(step, lambda transfers, _: [(source, volume, destination) for source, volume, destination, _ in transfers])
+    return plan
+
+PLANNERS = {
+    "protocol-1": plan_protocol_1,
+    "protocol-2": plan_protocol_2,
+    "protocol-3": plan_protocol_3,
+    "protocol-4": plan_protocol_4,
+}
+
+def protocol_type(template_file: str) -> Optional[str]:
+    """Return the protocol (e.g. protocol-1) of a template, or None if it has no planner."""
+    match = re.search(r"protocol-\d+", template_file)
+    return match.group(0) if match is not None and match.group(0) in PLANNERS else None
+
+def build_plan(protocol: str, params: Dict[str, Any], csv_content: str, labware_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Build the step plan of a protocol, each step (and its single-channel pass) listing its pipette mount and transfers as tuples.
+    Plates are looked up in labware_dir for the rows of 8-channel transfers, and taken as 96-well plates if not set."""
+    plan = PLANNERS[protocol](params, load_csv_rows(csv_content), labware_dir)
+    return {name: map_transfers(step, lambda transfers, _: tuple(tuple(transfer) for transfer in transfers))
+            for name, step in plan.items()}
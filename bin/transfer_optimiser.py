@@ -0,0 +1,240 @@
+"""transfer_optimiser.py
+
+    Compile-time optimisation of the step plans built by step_plan.py.
+
+    Transfers of each step are grouped by source well and their destinations ordered along a serpentine
+    path over the plate, to reduce head travel. Steps whose tips only touch a single reagent and empty
+    destination wells are marked for multi-dispense, so that one aspiration serves several wells.
+    Steps whose destinations already hold cells or cultures keep a fresh tip per transfer.
+
+    Savings are estimated with a simple model of the OT-2 deck: tip changes, aspirations and head travel
+    between well positions, converted to seconds with average durations measured on the robot. Wells are
+    positioned from the labware definitions (see labware_registry.py), or as on a 96-well plate if unknown.
+"""
+
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+from labware_registry import Labware, registry
+from step_plan import is_multichannel, map_transfers, pipette_max_volume, step_passes
+
+# average duration of picking up and dropping a tip, and of an aspirate/dispense cycle, in seconds
+TIP_SECONDS = 10.0
+ASPIRATE_SECONDS = 3.0
+# average speed of the gantry between wells, in mm/s
+HEAD_SPEED = 400.0
+
+# OT-2 deck geometry in mm: slots are arranged in 4 rows of 3 from the front left, and wells of the
+# SBS plates are spaced by 9 mm from the A1 offset, for labware without a definition; the thermocycler sits on slots 7-8-10-11
+SLOT_PITCH = (132.5, 90.5)
+WELL_PITCH = 9.0
+A1_OFFSET = (14.38, 74.24)
+TRASH_SLOT = 12
+THERMOCYCLER_SLOT = 7
+# tips held by a tip rack, and picked up at once by an 8-channel pipette
+RACK_TIPS = 96
+CHANNELS = 8
+# labware of the locations given as a transfer field
+LOCATION_LABWARE = "agar_plate_name"
+
+# Transfer fields and contamination rules of each step: new_tip is "once" when a tip can serve the whole
+# step, or "always" when it touches cells or cultures; slots are given as a protocol parameter or a transfer field.
+# Overlapped steps run during a thermocycler hold, and do not add to the run time.
+STEP_RULES = {
+    "protocol-1": {
+        "cells": {"fields": ("source", "volume", "destination", "mix_volume"), "new_tip": "once", "mix_per_source": True,
+                  "source_slot": "cells_plate_slot", "destination_slot": "destination_plate_slot"},
+        "dna": {"fields": ("source", "volume", "destination", "mix_volume"), "new_tip": "always",
+                "source_slot": "dna_plate_slot", "destination_slot": "destination_plate_slot"},
+        "media": {"fields": ("source", "volume", "destination", "mix_volume"), "new_tip": "always",
+                  "source_slot": "media_plate_slot", "destination_slot": "destination_plate_slot"},
+        "media_staging": {"fields": ("source", "volume", "destination"), "new_tip": "once", "multi_dispense": True, "overlapped": True,
+                          "source_slot": "media_plate_slot", "destination_slot": "media_staging_plate_slot"},
+        "staged_media": {"fields": ("source", "volume", "destination", "mix_volume"), "new_tip": "always",
+                         "source_slot": "media_staging_plate_slot", "destination_slot": "destination_plate_slot"},
+    },
+    "protocol-2": {
+        "spotting": {"fields": ("location", "source", "volume", "destinations"), "new_tip": "always",
+                     "source_slot": "source_plate_slot", "destination_slot": "location"},
+    },
+    "protocol-3": {
+        "media": {"fields": ("source", "volume", "destination"), "new_tip": "once", "multi_dispense": True,
+                  "source_slot": "media_plate_slot", "destination_slot": "destination_plate_slot"},
+        "sampling": {"fields": ("location", "source", "destination"), "new_tip": "always",
+                     "source_slot": "location", "destination_slot": "media_plate_slot"},
+    },
+    "protocol-4": {
+        "media": {"fields": ("source", "volume", "destination"), "new_tip": "once", "multi_dispense": True,
+                  "source_slot": "media_plate_slot", "destination_slot": "destination_plate_slot"},
+        "culture": {"fields": ("source", "volume", "destination"), "new_tip": "always",
+                    "source_slot": "culture_plate_slot", "destination_slot": "destination_plate_slot"},
+        "inducer": {"fields": ("source", "volume", "destination"), "new_tip": "always",
+                    "source_slot": "inducer_plate_slot", "destination_slot": "destination_plate_slot"},
+    },
+}
+
+def well_index(well: str) -> Tuple[int, int]:
+    """Return the (row, column) indexes of a well name, e.g. (1, 0) for B1."""
+    return ord(well[0].upper()) - ord("A"), int(well[1:]) - 1
+
+def serpentine_key(well: str) -> Tuple[int, int]:
+    """Order wells column by column, alternating the row direction, so consecutive wells are adjacent."""
+    row, col = well_index(well)
+    return col, row if col % 2 == 0 else -row
+
+def slot_number(slot: Any) -> int:
+    """Return the deck slot number of a location, mapping the thermocycler to its front slot."""
+    return THERMOCYCLER_SLOT if slot == "thermocycler" else int(slot)
+
+def labware_definition(labware_dir: Optional[str], name: Optional[str]) -> Optional[Labware]:
+    """Return the compact definition of a labware, or None if it is unknown or no labware directory is given."""
+    return registry(labware_dir).get(name) if labware_dir is not None and name is not None else None
+
+def well_position(slot: Any, well: Optional[str] = None, labware: Optional[Labware] = None) -> Tuple[float, float]:
+    """Return the deck coordinates of a well, from the definition of its labware if given, or as on a 96-well
+    plate otherwise; the slot A1 offset is returned if no well is given."""
+    slot = slot_number(slot) - 1
+    origin = (SLOT_PITCH[0] * (slot % 3), SLOT_PITCH[1] * (slot // 3))
+    if labware is not None and well in labware.wells:
+        return origin[0] + labware.wells[well].x, origin[1] + labware.wells[well].y
+    row, col = well_index(well) if well else (0, 0)
+    return origin[0] + A1_OFFSET[0] + WELL_PITCH * col, origin[1] + A1_OFFSET[1] - WELL_PITCH * row
+
+def as_record(transfer: Tuple, rule: Dict[str, Any]) -> Dict[str, Any]:
+    """Name the fields of a transfer tuple."""
+    return dict(zip(rule["fields"], transfer))
+
+def step_slot(record: Dict[str, Any], rule: Dict[str, Any], params: Dict[str, Any], name: str) -> Any:
+    """Return the source or destination slot of a transfer, from its fields or the protocol parameters."""
+    key = rule[f"{name}_slot"]
+    return record[key] if key in record else params[key]
+
+def step_labware(rule: Dict[str, Any], params: Dict[str, Any], name: str) -> Optional[str]:
+    """Return the load name of the source or destination labware of a step, from the protocol parameters."""
+    key = rule[f"{name}_slot"]
+    return params.get(LOCATION_LABWARE if key in rule["fields"] else key[:-len("_slot")] + "_name")
+
+def step_pipette(params: Dict[str, Any], mount: str) -> Tuple[str, List[Any]]:
+    """Return the pipette name and tip rack slots used by a step."""
+    if f"{mount}_pipette_name" in params:
+        return params[f"{mount}_pipette_name"], params[f"{mount}_pipette_tiprack_slot"]
+    return params["pipette_name"], params["tiprack_slots"]
+
+def rack_pick_ups(pipette_name: str) -> int:
+    """Return the tip pick-ups of a tip rack by a pipette, a column at a time for 8-channel pipettes."""
+    return RACK_TIPS // CHANNELS if is_multichannel(pipette_name) else RACK_TIPS
+
+def order_transfers(transfers: List[Tuple], rule: Dict[str, Any]) -> List[Tuple]:
+    """Group transfers by plate and source well, visiting sources and destinations along serpentine paths."""
+    def key(transfer):
+        record = as_record(transfer, rule)
+        destination = record["destinations"][0] if "destinations" in record else record["destination"]
+        return record.get("location") or 0, serpentine_key(record["source"]), serpentine_key(destination)
+    ordered = sorted(transfers, key=key)
+
+    if rule.get("mix_per_source"):
+        # the source is mixed before its first transfer, with the mix volume computed over all its transfers
+        mix_index = rule["fields"].index("mix_volume")
+        mix_volumes = {transfer[0]: max(t[mix_index] for t in transfers if t[0] == transfer[0]) for transfer in transfers}
+        mixed, reordered = set(), []
+        for transfer in ordered:
+            mix_volume = mix_volumes[transfer[0]] if transfer[0] not in mixed else 0.0
+            mixed.add(transfer[0])
+            reordered.append(transfer[:mix_index] + (mix_volume,) + transfer[mix_index + 1:])
+        ordered = reordered
+    return ordered
+
+def dispense_groups(records: List[Dict[str, Any]], max_volume: float, multi_dispense: bool) -> List[List[Dict[str, Any]]]:
+    """Split transfers into aspirations: consecutive transfers from the same source share an aspiration
+    when multi-dispensing and their total volume fits in the tip."""
+    groups = []
+    for record in records:
+        volume = record.get("volume") or 0.0
+        last = groups[-1] if groups else None
+        if (multi_dispense and last and last[0]["source"] == record["source"]
+                and sum(r["volume"] for r in last) + volume <= max_volume):
+            last.append(record)
+        else:
+            groups.append([record])
+    return groups
+
+def step_path(transfers: List[Tuple], rule: Dict[str, Any], params: Dict[str, Any], mount: str,
+              multi_dispense: bool, tips_used: int = 0) -> Tuple[List[Tuple[Any, Optional[str], Optional[str]]], int, int]:
+    """Return the (slot, well, labware) locations visited by the head during a step, with its tips and aspirations.
+    Tips are picked up from the racks in order, after the tips_used by earlier steps; tip racks and the trash
+    are visited at their A1 offset, given as a None well and labware."""
+    pipette_name, tiprack_slots = step_pipette(params, mount)
+    max_volume = pipette_max_volume(pipette_name)
+    records = [as_record(transfer, rule) for transfer in transfers]
+    tiprack = lambda: (tiprack_slots[min((tips_used + tips) // rack_pick_ups(pipette_name), len(tiprack_slots) - 1)], None, None)
+    source_labware, destination_labware = step_labware(rule, params, "source"), step_labware(rule, params, "destination")
+
+    path, tips, aspirations = [], 0, 0
+    if rule["new_tip"] == "once" and records:
+        path.append(tiprack())
+        tips += 1
+    for group in dispense_groups(records, max_volume, multi_dispense):
+        if rule["new_tip"] == "always":
+            path.append(tiprack())
+            tips += 1
+        source = (step_slot(group[0], rule, params, "source"), group[0]["source"], source_labware)
+        destination_slot = step_slot(group[0], rule, params, "destination")
+        if len(group) > 1:
+            aspirations += math.ceil(sum(record["volume"] for record in group) / max_volume)
+            path.append(source)
+            path += [(destination_slot, record["destination"], destination_labware) for record in group]
+        else:
+            record = group[0]
+            destinations = record["destinations"] if "destinations" in record else (record["destination"],)
+            repeats = math.ceil((record.get("volume") or 0.0) / max_volume) or 1
+            if rule["new_tip"] == "always" and "destinations" not in record:
+                tips += repeats - 1 # transfer() picks up a new tip for each aspiration of a split volume
+            for destination in destinations:
+                aspirations += repeats
+                path += [source, (destination_slot, destination, destination_labware)] * repeats
+        if rule["new_tip"] == "always":
+            path.append((TRASH_SLOT, None, None))
+    if rule["new_tip"] == "once" and records:
+        path.append((TRASH_SLOT, None, None))
+    return path, tips, aspirations
+
+def estimate_step(transfers: List[Tuple], rule: Dict[str, Any], params: Dict[str, Any], mount: str, multi_dispense: bool,
+                  labware_dir: Optional[str] = None) -> Dict[str, float]:
+    """Estimate tips, aspirations, head travel and duration of a step, positioning wells from the labware definitions
+    of labware_dir."""
+    path, tips, aspirations = step_path(transfers, rule, params, mount, multi_dispense)
+    positions = [well_position(slot, well, labware_definition(labware_dir, labware)) for slot, well, labware in path]
+    travel = sum(math.dist(a, b) for a, b in zip(positions, positions[1:]))
+    return {"tips": tips, "aspirations": aspirations, "travel_mm": round(travel, 1),
+            "seconds": round(tips * TIP_SECONDS + aspirations * ASPIRATE_SECONDS + travel / HEAD_SPEED, 1)}
+
+def estimate_passes(step: Dict[str, Any], rule: Dict[str, Any], params: Dict[str, Any], multi_dispense: bool,
+                    labware_dir: Optional[str] = None) -> Dict[str, float]:
+    """Estimate tips, aspirations, head travel and duration of the 8-channel and single-channel passes of a step."""
+    estimates = [estimate_step(step_pass["transfers"], rule, params, step_pass["pipette"], multi_dispense, labware_dir)
+                 for step_pass in step_passes(step)]
+    return {metric: round(sum(estimate[metric] for estimate in estimates), 1) for metric in estimates[0]}
+
+def optimise_plan(protocol: str, params: Dict[str, Any], plan: Dict[str, Any],
+                  labware_dir: Optional[str] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Optimise the transfers of every step of a plan, returning the optimised plan and the estimated savings.
+    The order of the transfers, and multi-dispensing, are only changed where no estimate of the step gets worse."""
+    optimised, report = {}, {"steps": {}}
+    for name, step in plan.items():
+        rule = STEP_RULES[protocol][name]
+        before = estimate_passes(step, rule, params, False, labware_dir)
+        candidates = [({**step, "multi_dispense": False}, before)]
+        reordered = map_transfers(step, lambda transfers, _: tuple(order_transfers(list(transfers), rule)))
+        for multi_dispense in ([False, True] if rule.get("multi_dispense", False) else [False]):
+            for candidate in ([step, reordered] if multi_dispense else [reordered]):
+                candidate = {**candidate, "multi_dispense": multi_dispense}
+                estimate = estimate_passes(candidate, rule, params, multi_dispense, labware_dir)
+                if all(estimate[metric] <= before[metric] for metric in before):
+                    candidates.append((candidate, estimate))
+        optimised[name], after = min(candidates, key=lambda candidate: (candidate[1]["seconds"], candidate[1]["travel_mm"]))
+        report["steps"][name] = {"before": before, "after": after}
+
+    steps = report["steps"].values()
+    report["saved"] = {metric: round(sum(s["before"][metric] - s["after"][metric] for s in steps), 1)
+                       for metric in ["tips", "aspirations", "travel_mm", "seconds"]}
+    return optimised, report
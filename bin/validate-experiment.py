@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""validate-experiment.py
+
+    Validate the JSON parameters and CSV data of experiments against the schema of their protocol and the
+    labware definitions (see experiment_validator.py), in milliseconds, before compiling and simulating them.
+    All errors of every experiment are printed, or written to the report file if given, and the exit status is 1 if any
+    experiment is invalid.
+
+    Usage:
+        validate-experiment.py [-l <labware_dir>] [-o <out_file>] <csv_file> <json_file>
+        validate-experiment.py batch [-l <labware_dir>] [-o <out_file>] (<id> <csv_file> <json_file>)...
+
+    Input:
+    <csv_file>       Path to the CSV file containing experiment data.
+    <json_file>      Path to the JSON file containing protocol parameters.
+    <id>             Experiment identifier ending with its protocol (e.g. protocol-1).
+
+    The protocol of a single experiment is identified by the "protocol-N" in its CSV file name.
+
+    Options:
+    -l, --labware-dir <labware_dir>   Directory of the custom labware definitions [default: assets/labware].
+    -o, --output-file <out_file>      Validation report, printed if not set.
+    -h --help                         Show this screen.
+"""
+
+import os
+import re
+import sys
+
+from docopt import docopt
+
+from experiment_validator import VALIDATION_SCHEMAS, ValidationError, validate_files
+
+def protocol_type(name: str) -> str:
+    """Return the protocol (e.g. protocol-1) identified in an experiment id or file name."""
+    match = re.search(r"protocol-\d+", os.path.basename(name))
+    if match is None or match.group(0) not in VALIDATION_SCHEMAS:
+        raise ValidationError([f"Cannot identify the protocol of {name}, expected one of {', '.join(VALIDATION_SCHEMAS)}."])
+    return match.group(0)
+
+def main():
+    args = docopt(__doc__)
+    if args["batch"]:
+        experiments = list(zip(args["<id>"], args["<csv_file>"], args["<json_file>"]))
+    else:
+        # docopt returns the repeated batch arguments as lists in both usages
+        experiments = [(args["<csv_file>"][0], args["<csv_file>"][0], args["<json_file>"][0])]
+
+    report, invalid = [], 0
+    for id, csv_file, json_file in experiments:
+        try:
+            validate_files(protocol_type(id), json_file, csv_file, args["--labware-dir"])
+            report.append(f"{id}: valid")
+        except ValidationError as error:
+            invalid += 1
+            report += [f"{id}: {len(error.errors)} error(s)"] + [f"    {message}" for message in error.errors]
+
+    if args["--output-file"]:
+        with open(args["--output-file"], "w") as f:
+            f.write("\n".join(report) + "\n")
+    else:
+        print("\n".join(report))
+    if invalid:
+        sys.exit(f"{invalid} of {len(experiments)} experiment(s) are invalid.")
+
+if __name__ == "__main__":
+    main()
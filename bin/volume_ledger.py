@@ -0,0 +1,76 @@
+"""volume_ledger.py
+
+    Liquid volume ledger and tip inventory of an experiment, computed at compile time.
+
+    The ledger sums the volume drawn from and added to every well in a single pass over the CSV rows, against the
+    capacity of its labware (see experiment_validator.py), and counts the tips each pipette mount needs for the
+    planned transfers against the tips held by its racks. Shortfalls are reported with the number of extra tip
+    racks needed and the free deck slots where they can be loaded, before the protocol fails on the robot.
+"""
+
+import math
+from typing import Any, Dict, List
+
+from experiment_validator import DECK_SLOTS, THERMOCYCLER_SLOTS, slot_number, volume_errors, well_volumes
+from step_plan import step_passes
+from transfer_optimiser import STEP_RULES, estimate_step, rack_pick_ups, step_pipette
+
+def tiprack_key(params: Dict[str, Any], mount: str) -> str:
+    """Return the parameter listing the tip rack slots of the pipette on mount."""
+    return f"{mount}_pipette_tiprack_slot" if f"{mount}_pipette_tiprack_slot" in params else "tiprack_slots"
+
+def tip_capacity(params: Dict[str, Any], mount: str) -> int:
+    """Return the number of tip pick-ups available to the pipette on mount."""
+    pipette_name, _ = step_pipette(params, mount)
+    return len(params[tiprack_key(params, mount)]) * rack_pick_ups(pipette_name)
+
+def tip_demand(protocol: str, params: Dict[str, Any], plan: Dict[str, Any]) -> Dict[str, int]:
+    """Count the tip pick-ups of the planned transfers of each pipette mount."""
+    tips = {}
+    for name, step in plan.items():
+        rule = STEP_RULES[protocol][name]
+        for step_pass in step_passes(step):
+            if step_pass["transfers"]:
+                estimate = estimate_step(step_pass["transfers"], rule, params, step_pass["pipette"], step.get("multi_dispense", False))
+                tips[step_pass["pipette"]] = tips.get(step_pass["pipette"], 0) + estimate["tips"]
+    return tips
+
+def free_slots(params: Dict[str, Any]) -> List[int]:
+    """Return the deck slots not used by any plate, tip rack or module of the parameters."""
+    used = set()
+    for key, value in params.items():
+        if not key.endswith(("_slot", "_slots")):
+            continue
+        for slot in value if isinstance(value, list) else [value]:
+            used |= set(THERMOCYCLER_SLOTS) if slot == "thermocycler" else {slot_number(slot)}
+    return sorted(DECK_SLOTS - used)
+
+def tip_inventory(protocol: str, params: Dict[str, Any], plan: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Compare the tips needed by each pipette mount with the tips of its racks."""
+    inventory = {}
+    for mount, needed in tip_demand(protocol, params, plan).items():
+        pipette_name, _ = step_pipette(params, mount)
+        available = tip_capacity(params, mount)
+        shortfall = max(needed - available, 0)
+        inventory[mount] = {"pipette": pipette_name, "tip_racks": params[tiprack_key(params, mount)],
+                            "needed": needed, "available": available, "shortfall": shortfall,
+                            "extra_racks": math.ceil(shortfall / rack_pick_ups(pipette_name))}
+    return inventory
+
+def tip_errors(params: Dict[str, Any], inventory: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Report the pipettes running out of tips, with the extra tip racks needed."""
+    slots = free_slots(params)
+    return [f"{tips['pipette']} on {mount} needs {tips['needed']} tip pick-ups but its racks in slots {tips['tip_racks']} "
+            f"hold {tips['available']}: add {tips['extra_racks']} tip rack(s) to {tiprack_key(params, mount)} "
+            f"(free slots: {slots or 'none'}), or shard the experiment."
+            for mount, tips in inventory.items() if tips["shortfall"]]
+
+def build_ledger(protocol: str, params: Dict[str, Any], rows: List[Dict[str, Any]], plan: Dict[str, Any], labware_dir: str) -> Dict[str, Any]:
+    """Build the volume ledger and tip inventory of an experiment, with all shortfalls found."""
+    volumes, errors = well_volumes(protocol, params, rows, labware_dir)
+    inventory = tip_inventory(protocol, params, plan)
+    wells = [{"slot": slot, "well": well, "labware": entry["labware"].name if entry["labware"] else None,
+              "drawn": round(entry["drawn"], 3), "added": round(entry["added"], 3),
+              "capacity": entry["labware"].wells[well].volume if entry["labware"] else None}
+             for (slot, well), entry in volumes.items()]
+    return {"wells": wells, "tips": inventory, "shortfalls": errors + volume_errors(volumes) + tip_errors(params, inventory)}
@@ -1,118 +1,114 @@
-include { MAKE_PROTOCOL_1; MAKE_PROTOCOL_2; MAKE_PROTOCOL_3;  MAKE_PROTOCOL_4} from './modules/protocol_compiler'
-include { SIMULATE_PROTOCOL_1; SIMULATE_PROTOCOL_2; SIMULATE_PROTOCOL_3; SIMULATE_PROTOCOL_4; } from './modules/protocol_compiler'
-include { CREATE_LABWARE_CSV as CREATE_LABWARE_CSV_1; CREATE_LABWARE_CSV as CREATE_LABWARE_CSV_2; CREATE_LABWARE_CSV as CREATE_LABWARE_CSV_3; CREATE_LABWARE_CSV as CREATE_LABWARE_CSV_4 } from './modules/instructions_compiler'
-include { VISUALISE_LABWARE as VISUALISE_LABWARE_1; VISUALISE_LABWARE as VISUALISE_LABWARE_2; VISUALISE_LABWARE as VISUALISE_LABWARE_3; VISUALISE_LABWARE as VISUALISE_LABWARE_4 } from './modules/instructions_compiler'
-include { MAKE_INSTRUCTIONS_1;  MAKE_INSTRUCTIONS_2; MAKE_INSTRUCTIONS_3; MAKE_INSTRUCTIONS_4} from './modules/instructions_compiler'
+include { VALIDATE_EXPERIMENTS } from './modules/protocol_compiler'
+include { MAKE_PROTOCOLS } from './modules/protocol_compiler'
+include { SIMULATE_PROTOCOLS } from './modules/protocol_compiler'
+include { ESTIMATE_RUNTIME } from './modules/protocol_compiler'
+include { SHARD_EXPERIMENTS; MAKE_SHARDED_PROTOCOLS } from './modules/protocol_compiler'
+include { OPTIMISE_LAYOUT } from './modules/protocol_compiler'
+include { CREATE_LABWARE_CSV } from './modules/instructions_compiler'
+include { VISUALISE_LABWARE } from './modules/instructions_compiler'
+include { MAKE_INSTRUCTIONS } from './modules/instructions_compiler'
 
-workflow PROTOCOL_1 {
+PROTOCOLS = ["protocol-1", "protocol-2", "protocol-3", "protocol-4"]
 
-    // PROTOCOL 1 - TRANSFORMATION
-    MAKE_PROTOCOL_1(
-        tuple(file("$params.protocol_1_config"), file("$params.protocol_1_data")), 
-        file("$params.protocol_template_dir")
-    )
-    SIMULATE_PROTOCOL_1(
-        MAKE_PROTOCOL_1.out,
-        file("$params.opentrons_labware_dir")
-    )
-    CREATE_LABWARE_CSV_1(
-        tuple(file("$params.protocol_1_data"), file("$params.protocol_1_config"))
-    )
-    VISUALISE_LABWARE_1(
-        CREATE_LABWARE_CSV_1.out, 
-        file("$params.opentrons_labware_dir")
-    )
-    MAKE_INSTRUCTIONS_1( 
-        file("$params.protocol_1_instructions"),
-        file("$params.protocol_1_config"),
-        VISUALISE_LABWARE_1.out
-    )
-}
+// experiments as [id, protocol, config, data], read from the samplesheet (columns: id, protocol, config, data),
+// or the single experiment of each protocol given by the protocol_N_config and protocol_N_data parameters
+def load_experiments() {
+    if (!params.samplesheet) {
+        return Channel.fromList(PROTOCOLS.collect { protocol ->
+            def name = protocol.replace("-", "_")
+            [protocol, protocol, file(params["${name}_config".toString()], checkIfExists: true), file(params["${name}_data".toString()], checkIfExists: true)]
+        })
+    }
 
-workflow PROTOCOL_2 {
+    // paths are relative to the samplesheet, and ids end with their protocol as expected by the batch scripts
+    def samplesheet = file(params.samplesheet, checkIfExists: true)
+    return Channel.fromPath(samplesheet)
+        .splitCsv(header: true)
+        .map { row ->
+            if (!(row.protocol in PROTOCOLS)) {
+                error "Unknown protocol '${row.protocol}' of experiment '${row.id}' in ${params.samplesheet}, expected one of ${PROTOCOLS.join(', ')}"
+            }
+            def config = samplesheet.parent.resolve(row.config)
+            def data = samplesheet.parent.resolve(row.data)
+            ["${row.id}-${row.protocol}".toString(), row.protocol, file(config, checkIfExists: true), file(data, checkIfExists: true)]
+        }
+}
 
-    // PROTOCOL 2 - SELECTION
-    MAKE_PROTOCOL_2(
-        tuple(file("$params.protocol_2_config"), file("$params.protocol_2_data")), 
-        file("$params.protocol_template_dir")
-    )
-    SIMULATE_PROTOCOL_2(
-        MAKE_PROTOCOL_2.out,
-        file("$params.opentrons_labware_dir")
-    )
-    CREATE_LABWARE_CSV_2(
-        tuple(file("$params.protocol_2_data"), file("$params.protocol_2_config"))
-    )
-    VISUALISE_LABWARE_2(
-        CREATE_LABWARE_CSV_2.out, 
-        file("$params.opentrons_labware_dir")
-    )
+// custom labware definitions used by the given experiment configs, so that tasks stage only those instead of the whole directory
+def labware_files(configs) {
+    def names = configs.collectMany { config ->
+        new groovy.json.JsonSlurper().parse(config).findAll { key, value -> key.endsWith("_name") && value instanceof String }.values()
+    }
+    return names.unique().collect { name -> file("${params.opentrons_labware_dir}/${name}.json") }.findAll { it.exists() }
+}
 
-    MAKE_INSTRUCTIONS_2( 
-        file("$params.protocol_2_instructions"),
-        file("$params.protocol_2_config"),
-        VISUALISE_LABWARE_2.out
-    )
+workflow {
+    experiments = load_experiments()
+    labware = experiments.map { id, protocol, config, data -> config }.collect().map { configs -> labware_files(configs) }
 
-}
+    // experiments are processed in batches of batch_size, each batch in a single task, so that a
+    // large samplesheet runs in parallel under the executor queueSize without a task per experiment
+    batches = experiments
+        .collate(params.batch_size)
+        .map { batch -> batch.transpose() }
 
-workflow PROTOCOL_3 {
+    // check every batch against the protocol schemas and labware definitions, and process only valid batches:
+    // batches with an invalid experiment are reported and left out of the rest of the run
+    VALIDATE_EXPERIMENTS(batches, labware)
+    valid = VALIDATE_EXPERIMENTS.out.filter { ids, report ->
+        def invalid = report.readLines().findAll { line -> !line.startsWith(" ") && !line.endsWith(": valid") }
+        if (invalid) {
+            log.warn "Skipping batch ${ids.join(', ')}: ${invalid.join(', ')}, see ${report.name}"
+        }
+        !invalid
+    }
+    batches = batches
+        .join(valid)
+        .map { ids, protocols, configs, csvs, report -> [ids, protocols, configs, csvs] }
 
-    // PROTOCOL 3 - SAMPLING
-    MAKE_PROTOCOL_3(
-        tuple(file("$params.protocol_3_config"), file("$params.protocol_3_data")), 
-        file("$params.protocol_template_dir")
-    )
-    SIMULATE_PROTOCOL_3(
-        MAKE_PROTOCOL_3.out,
-        file("$params.opentrons_labware_dir")
-    )
-    CREATE_LABWARE_CSV_3(
-        tuple(file("$params.protocol_3_data"), file("$params.protocol_3_config"))
-    )
-    VISUALISE_LABWARE_3(
-        CREATE_LABWARE_CSV_3.out, 
-        file("$params.opentrons_labware_dir")
-    )
+    if (params.optimise_layout) {
+        // propose deck layouts minimising head travel, and with "apply" run the experiments with their new layout from here on
+        OPTIMISE_LAYOUT(batches, labware)
+        if (params.optimise_layout == "apply") {
+            batches = OPTIMISE_LAYOUT.out.experiments.map { ids, protocols, layout ->
+                [ids, protocols, ids.collect { id -> layout.resolve("${id}-config.json") }, ids.collect { id -> layout.resolve("${id}-data.csv") }]
+            }
+            experiments = batches.flatMap { batch -> batch.transpose() }
+        }
+    }
 
-    MAKE_INSTRUCTIONS_3( 
-        file("$params.protocol_3_instructions"),
-        file("$params.protocol_3_config"),
-        VISUALISE_LABWARE_3.out
+    if (params.shard) {
+        // split experiments larger than a deck into shards balanced across robots, which needs all experiments at once
+        all_experiments = batches.flatMap { batch -> batch.transpose() }.toList().map { batch -> batch.transpose() }
+        SHARD_EXPERIMENTS(all_experiments.map { ids, protocols, configs, csvs -> [ids, csvs, configs] }, labware)
+        MAKE_SHARDED_PROTOCOLS(SHARD_EXPERIMENTS.out, file("$params.protocol_template_dir"), labware)
+        protocols = MAKE_SHARDED_PROTOCOLS.out.protocols
+    } else {
+        MAKE_PROTOCOLS(batches, file("$params.protocol_template_dir"), labware)
+        protocols = MAKE_PROTOCOLS.out.protocols
+    }
+    SIMULATE_PROTOCOLS(
+        protocols,
+        labware
+    )
+    // estimate the run time of all protocols from their simulations
+    ESTIMATE_RUNTIME(
+        SIMULATE_PROTOCOLS.out.flatten().filter { it.name.endsWith("-simulation.json") }.collect()
     )
 
-}
-
-workflow PROTOCOL_4 {
+    // build the labware tables of each batch, then plot and render the instructions of each experiment
+    CREATE_LABWARE_CSV(batches.map { ids, protocols, configs, csvs -> [ids, csvs, configs] })
+    labware_csvs = CREATE_LABWARE_CSV.out
+        .flatten()
+        .map { csv -> [csv.name - "-labware.csv", csv] }
 
-    // PROTOCOL 4 - INDUCTION
-    MAKE_PROTOCOL_4(
-        tuple(file("$params.protocol_4_config"), file("$params.protocol_4_data")), 
-        file("$params.protocol_template_dir")
+    VISUALISE_LABWARE(
+        labware_csvs,
+        labware
     )
-    SIMULATE_PROTOCOL_4(
-        MAKE_PROTOCOL_4.out,
-        file("$params.opentrons_labware_dir")
+    MAKE_INSTRUCTIONS(
+        experiments
+            .map { id, protocol, config, data -> [id, file(params["${protocol.replace('-', '_')}_instructions".toString()]), config] }
+            .join(VISUALISE_LABWARE.out)
     )
-    CREATE_LABWARE_CSV_4(
-        tuple(file("$params.protocol_4_data"), file("$params.protocol_4_config"))
-    )
-    VISUALISE_LABWARE_4(
-        CREATE_LABWARE_CSV_4.out, 
-        file("$params.opentrons_labware_dir")
-    )
-
-    MAKE_INSTRUCTIONS_4( 
-        file("$params.protocol_4_instructions"),
-        file("$params.protocol_4_config"),
-        VISUALISE_LABWARE_4.out
-    )
-
 }
-
-workflow {
-    PROTOCOL_1()
-    PROTOCOL_2()
-    PROTOCOL_3()
-    PROTOCOL_4()
-}
\ No newline at end of file
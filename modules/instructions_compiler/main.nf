@@ -1,122 +1,58 @@
 process CREATE_LABWARE_CSV {
 
     input:
-        tuple path(csv), path(config)
+        tuple val(ids), path(csvs, stageAs: "data?.csv"), path(configs, stageAs: "config?.json")
 
     output:
-        path("labware.csv")
+        path("*-labware.csv")
 
     script:
+    def experiments = [ids, csvs, configs].transpose().collect { id, csv, config -> "${id} ${csv} ${config}" }
     """
-        create-labware.py ${csv} ${config} labware.csv
+        create-labware.py batch -O . ${experiments.join(' ')}
     """
 }
 
 process VISUALISE_LABWARE {
 
     input:
-        path(csv_labware)
-        path(opentrons_dir)
+        tuple val(id), path(csv_labware)
+        path(labware, stageAs: "labware/*")
 
     output:
-        path("plots")
+        tuple val(id), path("plots")
 
     script:
+    def cache = params.cache_dir ? "-c ${params.cache_dir}" : ""
     """
-        visualise-labware.R ${csv_labware} ${opentrons_dir}
+        mkdir -p labware
+        plot-labware.py -j ${task.cpus} ${cache} ${csv_labware} labware
     """
-} 
 
-process MAKE_INSTRUCTIONS_1 {
-
-    publishDir "${params.resultsDir}", pattern: "protocol-1-instructions.pdf", mode: 'copy'
-
-    input:
-        path(markdown_file)
-        path(config)
-        path(plots)
-
-    output:
-    path "protocol-1-instructions.pdf"
-
-    script:
-    """
-    R -e "rmarkdown::render('${markdown_file}', output_file = 'protocol-1-instructions.pdf', params = list(json_path = '${config}', labware_images_dir = '${plots}'))"
-    """
-
-    stub: 
-    """
-        touch protocol-1-instructions.pdf
-    """
-
-}
-
-process MAKE_INSTRUCTIONS_2 {
-
-    publishDir "${params.resultsDir}", pattern: "protocol-2-instructions.pdf", mode: 'copy'
-
-    input:
-        path(markdown_file)
-        path(config)
-        path(plots)
-
-    output:
-    path "protocol-2-instructions.pdf"
-
-    script:
-    """
-    R -e "rmarkdown::render('${markdown_file}', output_file = 'protocol-2-instructions.pdf', params = list(json_path = '${config}', labware_images_dir = '${plots}'))"
-    """
-
-    stub: 
+    stub:
     """
-        touch protocol-2-instructions.pdf
+        mkdir -p plots
     """
-
 }
 
-process MAKE_INSTRUCTIONS_3 {
+process MAKE_INSTRUCTIONS {
 
-    publishDir "${params.resultsDir}", pattern: "protocol-3-instructions.pdf", mode: 'copy'
+    publishDir "${params.resultsDir}", pattern: "*-instructions.*", mode: 'copy'
 
     input:
-        path(markdown_file)
-        path(config)
-        path(plots)
+        tuple val(id), path(markdown_file), path(config), path(plots)
 
     output:
-    path "protocol-3-instructions.pdf"
+    path "${id}-instructions.${params.instructions_format}"
 
     script:
+    def cache = params.cache_dir ? "-c ${params.cache_dir}" : ""
     """
-    R -e "rmarkdown::render('${markdown_file}', output_file = 'protocol-3-instructions.pdf', params = list(json_path = '${config}', labware_images_dir = '${plots}'))"
+        render-instructions.py -f ${params.instructions_format} -o ${id}-instructions.${params.instructions_format} ${cache} ${markdown_file} ${config} ${plots}
     """
 
     stub: 
     """
-        touch protocol-3-instructions.pdf
+        touch ${id}-instructions.${params.instructions_format}
     """
 }
-
-process MAKE_INSTRUCTIONS_4 {
-
-    publishDir "${params.resultsDir}", pattern: "protocol-4-instructions.pdf", mode: 'copy'
-
-    input:
-        path(markdown_file)
-        path(config)
-        path(plots)
-
-    output:
-    path "protocol-4-instructions.pdf"
-
-    script:
-    """
-    R -e "rmarkdown::render('${markdown_file}', output_file = 'protocol-4-instructions.pdf', params = list(json_path = '${config}', labware_images_dir = '${plots}'))"
-    """
-
-    stub: 
-    """
-        touch protocol-4-instructions.pdf
-    """
-}
\ No newline at end of file
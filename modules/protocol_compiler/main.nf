@@ -1,186 +1,193 @@
-process MAKE_PROTOCOL_1 {
+process VALIDATE_EXPERIMENTS {
 
-    publishDir "${params.resultsDir}", pattern: "protocol-1.py", mode: 'copy'
+    publishDir "${params.resultsDir}", pattern: "validation-*.txt", mode: 'copy'
 
     input:
-        tuple path(config), path(csv)
-        path(template_dir)
+        tuple val(ids), val(protocols), path(configs, stageAs: "config?.json"), path(csvs, stageAs: "data?.csv")
+        path(labware, stageAs: "labware/*")
 
     output:
-        path 'protocol-1.py'
+        tuple val(ids), path("validation-*.txt")
 
     script:
+    def experiments = [ids, csvs, configs].transpose().collect { id, csv, config -> "${id} ${csv} ${config}" }
+    // invalid experiments exit with an error once the report is written: the batch is then left out by the workflow,
+    // while a failure before the report is written still stops the pipeline
     """
-        protocol-compiler.py -d ${template_dir} -o protocol-1.py \
-            protocol-1-template.py ${config} ${csv}
+        mkdir -p labware
+        validate-experiment.py batch -l labware -o validation-${task.index}.txt ${experiments.join(' ')} || test -s validation-${task.index}.txt
     """
 
-    stub: 
+    stub:
     """
-        touch protocol-1.py
+        printf '${ids.collect { id -> "${id}: valid" }.join('\\n')}\\n' > validation-${task.index}.txt
     """
-
 }
 
-process MAKE_PROTOCOL_2 {
+process OPTIMISE_LAYOUT {
 
-    publishDir "${params.resultsDir}", pattern: "protocol-2.py", mode: 'copy'
+    publishDir "${params.resultsDir}", pattern: "layout-*.json", mode: 'copy'
 
     input:
-        tuple path(config), path(csv)
-        path(template_dir)
+        tuple val(ids), val(protocols), path(configs, stageAs: "config?.json"), path(csvs, stageAs: "data?.csv")
+        path(labware, stageAs: "labware/*")
 
     output:
-        path 'protocol-2.py'
+        tuple val(ids), val(protocols), path('layout'), emit: experiments
+        path 'layout-*.json', emit: report
 
     script:
+    def experiments = [ids, csvs, configs].transpose().collect { id, csv, config -> "${id} ${csv} ${config}" }
+    def apply = params.optimise_layout == "apply" ? "-a" : ""
+    def optimise = params.optimise_transfers ? "-p" : ""
     """
-        protocol-compiler.py -d ${template_dir} -o protocol-2.py \
-            protocol-2-template.py ${config} ${csv}
+        mkdir -p layout labware
+        optimise-layout.py -O layout -r layout-${task.index}.json -l labware ${apply} ${optimise} ${experiments.join(' ')}
     """
 
-    stub: 
+    stub:
     """
-        touch protocol-2.py
+        mkdir -p layout
+        touch layout-${task.index}.json
     """
-
 }
 
-process MAKE_PROTOCOL_3 {
+process MAKE_PROTOCOLS {
 
-    publishDir "${params.resultsDir}", pattern: "protocol-3.py", mode: 'copy'
+    publishDir "${params.resultsDir}", pattern: "*protocol-*.py", mode: 'copy'
+    publishDir "${params.resultsDir}", pattern: "optimisation-*.json", mode: 'copy'
+    publishDir "${params.resultsDir}", pattern: "ledger-*.json", mode: 'copy'
 
     input:
-        tuple path(config), path(csv)
+        tuple val(ids), val(protocols), path(configs, stageAs: "config?.json"), path(csvs, stageAs: "data?.csv")
         path(template_dir)
+        path(labware, stageAs: "labware/*")
 
     output:
-        path 'protocol-3.py'
+        path '*protocol-*.py', emit: protocols
+        path 'optimisation-*.json', optional: true, emit: report
+        path 'ledger-*.json', emit: ledger
 
     script:
+    def manifest = [ids, protocols, configs, csvs].transpose().collect { id, protocol, config, csv -> "${id},${protocol}-template.py,${config},${csv}" }
+    def cache = params.cache_dir ? "-c ${params.cache_dir}" : ""
+    // batches save their savings to separate reports, which would otherwise overwrite each other when published
+    def optimise = params.optimise_transfers ? "-p -R optimisation-${task.index}.json" : ""
+    def telemetry = params.telemetry ? "-t ${params.telemetry}" : ""
     """
-        protocol-compiler.py -d ${template_dir} -o protocol-3.py \
-            protocol-3-template.py ${config} ${csv}
+        mkdir -p labware
+        printf 'id,template,config,data\\n${manifest.join('\\n')}\\n' > manifest.csv
+        protocol-compiler.py batch -d ${template_dir} -O . -j ${task.cpus} -l labware -L ledger-${task.index}.json ${cache} ${telemetry} ${optimise} manifest.csv
     """
 
     stub: 
     """
-        touch protocol-3.py
+        touch ${ids.collect { "${it}.py" }.join(' ')} ledger-${task.index}.json
     """
 
 }
 
-process MAKE_PROTOCOL_4 {
+process SHARD_EXPERIMENTS {
 
-    publishDir "${params.resultsDir}", pattern: "protocol-4.py", mode: 'copy'
+    publishDir "${params.resultsDir}", pattern: "shards/shards.csv", mode: 'copy'
 
     input:
-        tuple path(config), path(csv)
-        path(template_dir)
+        tuple val(ids), path(csvs, stageAs: "data?.csv"), path(configs, stageAs: "config?.json")
+        path(labware, stageAs: "labware/*")
 
     output:
-        path 'protocol-4.py'
+        path 'shards'
 
     script:
+    def experiments = [ids, csvs, configs].transpose().collect { id, csv, config -> "${id} ${csv} ${config}" }
     """
-        protocol-compiler.py -d ${template_dir} -o protocol-4.py \
-            protocol-4-template.py ${config} ${csv}
+        mkdir -p labware
+        shard-experiment.py -O shards -n ${params.robots} -l labware ${experiments.join(' ')}
     """
 
-    stub: 
+    stub:
     """
-        touch protocol-4.py
+        mkdir shards
+        printf 'id,template,config,data,robot,rows,estimated_seconds\\n' > shards/shards.csv
     """
 }
 
-process SIMULATE_PROTOCOL_1 {
-
-    publishDir "${params.resultsDir}", pattern: "protocol-1-simulation.txt", mode: "copy"
+process MAKE_SHARDED_PROTOCOLS {
 
+    publishDir "${params.resultsDir}", pattern: "*protocol-*.py", mode: 'copy'
+    publishDir "${params.resultsDir}", pattern: "optimisation.json", mode: 'copy'
+    publishDir "${params.resultsDir}", pattern: "ledger.json", mode: 'copy'
 
     input:
-        path(protocol)
-        path(labware)
+        path(shards)
+        path(template_dir)
+        path(labware, stageAs: "labware/*")
 
     output:
-        path "protocol-1-simulation.txt"
+        path '*protocol-*.py', emit: protocols
+        path 'optimisation.json', optional: true, emit: report
+        path 'ledger.json', emit: ledger
 
     script:
+    def cache = params.cache_dir ? "-c ${params.cache_dir}" : ""
+    def optimise = params.optimise_transfers ? "-p -R optimisation.json" : ""
+    def telemetry = params.telemetry ? "-t ${params.telemetry}" : ""
     """
-        opentrons_simulate ${protocol} -L ${labware} > protocol-1-simulation.txt
+        mkdir -p labware
+        protocol-compiler.py batch -d ${template_dir} -O . -j ${task.cpus} -l labware -L ledger.json ${cache} ${telemetry} ${optimise} ${shards}/shards.csv
     """
 
-    stub: 
+    stub:
     """
-        touch protocol-1-simulation.txt
+        touch protocol-1-shard-01.py ledger.json
     """
 }
 
-process SIMULATE_PROTOCOL_2 {
+process SIMULATE_PROTOCOLS {
 
-    publishDir "${params.resultsDir}", pattern: "protocol-2-simulation.txt", mode: "copy"
+    publishDir "${params.resultsDir}", pattern: "*protocol-*-simulation.*", mode: "copy"
 
 
     input:
-        path(protocol)
-        path(labware)
+        path(protocols)
+        path(labware, stageAs: "labware/*")
 
     output:
-        path "protocol-2-simulation.txt"
+        path "*protocol-*-simulation.*"
 
     script:
+    def cache = params.cache_dir ? "-c ${params.cache_dir}" : ""
     """
-        opentrons_simulate ${protocol} -L ${labware} > protocol-2-simulation.txt
+        mkdir -p labware
+        simulate-protocol.py batch -O . ${cache} labware ${protocols}
     """
 
     stub: 
     """
-        touch protocol-2-simulation.txt
+        for protocol in ${protocols}; do
+            touch \${protocol%.py}-simulation.txt \${protocol%.py}-simulation.json \${protocol%.py}-simulation.jsonl
+        done
     """
 }
 
-process SIMULATE_PROTOCOL_3 {
-
-    publishDir "${params.resultsDir}", pattern: "protocol-3-simulation.txt", mode: "copy"
+process ESTIMATE_RUNTIME {
 
+    publishDir "${params.resultsDir}", pattern: "runtime*", mode: "copy"
 
     input:
-        path(protocol)
-        path(labware)
+        path(results)
 
     output:
-        path "protocol-3-simulation.txt"
+        path "runtime*"
 
     script:
+    def model = params.timing_model ? "-m ${params.timing_model}" : ""
     """
-        opentrons_simulate ${protocol} -L ${labware} > protocol-3-simulation.txt
+        estimate-runtime.py ${model} -o runtime.json -r runtime.txt -t runtime-timeline.txt ${results}
     """
 
-    stub: 
+    stub:
     """
-        touch protocol-3-simulation.txt
+        touch runtime.json runtime.txt runtime-timeline.txt
     """
 }
-
-process SIMULATE_PROTOCOL_4 {
-
-    publishDir "${params.resultsDir}", pattern: "protocol-4-simulation.txt", mode: "copy"
-
-
-    input:
-        path(protocol)
-        path(labware)
-
-    output:
-        path "protocol-4-simulation.txt"
-
-    script:
-    """
-        opentrons_simulate ${protocol} -L ${labware} > protocol-4-simulation.txt
-    """
-
-    stub: 
-    """
-        touch protocol-4-simulation.txt
-    """
-}
\ No newline at end of file
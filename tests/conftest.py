@@ -0,0 +1,6 @@
+"""Make the scripts and modules of bin/ importable by the tests, as they are on the PATH of the pipeline."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin"))
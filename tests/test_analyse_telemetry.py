@@ -0,0 +1,51 @@
+import importlib.util
+import os
+
+import pytest
+
+from dry_run import ProtocolContext, dry_run
+from runtime_model import load_timing_model
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LABWARE = os.path.join(ROOT, "assets", "labware")
+TESTDATA = os.path.join(ROOT, "assets", "testdata")
+
+def load_script(name):
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(ROOT, "bin", f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+protocol_compiler = load_script("protocol-compiler")
+simulate_protocol = load_script("simulate-protocol")
+analyse_telemetry = load_script("analyse-telemetry")
+
+def test_telemetry_of_a_run_is_compared_with_its_simulation(tmp_path, monkeypatch):
+    protocol_compiler.init_compiler(os.path.join(ROOT, "assets", "protocols"), labware_dir=LABWARE)
+    protocol_file = str(tmp_path / "test-protocol-3.py")
+    protocol_compiler.compile_protocol("protocol-3-template.py", os.path.join(TESTDATA, "protocol-3-config.json"),
+                                       os.path.join(TESTDATA, "protocol-3-data.csv"), protocol_file, telemetry_dir=str(tmp_path / "robot"))
+    _, records = simulate_protocol.run_simulation(protocol_file, LABWARE)
+    assert not (tmp_path / "robot").exists()
+
+    # run the protocol as on the robot, with the dry run
+    monkeypatch.setattr(ProtocolContext, "is_simulating", lambda self: False)
+    dry_run(protocol_file, LABWARE)
+    telemetry_file, = (tmp_path / "robot").iterdir()
+    run = analyse_telemetry.read_telemetry(str(telemetry_file))
+    assert run["protocol"] == "test-protocol-3" and run["complete"]
+    assert [section["section"] for section in run["sections"]][0] == "setup" and len(run["sections"]) > 1
+
+    # time each transfer pass as estimated, so that the calibration keeps the timing model
+    model = load_timing_model()
+    estimates = analyse_telemetry.section_estimates(records, model, [section["section"] for section in run["sections"]])
+    for section in run["sections"]:
+        for step_pass in section["passes"]:
+            step_pass["seconds"] = estimates[section["section"]]["passes"][step_pass["pipette"]]["seconds"]
+    analysis = analyse_telemetry.analyse_run(run, records, model)
+    assert [section["name"] for section in analysis["sections"]] == [section["section"] for section in run["sections"]]
+    assert analysis["estimated_seconds"] > 0
+    assert sum(len(section["passes"]) for section in analysis["sections"]) > 0
+    ratios = analyse_telemetry.calibrate(model, [analysis])
+    assert ratios and all(ratio == pytest.approx(1.0) for ratio in ratios.values())
+    assert "test-protocol-3" in analyse_telemetry.format_report({"test-protocol-3": analysis})
@@ -0,0 +1,48 @@
+import importlib.util
+import json
+import os
+import time
+
+from content_cache import ContentCache, hash_content
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTDATA = os.path.join(ROOT, "assets", "testdata")
+
+spec = importlib.util.spec_from_file_location("protocol_compiler", os.path.join(ROOT, "bin", "protocol-compiler.py"))
+protocol_compiler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(protocol_compiler)
+
+def test_hit_miss_and_eviction(tmp_path):
+    cache = ContentCache(str(tmp_path), "test", max_bytes=10)
+    assert cache.get(hash_content("a")) is None
+    cache.put(hash_content("a"), b"123456")
+    cache.put(hash_content("b"), b"123456")
+    # the entry read last is kept when the cache grows above its size
+    os.utime(cache._path(hash_content("a")), (time.time() - 60, time.time() - 60))
+    assert cache.get(hash_content("b")) == b"123456"
+    assert cache.evict() == 1
+    assert cache.get(hash_content("a")) is None and cache.get(hash_content("b")) == b"123456"
+    assert cache.stats == {"hits": 2, "misses": 2, "evictions": 1}
+    assert cache.save_stats() == cache.save_stats({}) == {"hits": 2, "misses": 2, "evictions": 1}
+
+def compile_protocol(tmp_path, name):
+    return protocol_compiler.compile_protocol("protocol-1-template.py", os.path.join(TESTDATA, "protocol-1-config.json"),
+                                              os.path.join(TESTDATA, "protocol-1-data.csv"), str(tmp_path / name), optimise=True)
+
+def test_compile_cache_round_trip(tmp_path):
+    protocol_compiler.init_compiler(os.path.join(ROOT, "assets", "protocols"), str(tmp_path / "cache"),
+                                    labware_dir=os.path.join(ROOT, "assets", "labware"))
+    compiled = compile_protocol(tmp_path, "compiled.py")
+    cached = compile_protocol(tmp_path, "cached.py")
+    assert not compiled[0] and cached[0]
+    assert compiled[1:] == cached[1:] and compiled[1] is not None and compiled[2] is not None
+    assert (tmp_path / "compiled.py").read_text() == (tmp_path / "cached.py").read_text()
+
+    # an entry missing its ledger is compiled again
+    entries = [entry for entry in (tmp_path / "cache" / "protocols").rglob("*") if entry.is_file() and entry.name != "stats.json"]
+    assert len(entries) == 1
+    entry = json.loads(entries[0].read_text())
+    del entry["ledger"]
+    entries[0].write_text(json.dumps(entry))
+    recompiled = compile_protocol(tmp_path, "recompiled.py")
+    assert not recompiled[0] and recompiled[1:] == compiled[1:]
@@ -0,0 +1,58 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTDATA = os.path.join(ROOT, "assets", "testdata")
+# labware tables of the test experiments written by the row-wise create-labware.py
+BASELINE = os.path.join(ROOT, "tests", "data")
+PROTOCOLS = ["protocol-1", "protocol-2", "protocol-3", "protocol-4"]
+
+spec = importlib.util.spec_from_file_location("create_labware", os.path.join(ROOT, "bin", "create-labware.py"))
+create_labware = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(create_labware)
+
+def build_labware(protocol):
+    with open(os.path.join(TESTDATA, f"{protocol}-config.json")) as f:
+        params = json.load(f)
+    return create_labware.build_labware(pd.read_csv(os.path.join(TESTDATA, f"{protocol}-data.csv")), params, protocol)
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def test_labware_csv_matches_the_baseline(tmp_path, protocol):
+    output_file = tmp_path / "labware.csv"
+    create_labware.save_labware(build_labware(protocol), str(output_file))
+    with open(os.path.join(BASELINE, f"{protocol}-labware.csv"), "rb") as f:
+        assert output_file.read_bytes() == f.read()
+
+@pytest.mark.parametrize("output_format", ["parquet", "feather"])
+def test_columnar_labware_matches_the_csv(tmp_path, output_format):
+    output_file = tmp_path / f"labware.{output_format}"
+    create_labware.save_labware(build_labware("protocol-1"), str(output_file), output_format)
+    expected = pd.read_csv(os.path.join(BASELINE, "protocol-1-labware.csv"), dtype={"location": str})
+    pd.testing.assert_frame_equal(getattr(pd, f"read_{output_format}")(output_file), expected)
+
+def test_batch_builds_every_protocol_in_one_run(tmp_path):
+    args = [arg for protocol in PROTOCOLS for arg in
+            (f"test-{protocol}", os.path.join(TESTDATA, f"{protocol}-data.csv"), os.path.join(TESTDATA, f"{protocol}-config.json"))]
+    subprocess.run([sys.executable, os.path.join(ROOT, "bin", "create-labware.py"), "batch", "-O", str(tmp_path), *args], check=True)
+    for protocol in PROTOCOLS:
+        with open(os.path.join(BASELINE, f"{protocol}-labware.csv"), "rb") as f:
+            assert (tmp_path / f"test-{protocol}-labware.csv").read_bytes() == f.read()
+
+def test_shared_files_are_read_once(monkeypatch):
+    reads = []
+    read_csv = pd.read_csv
+    def counting_read_csv(path, *args, **kwargs):
+        reads.append(path)
+        return read_csv(path, *args, **kwargs)
+    monkeypatch.setattr(pd, "read_csv", counting_read_csv)
+    data, config = os.path.join(TESTDATA, "protocol-2-data.csv"), os.path.join(TESTDATA, "protocol-2-config.json")
+    labware = create_labware.build_all_labware([{"id": id, "protocol": "protocol-2", "data": data, "config": config}
+                                                for id in ["a-protocol-2", "b-protocol-2"]])
+    assert reads == [data]
+    pd.testing.assert_frame_equal(labware["a-protocol-2"], labware["b-protocol-2"])
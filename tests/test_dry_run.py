@@ -0,0 +1,44 @@
+import importlib.util
+import os
+
+import pytest
+
+from dry_run import DryRunError, dry_run, format_records, summarise
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LABWARE = os.path.join(ROOT, "assets", "labware")
+TESTDATA = os.path.join(ROOT, "assets", "testdata")
+
+def load_script(name):
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(ROOT, "bin", f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+protocol_compiler = load_script("protocol-compiler")
+simulate_protocol = load_script("simulate-protocol")
+
+def compile_protocol(tmp_path, protocol):
+    protocol_compiler.init_compiler(os.path.join(ROOT, "assets", "protocols"), labware_dir=LABWARE)
+    protocol_file = str(tmp_path / f"{protocol}.py")
+    protocol_compiler.compile_protocol(f"{protocol}-template.py", os.path.join(TESTDATA, f"{protocol}-config.json"),
+                                       os.path.join(TESTDATA, f"{protocol}-data.csv"), protocol_file)
+    return protocol_file
+
+@pytest.mark.filterwarnings("ignore:Destination columns")
+@pytest.mark.parametrize("protocol", ["protocol-1", "protocol-2", "protocol-3", "protocol-4"])
+def test_dry_run_log_matches_the_simulation(tmp_path, protocol):
+    protocol_file = compile_protocol(tmp_path, protocol)
+    context = dry_run(protocol_file, LABWARE)
+    text, _ = simulate_protocol.run_simulation(protocol_file, LABWARE)
+    assert format_records(context.records) == text
+
+    summary = summarise(context)
+    assert sum(tips["pick_ups"] for tips in summary["tips"].values()) == text.count("Picking up tip")
+    assert all(tips["tips"] <= tips["available"] for tips in summary["tips"].values())
+
+def test_failing_protocol_reports_the_commands_run(tmp_path):
+    protocol_file = tmp_path / "protocol.py"
+    protocol_file.write_text("def run(protocol):\n    protocol.comment('started')\n    raise RuntimeError('out of tips')\n")
+    with pytest.raises(DryRunError, match="RuntimeError: out of tips after 1 commands"):
+        dry_run(str(protocol_file), LABWARE)
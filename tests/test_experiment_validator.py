@@ -0,0 +1,28 @@
+import csv
+import json
+import os
+
+import experiment_validator
+
+TESTDATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "testdata")
+
+def load_experiment(protocol):
+    with open(os.path.join(TESTDATA, f"{protocol}-config.json")) as f:
+        params = json.load(f)
+    with open(os.path.join(TESTDATA, f"{protocol}-data.csv"), newline="") as f:
+        return params, list(csv.DictReader(f))
+
+def test_dna_aspiration_exceeding_the_selected_pipette():
+    params, rows = load_experiment("protocol-1")
+    assert experiment_validator.check_pipettes("protocol-1", params, rows) == []
+    rows[1]["dna_volume"] = "40"
+    errors = experiment_validator.check_pipettes("protocol-1", params, rows)
+    assert len(errors) == 1 and errors[0].startswith("Line 3: dna_volume 40 exceeds the 20 uL of p20_multi_gen2")
+
+def test_every_error_of_a_row_outside_the_agar_plates():
+    params, rows = load_experiment("protocol-2")
+    rows[0].update(agar_plate_location="5", destination_well="Z9")
+    labware_dir = os.path.join(os.path.dirname(TESTDATA), "labware")
+    errors = experiment_validator.check_wells("protocol-2", params, rows, labware_dir)
+    assert any(error.startswith("Line 2: agar_plate_location 5 is not in agar_plate_slot") for error in errors)
+    assert any(error.startswith("Line 2: well Z9 of destination_well does not exist") for error in errors)
@@ -0,0 +1,22 @@
+import importlib.util
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+spec = importlib.util.spec_from_file_location("plot_labware", os.path.join(ROOT, "bin", "plot-labware.py"))
+plot_labware = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(plot_labware)
+
+def test_plates_of_a_location_are_split_by_labware(tmp_path):
+    csv_file = tmp_path / "labware.csv"
+    csv_file.write_text("id,location,labware,well_name,volume\n"
+                        "a,1,plate_a,A1,10\nb,1,plate_b,A1,20\nc,2,plate_a,A1,30\nd,1,plate_a,B1,40\n")
+    plates = plot_labware.split_plates(str(csv_file))
+    assert list(plates) == [("1", "plate_a"), ("1", "plate_b"), ("2", "plate_a")]
+    assert [row["id"] for row in plates[("1", "plate_a")]] == ["a", "d"]
+
+    labware_dir = str(tmp_path)
+    keys = {plot_labware.plate_key(plate, rows, labware_dir) for plate, rows in plates.items()}
+    assert len(keys) == 3
+    names = [plot_labware.plot_name(index, plate) for index, plate in enumerate(plates, start=1)]
+    assert names == ["01-slot-1-plate_a-labware.png", "02-slot-1-plate_b-labware.png", "03-slot-2-plate_a-labware.png"]
@@ -0,0 +1,46 @@
+import importlib.util
+import os
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MARKDOWN = os.path.join(ROOT, "assets", "instructions", "protocol-1-instructions.Rmd")
+CONFIG = os.path.join(ROOT, "assets", "testdata", "protocol-1-config.json")
+
+spec = importlib.util.spec_from_file_location("render_instructions", os.path.join(ROOT, "bin", "render-instructions.py"))
+render_instructions = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(render_instructions)
+
+def plots(tmp_path):
+    plots_dir = tmp_path / "plots"
+    plots_dir.mkdir()
+    (plots_dir / "01-slot-1-plate-labware.png").write_bytes(b"plate")
+    return str(plots_dir)
+
+def test_instructions_key_changes_with_their_inputs(tmp_path):
+    plots_dir = plots(tmp_path)
+    key = render_instructions.instructions_key(MARKDOWN, CONFIG, plots_dir, "pdf")
+    assert render_instructions.instructions_key(MARKDOWN, CONFIG, plots_dir, "pdf") == key
+    assert render_instructions.instructions_key(MARKDOWN, CONFIG, plots_dir, "html") != key
+
+    (tmp_path / "plots" / "01-slot-1-plate-labware.png").write_bytes(b"edited plate")
+    edited = render_instructions.instructions_key(MARKDOWN, CONFIG, plots_dir, "pdf")
+    assert edited != key
+    shutil.move(tmp_path / "plots" / "01-slot-1-plate-labware.png", tmp_path / "plots" / "01-slot-2-plate-labware.png")
+    assert render_instructions.instructions_key(MARKDOWN, CONFIG, plots_dir, "pdf") not in (key, edited)
+
+def test_unchanged_instructions_are_not_rendered_again(tmp_path, monkeypatch):
+    rendered = []
+    def render(markdown_file, json_file, plots_dir, output_format, out_file):
+        rendered.append(out_file)
+        with open(out_file, "w") as f:
+            f.write(f"<html>{len(rendered)}</html>")
+    monkeypatch.setattr(render_instructions, "render", render)
+
+    plots_dir = plots(tmp_path)
+    for name in ["rendered.html", "cached.html"]:
+        monkeypatch.setattr(sys, "argv", ["render-instructions.py", "-f", "html", "-o", str(tmp_path / name),
+                                          "-c", str(tmp_path / "cache"), MARKDOWN, CONFIG, plots_dir])
+        render_instructions.main()
+    assert rendered == [str(tmp_path / "rendered.html")]
+    assert (tmp_path / "cached.html").read_text() == (tmp_path / "rendered.html").read_text()
@@ -0,0 +1,57 @@
+import importlib.util
+import json
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTDATA = os.path.join(ROOT, "assets", "testdata")
+
+spec = importlib.util.spec_from_file_location("shard_experiment", os.path.join(ROOT, "bin", "shard-experiment.py"))
+shard_experiment = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(shard_experiment)
+
+def spotting_rows(locations, columns):
+    return [{"id": f"x{location}{row}{column}", "agar_plate_location": str(location), "source_well": f"{row}{column}",
+             "destination_well": f"{row}{column}", "spotting_volume": "5"}
+            for location in locations for column in columns for row in "ABCDEFGH"]
+
+def test_columns_out_of_order_are_kept_together():
+    rows = spotting_rows([2], [1, 2])
+    rows = rows[::2] + rows[1::2]
+    units = shard_experiment.column_units("protocol-2", rows)
+    assert [sorted(rows[index]["destination_well"] for index in unit) for unit in units] == [
+        [f"{row}{column}" for row in "ABCDEFGH"] for column in [1, 2]]
+
+def test_agar_plates_beyond_the_deck_are_moved_to_free_slots():
+    with open(os.path.join(TESTDATA, "protocol-2-config.json")) as f:
+        params = json.load(f)
+    plates = list(range(1, 16))
+    params.update(agar_plate_slot=plates, empty_agar_plate_weight=[38.0 + plate for plate in plates], agar_plate_weight=[68.35] * 15)
+    rows = spotting_rows(plates, [1])
+
+    free = shard_experiment.agar_slots(params)
+    shards = shard_experiment.shard_rows("protocol-2", params, rows)
+    assert sorted(index for shard in shards for index in shard) == list(range(len(rows)))
+    for indexes in shards:
+        shard_params, shard_rows = shard_experiment.place_plates("protocol-2", params, [rows[index] for index in indexes])
+        shard_plates = sorted({int(rows[index]["agar_plate_location"]) for index in indexes})
+        assert set(shard_params["agar_plate_slot"]) <= set(free)
+        assert shard_params["empty_agar_plate_weight"] == [38.0 + plate for plate in shard_plates]
+        for index, row in zip(indexes, shard_rows):
+            plate = shard_plates.index(int(rows[index]["agar_plate_location"]))
+            assert int(row["agar_plate_location"]) == shard_params["agar_plate_slot"][plate]
+
+@pytest.mark.filterwarnings("ignore:Destination columns")
+def test_tips_of_columns_add_up_to_the_tips_of_the_experiment():
+    labware_dir = os.path.join(ROOT, "assets", "labware")
+    # the pipettes of protocol-1 are selected over all rows, so its shards are also planned in full
+    for protocol in ["protocol-3", "protocol-4"]:
+        with open(os.path.join(TESTDATA, f"{protocol}-config.json")) as f:
+            params = json.load(f)
+        _, rows = shard_experiment.read_experiment(os.path.join(TESTDATA, f"{protocol}-data.csv"))
+        tips = {}
+        for unit in shard_experiment.column_units(protocol, rows):
+            unit_tips, _ = shard_experiment.plan_usage(protocol, params, shard_experiment.parse_rows([rows[index] for index in unit]), labware_dir)
+            tips = shard_experiment.add_tips(protocol, tips, unit_tips)
+        assert tips == shard_experiment.plan_usage(protocol, params, shard_experiment.parse_rows(rows), labware_dir)[0]
@@ -0,0 +1,34 @@
+import importlib.util
+import os
+
+from content_cache import ContentCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LABWARE = os.path.join(ROOT, "assets", "labware")
+TESTDATA = os.path.join(ROOT, "assets", "testdata")
+
+def load_script(name):
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(ROOT, "bin", f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+protocol_compiler = load_script("protocol-compiler")
+simulate_protocol = load_script("simulate-protocol")
+
+def test_simulation_cache_round_trip(tmp_path):
+    protocol_compiler.init_compiler(os.path.join(ROOT, "assets", "protocols"), labware_dir=LABWARE)
+    protocol_file = str(tmp_path / "protocol-2.py")
+    protocol_compiler.compile_protocol("protocol-2-template.py", os.path.join(TESTDATA, "protocol-2-config.json"),
+                                       os.path.join(TESTDATA, "protocol-2-data.csv"), protocol_file)
+    cache = ContentCache(str(tmp_path / "cache"), "simulations", 512 * 1024 * 1024)
+
+    text, results, cached = simulate_protocol.simulate_protocol(protocol_file, LABWARE, cache)
+    assert not cached and results
+    assert simulate_protocol.simulate_protocol(protocol_file, LABWARE, cache) == (text, results, True)
+
+    # an edited protocol is simulated again
+    with open(protocol_file, "a") as f:
+        f.write("\n# edited\n")
+    assert simulate_protocol.simulate_protocol(protocol_file, LABWARE, cache) == (text, results, False)
+    assert cache.stats == {"hits": 1, "misses": 2, "evictions": 0}
@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+import step_plan
+
+TESTDATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "testdata")
+PROTOCOL_1_COLUMNS = "dna_id,dna_well,dna_volume,cells_id,cells_well,cells_volume,media_id,media_well,media_volume,destination_well"
+
+def protocol_1_params():
+    with open(os.path.join(TESTDATA, "protocol-1-config.json")) as f:
+        return json.load(f)
+
+def test_partial_column_without_row_a():
+    csv_content = "\n".join([PROTOCOL_1_COLUMNS,
+                             "pEX02,B1,1,DH5a,B2,10,SOC,B1,50,B1",
+                             "pEX03,C1,1,DH5a,C2,10,SOC,C1,50,C1"])
+    with pytest.warns(step_plan.PlanWarning):
+        plan = step_plan.build_plan("protocol-1", protocol_1_params(), csv_content)
+    # 8-channel transfers are moved to row A and mixed with the cells of the first well of their column
+    assert plan["dna"]["transfers"] == (("A1", 1.0, "A1", 5.5),)
+    assert plan["media"]["transfers"] == (("A1", 50.0, "A1", 30.0),)
+
+def write_plate(labware_dir, name, rows, columns):
+    wells = {f"{chr(ord('A') + row)}{column + 1}": {"x": 0, "y": 0, "z": 0, "depth": 10, "totalLiquidVolume": 100}
+             for row in range(rows) for column in range(columns)}
+    with open(labware_dir / f"{name}.json", "w") as f:
+        json.dump({"dimensions": {"xDimension": 127.76, "yDimension": 85.48, "zDimension": 14}, "wells": wells}, f)
+
+def test_channel_rows_of_384_well_plates(tmp_path):
+    write_plate(tmp_path, "plate_96", 8, 12)
+    write_plate(tmp_path, "plate_384", 16, 24)
+    assert step_plan.channel_rows(str(tmp_path), "plate_96", "plate_96") == "ABCDEFGH"
+    assert step_plan.channel_rows(str(tmp_path), "plate_384", "plate_384") == "ACEGIKMO"
+    assert step_plan.channel_rows(str(tmp_path), "plate_96", "plate_384") is None
+
+def test_batch_columns_of_384_well_plates():
+    reached = [(f"{row}3", 5.0, f"{row}1", None) for row in "ACEGIKMO"]
+    columns, wells = step_plan.batch_columns(reached, "ACEGIKMO")
+    assert columns == [("A3", 5.0, "A1", None)] and wells == []
+    # rows A to H of a 384-well plate are not reached at once by an 8-channel pipette
+    adjacent = [(f"{row}3", 5.0, f"{row}1", None) for row in "ABCDEFGH"]
+    assert step_plan.batch_columns(adjacent, "ACEGIKMO") == ([], adjacent)
+
+def staging_experiment(media_rows):
+    params = {**protocol_1_params(), "right_pipette_name": "p300_single_gen2", "right_pipette_tiprack_name": "opentrons_96_tiprack_300ul",
+              "media_staging_plate_name": "usascientific_96_wellplate_2.4ml_deep", "media_staging_plate_slot": 3}
+    csv_content = "\n".join([PROTOCOL_1_COLUMNS] + [f"pEX0{i},{row}1,25,DH5a,{row}2,30,SOC,{media_row}1,50,{row}1"
+                                                    for i, (row, media_row) in enumerate(zip("ABCDEFGH", media_rows))])
+    return params, csv_content
+
+def test_media_is_staged_when_it_saves_time():
+    # media wells out of order with the destination wells are only batched once staged in the destination wells
+    plan = step_plan.build_plan("protocol-1", *staging_experiment("HGFEDCBA"))
+    assert "media" not in plan and plan["staged_media"]["transfers"] == (("A1", 50.0, "A1", 40.0),)
+
+def test_media_staging_is_skipped_when_it_saves_no_time():
+    with pytest.warns(step_plan.PlanWarning, match="Recovery media is not staged"):
+        plan = step_plan.build_plan("protocol-1", *staging_experiment("ABCDEFGH"))
+    assert "media" in plan and "media_staging" not in plan and "staged_media" not in plan
@@ -0,0 +1,47 @@
+import importlib.util
+import json
+import os
+import warnings
+
+import pytest
+
+import step_plan
+import transfer_optimiser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTDATA = os.path.join(ROOT, "assets", "testdata")
+LABWARE = os.path.join(ROOT, "assets", "labware")
+METRICS = ["tips", "aspirations", "travel_mm", "seconds"]
+
+# synthetic experiments of the pipeline benchmark, for every protocol, plate and pipette layout
+spec = importlib.util.spec_from_file_location("benchmark_pipeline", os.path.join(ROOT, "bin", "benchmark-pipeline.py"))
+benchmark = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(benchmark)
+
+def experiments():
+    for protocol in step_plan.PLANNERS:
+        config, data = os.path.join(TESTDATA, f"{protocol}-config.json"), os.path.join(TESTDATA, f"{protocol}-data.csv")
+        with open(config) as f, open(data) as g:
+            yield pytest.param(protocol, json.load(f), g.read(), id=f"test-{protocol}")
+        for wells in [96, 384]:
+            for layout in benchmark.LAYOUTS:
+                params, rows = benchmark.GENERATORS[protocol](wells, layout)
+                csv_content = "\n".join([",".join(rows[0])] + [",".join(str(value) for value in row.values()) for row in rows])
+                yield pytest.param(protocol, params, csv_content, id=f"{layout}-{wells}-{protocol}")
+
+@pytest.mark.parametrize("protocol, params, csv_content", list(experiments()))
+def test_savings_are_never_negative(protocol, params, csv_content):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", step_plan.PlanWarning)
+        plan = step_plan.build_plan(protocol, params, csv_content, LABWARE)
+    _, report = transfer_optimiser.optimise_plan(protocol, params, plan)
+    for step in report["steps"].values():
+        assert all(step["after"][metric] <= step["before"][metric] for metric in METRICS)
+    assert all(report["saved"][metric] >= 0 for metric in METRICS)
+
+def test_well_positions_of_384_well_plates():
+    labware = transfer_optimiser.labware_definition(LABWARE, "corning_384_wellplate_112ul_flat")
+    x, y = transfer_optimiser.well_position(1, "P24", labware)
+    assert 0 < x < labware.dimensions["xDimension"] and 0 < y < labware.dimensions["yDimension"]
+    # wells of labware without a definition are positioned as on a 96-well plate
+    assert transfer_optimiser.well_position(1, "A1") == transfer_optimiser.A1_OFFSET